@@ -1,11 +1,16 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
 from datetime import datetime, timedelta, date
 import calendar
-import io
+from collections import OrderedDict
 import plotly.graph_objects as go
-from backlog import check_stock_availability, update_stock_status
+from filters import ORDER_FILTERS, custom_order_mask, select, until_day, within_days
+from cube import AVAILABLE_ORDER_TYPES, BUCKET_LABELS, availability_series, build_cube, cube_by, cube_totals
+from ingestion import input_digests, load_workbooks, cached_result, cached_export
+from pipeline import run_pipeline, REFERENCE_FILES
+from profiling import record_stages, stage, timings_to_json
+from report import EXCEL_MAX_ROWS, EXPORT_FORMATS, export_report, report_tables
+from reference_store import latest_reference_digests, resolve_references
 
 # Configuration des couleurs et du thème
 COLORS = {
@@ -225,30 +230,6 @@ MOIS_FR = {
 def format_currency(value):
     return f"{value:,.2f} €"
 
-def apply_filter(merged_df, filter_type):
-    """
-    Applique le filtre sélectionné sur le DataFrame
-    """
-    if filter_type == "Toutes les commandes":
-        return merged_df
-    
-    elif filter_type == "Commandes avec matériel BUY":
-        # Récupérer les Sales Documents qui contiennent au moins un matériel de type BUY
-        sales_docs_with_buy = merged_df[merged_df['Type'] == 'BUY']['Sales Document'].unique()
-        return merged_df[merged_df['Sales Document'].isin(sales_docs_with_buy)]
-    
-    elif filter_type == "Commandes avec matériel SECUROC":
-        # Récupérer les Sales Documents qui contiennent au moins un matériel de type SECUROC
-        sales_docs_with_securoc = merged_df[merged_df['Type'] == 'SECUROC']['Sales Document'].unique()
-        return merged_df[merged_df['Sales Document'].isin(sales_docs_with_securoc)]
-    
-    elif filter_type == "Commandes avec produit INSTAL (Y5010646)":
-        # Récupérer les Sales Documents qui contiennent le produit Y5010646
-        sales_docs_with_instal = merged_df[merged_df['Y Material'] == 'Y5010646']['Sales Document'].unique()
-        return merged_df[merged_df['Sales Document'].isin(sales_docs_with_instal)]
-    
-    return merged_df
-
 def display_main_filter():
     """
     Affiche le filtre principal en haut à gauche de la page
@@ -267,12 +248,7 @@ def display_main_filter():
         ">
         """, unsafe_allow_html=True)
         
-        filter_options = [
-            "Toutes les commandes",
-            "Commandes avec matériel BUY", 
-            "Commandes avec matériel SECUROC",
-            "Commandes avec produit INSTAL (Y5010646)"
-        ]
+        filter_options = list(ORDER_FILTERS)
         
         # Initialiser le filtre dans session_state s'il n'existe pas
         if 'main_filter' not in st.session_state:
@@ -293,6 +269,40 @@ def display_main_filter():
     
     return selected_filter
 
+def split_materials(text):
+    """
+    Liste de matériels saisie librement (séparés par des espaces, virgules, points-virgules ou retours à la ligne)
+    """
+    return [material for material in text.replace(',', ' ').replace(';', ' ').split() if material]
+
+def display_custom_filter(filter_index):
+    """
+    Affiche le filtre personnalisé (MRP Controller, matériels, plages de dates) dans la barre latérale.
+    Retourne les critères renseignés, à passer à custom_order_mask (dict vide si aucun).
+    """
+    criteria = {}
+    with st.sidebar.expander("🔧 Filtre personnalisé"):
+        mrp_controllers = st.multiselect(
+            "MRP Controller", list(filter_index['mrp_controllers']), key="custom_mrp_controllers"
+        )
+        materials = split_materials(st.text_area(
+            "Matériels (Y Material)", key="custom_materials",
+            help="Séparés par des espaces, virgules ou retours à la ligne"
+        ))
+        created = st.date_input("Date de création", value=(), key="custom_created", format="DD/MM/YYYY")
+        delivered = st.date_input("Dernière date de livraison", value=(), key="custom_delivered", format="DD/MM/YYYY")
+
+    if mrp_controllers:
+        criteria['mrp_controllers'] = mrp_controllers
+    if materials:
+        criteria['materials'] = materials
+    # Une plage n'est prise en compte qu'une fois ses deux bornes choisies
+    if len(created) == 2:
+        criteria['created'] = created
+    if len(delivered) == 2:
+        criteria['delivered'] = delivered
+    return criteria
+
 # Fonction pour créer un badge HTML coloré selon le type de commande
 def get_order_type_badge(order_type):
     if order_type == "Dispo":
@@ -307,41 +317,22 @@ def get_order_type_badge(order_type):
         return f'<span class="badge badge-completed">Completed</span>'
     return order_type
 
-def create_order_metrics(merged_df):
+def create_order_metrics(cube):
     st.markdown('<div class="section-container order-metrics-section">', unsafe_allow_html=True)
     st.markdown("### 📊 Résumé des commandes", unsafe_allow_html=True)
     
-    # Calcul des métriques
-    total_orders = len(merged_df['Sales Document'].unique())
-    total_value_all = merged_df['Open Value'].sum()
+    # Calcul des métriques (lectures dans le cube des indicateurs)
+    total_orders, total_value_all = cube_totals(cube)
     
     # Calcul du nombre et de la valeur des commandes dispo jusqu'à la fin du mois en cours
     today = date.today()
     last_day_of_month = (date(today.year, today.month + 1, 1) if today.month < 12 else date(today.year + 1, 1, 1)) - timedelta(days=1)
     
-    # Commandes dispo et potentiellement dispo jusqu'à la fin du mois en cours
-    current_month_available = merged_df[
-        ((merged_df['Order_Type'] == 'Dispo') | (merged_df['Order_Type'] == 'Potentiellement dispo')) & 
-        (pd.to_datetime(merged_df['Last_Delivery_Date']).dt.date <= last_day_of_month)
-    ]
-
-    # Nombre de commandes uniques pour le mois en cours
-    current_month_available_count = len(current_month_available['Sales Document'].unique())
-
-    # Valeur totale pour le mois en cours
-    current_month_available_value = current_month_available['Open Value'].sum()
-    
-    # Commandes dispo et potentiellement dispo jusqu'à aujourd'hui
-    today_available = merged_df[
-        ((merged_df['Order_Type'] == 'Dispo') | (merged_df['Order_Type'] == 'Potentiellement dispo')) & 
-        (pd.to_datetime(merged_df['Last_Delivery_Date']).dt.date <= today)
-    ]
+    # Nombre et valeur des commandes dispo et potentiellement dispo jusqu'à la fin du mois en cours
+    current_month_available_count, current_month_available_value = cube_totals(cube, available=True, until=last_day_of_month)
     
-    # Nombre de commandes uniques jusqu'à aujourd'hui
-    today_available_count = len(today_available['Sales Document'].unique())
-    
-    # Valeur totale jusqu'à aujourd'hui
-    today_available_value = today_available['Open Value'].sum()
+    # Nombre et valeur des commandes dispo et potentiellement dispo jusqu'à aujourd'hui
+    today_available_count, today_available_value = cube_totals(cube, available=True, until=today)
     
     # Afficher les métriques principales avec HTML personnalisé pour éviter le décalage
     st.markdown('<div class="metric-container">', unsafe_allow_html=True)
@@ -374,19 +365,20 @@ def create_order_metrics(merged_df):
     
     # Métriques par type de commande avec styles améliorés
     order_types = {
-        'Completed': merged_df[merged_df['Order_Type'] == 'Completed'],
-        'Dispo': merged_df[merged_df['Order_Type'] == 'Dispo'],
-        'Potentiellement dispo': merged_df[merged_df['Order_Type'] == 'Potentiellement dispo'],
-        'No Dispo': merged_df[merged_df['Order_Type'] == 'No dispo'],
-        'Block': merged_df[merged_df['Order_Type'] == 'Block']
+        'Completed': 'Completed',
+        'Dispo': 'Dispo',
+        'Potentiellement dispo': 'Potentiellement dispo',
+        'No Dispo': 'No dispo',
+        'Block': 'Block'
     }
+    by_type = cube_by(cube, ['Order_Type']).set_index('Order_Type').reindex(list(order_types.values()), fill_value=0)
     
     st.markdown('<div class="metric-container">', unsafe_allow_html=True)
     cols = st.columns(5)
-    for i, (type_name, orders) in enumerate(order_types.items()):
+    for i, (type_name, order_type) in enumerate(order_types.items()):
         with cols[i]:
-            unique_orders = len(orders['Sales Document'].unique())
-            total_value = orders['Open Value'].sum()
+            unique_orders = int(by_type.at[order_type, 'Orders'])
+            total_value = by_type.at[order_type, 'Value']
             
             # Afficher le badge directement avec st.markdown pour un meilleur positionnement
             badge_label = "Pot. dispo" if type_name == "Potentiellement dispo" else type_name.replace("No Dispo", "No dispo")
@@ -414,38 +406,42 @@ def create_order_metrics(merged_df):
     st.markdown('</div>', unsafe_allow_html=True)
     st.markdown('</div>', unsafe_allow_html=True)
 
-def plot_dispo_orders(merged_df):
-    # Inclure à la fois les commandes dispo et potentiellement dispo
-    dispo_orders = merged_df[(merged_df['Order_Type'] == 'Dispo') | (merged_df['Order_Type'] == 'Potentiellement dispo')]
-    
-    daily_orders = (
-        dispo_orders.groupby(['Last_Delivery_Date', 'Sales Document', 'Order_Type'])
-        .size()
-        .reset_index()
-    )
-    
-    # Créer un dataframe pour le graphique
-    daily_summary = daily_orders.groupby(['Last_Delivery_Date', 'Order_Type']).size().reset_index()
-    daily_summary.columns = ['Date', 'Type de commande', 'Nombre de commandes']
-    
+# Nombre maximal de graphiques gardés en session (voir cached_figure)
+MAX_CACHED_FIGURES = 16
+
+def availability_traces(series, measure, label, value_format):
+    """
+    Courbes WebGL (une par type de commande) d'une série calculée par availability_series
+    """
     # Créer le graphique avec des couleurs améliorées
     color_map = {
         'Dispo': COLORS["secondary"],
         'Potentiellement dispo': COLORS["warning"]
     }
+    traces = []
+    for order_type in AVAILABLE_ORDER_TYPES:
+        points = series[series['Order_Type'] == order_type]
+        if len(points) == 0:
+            continue
+        traces.append(go.Scattergl(
+            x=points['Date'],
+            y=points[measure],
+            mode='lines+markers',
+            name=order_type,
+            line=dict(color=color_map[order_type]),
+            hovertemplate=f"Type de commande={order_type}<br>Date=%{{x}}<br>{label}=%{{y:{value_format}}}<extra></extra>"
+        ))
+    return traces
+
+def plot_dispo_orders(cube):
+    # Inclure à la fois les commandes dispo et potentiellement dispo
+    # Nombre de commandes par période et type, en une agrégation du cube (jour, semaine ou mois selon l'étendue)
+    series, bucket = availability_series(cube, 'Orders')
     
-    fig = px.line(
-        daily_summary, 
-        x='Date', 
-        y='Nombre de commandes', 
-        color='Type de commande',
-        title="Répartition des commandes Dispo et Potentiellement dispo par Date de Disponibilité", 
-        markers=True,
-        color_discrete_map=color_map
-    )
+    fig = go.Figure(availability_traces(series, 'Orders', 'Nombre de commandes', 'd'))
     
     fig.update_layout(
-        xaxis_title="Date de Disponibilité",
+        xaxis_title=f"Date de Disponibilité (par {BUCKET_LABELS[bucket]})",
         yaxis_title="Nombre de commandes",
         plot_bgcolor=COLORS["background"],
         paper_bgcolor=COLORS["background"],
@@ -458,6 +454,7 @@ def plot_dispo_orders(merged_df):
             'yanchor': 'top',
             'font': dict(color=COLORS["primary"], size=16)  # Couleur et taille pour le titre
         },
+        legend_title_text="Type de commande",
         legend_title_font=dict(color=COLORS["primary"]),
         legend=dict(
             bgcolor=COLORS["background"],
@@ -468,37 +465,15 @@ def plot_dispo_orders(merged_df):
     
     return fig
 
-def plot_dispo_orders_value(merged_df):
+def plot_dispo_orders_value(cube):
     # Inclure à la fois les commandes dispo et potentiellement dispo
-    dispo_orders = merged_df[(merged_df['Order_Type'] == 'Dispo') | (merged_df['Order_Type'] == 'Potentiellement dispo')]
-    
-    # Grouper par date, numéro de commande et type pour obtenir la valeur
-    daily_values = (
-        dispo_orders.groupby(['Last_Delivery_Date', 'Order_Type'])['Open Value']
-        .sum()
-        .reset_index()
-    )
-    
-    daily_values.columns = ['Date', 'Type de commande', 'Valeur des commandes']
+    # Valeur par période et type, en une agrégation du cube (jour, semaine ou mois selon l'étendue)
+    series, bucket = availability_series(cube, 'Value')
     
-    # Créer le graphique avec des couleurs améliorées
-    color_map = {
-        'Dispo': COLORS["secondary"],
-        'Potentiellement dispo': COLORS["warning"]
-    }
-    
-    fig = px.line(
-        daily_values, 
-        x='Date', 
-        y='Valeur des commandes', 
-        color='Type de commande',
-        title="Valeur des commandes Dispo et Potentiellement dispo par Date de Disponibilité", 
-        markers=True,
-        color_discrete_map=color_map
-    )
+    fig = go.Figure(availability_traces(series, 'Value', 'Valeur des commandes', ',.2f'))
     
     fig.update_layout(
-        xaxis_title="Date de Disponibilité",
+        xaxis_title=f"Date de Disponibilité (par {BUCKET_LABELS[bucket]})",
         yaxis_title="Valeur des commandes (€)",
         plot_bgcolor=COLORS["background"],
         paper_bgcolor=COLORS["background"],
@@ -511,6 +486,7 @@ def plot_dispo_orders_value(merged_df):
             'yanchor': 'top',
             'font': dict(color=COLORS["primary"], size=16)  # Couleur et taille pour le titre
         },
+        legend_title_text="Type de commande",
         legend_title_font=dict(color=COLORS["primary"]),
         legend=dict(
             bgcolor=COLORS["background"],
@@ -524,13 +500,25 @@ def plot_dispo_orders_value(merged_df):
     
     return fig
 
-def display_dispo_charts(merged_df):
+def cached_figure(key, build):
+    """
+    Graphique gardé en session pour key (données, filtre et graphique) : il n'est reconstruit que pour une nouvelle clé
+    """
+    figures = st.session_state.setdefault('chart_figures', OrderedDict())
+    if key not in figures:
+        figures[key] = build()
+        while len(figures) > MAX_CACHED_FIGURES:
+            figures.popitem(last=False)
+    figures.move_to_end(key)
+    return figures[key]
+
+def display_dispo_charts(cube, view_key):
     st.markdown('<div class="section-container">', unsafe_allow_html=True)
     st.markdown("### 📈 Analyse des commandes disponibles et Pot.dispo", unsafe_allow_html=True)
     
     # Afficher le premier graphique dans un conteneur stylisé
     st.markdown('<div class="chart-container">', unsafe_allow_html=True)
-    fig1 = plot_dispo_orders(merged_df)
+    fig1 = cached_figure(view_key + ('orders',), lambda: plot_dispo_orders(cube))
     st.plotly_chart(fig1, use_container_width=True)
     st.markdown('</div>', unsafe_allow_html=True)
     
@@ -540,13 +528,13 @@ def display_dispo_charts(merged_df):
     
     # Afficher le second graphique dans un conteneur stylisé
     st.markdown('<div class="chart-container">', unsafe_allow_html=True)
-    fig2 = plot_dispo_orders_value(merged_df)
+    fig2 = cached_figure(view_key + ('value',), lambda: plot_dispo_orders_value(cube))
     st.plotly_chart(fig2, use_container_width=True)
     st.markdown('</div>', unsafe_allow_html=True)
     
     st.markdown('</div>', unsafe_allow_html=True)
 
-def display_dispo_tables(merged_df):
+def display_dispo_tables(orders_df):
     st.markdown('<div class="section-container">', unsafe_allow_html=True)
     st.markdown("### 📦 Commandes Dispo et Potentiellement dispo", unsafe_allow_html=True)
     today = date.today()
@@ -627,11 +615,10 @@ def display_dispo_tables(merged_df):
     
     with col1:
         # Table de commandes dispo ce mois en fonction de la date de création
-        current_month_dispo_creation = merged_df[(merged_df['Order_Type'] == 'Dispo') & 
-                                              (pd.to_datetime(merged_df['Created on']).dt.date >= start_of_month) & 
-                                              (pd.to_datetime(merged_df['Created on']).dt.date <= last_day_of_month)]
+        current_month_dispo_creation = orders_df[(orders_df['Order_Type'] == 'Dispo').to_numpy() & 
+                                                 within_days(orders_df['Created on'], start_of_month, last_day_of_month)]
         
-        current_month_dispo_unique = current_month_dispo_creation.drop_duplicates('Sales Document')[
+        current_month_dispo_unique = current_month_dispo_creation[
             ['Sales Document', 'Created on', 'Last_Delivery_Date', 'Total Value Order']
         ].sort_values('Created on')
         
@@ -641,25 +628,24 @@ def display_dispo_tables(merged_df):
         display_styled_table(
             current_month_dispo_unique,
             f"Commandes dispo du mois de {MOIS_FR[today.month]} {today.year}",
-            current_month_dispo_creation['Open Value'].sum()
+            current_month_dispo_creation['Total Value Order'].sum()
         )
     
     with col2:
         # Table de commandes dispo et potentiellement dispo en fonction de la date de livraison
-        current_month_dispo_delivery = merged_df[
-            ((merged_df['Order_Type'] == 'Dispo') | (merged_df['Order_Type'] == 'Potentiellement dispo')) & 
-            (pd.to_datetime(merged_df['Last_Delivery_Date']).dt.date >= start_of_month) & 
-            (pd.to_datetime(merged_df['Last_Delivery_Date']).dt.date <= last_day_of_month)
+        current_month_dispo_delivery = orders_df[
+            orders_df['Available'].to_numpy() & 
+            within_days(orders_df['Last_Delivery_Date'], start_of_month, last_day_of_month)
         ]
         
-        current_month_all_dispo_unique = current_month_dispo_delivery.drop_duplicates('Sales Document')[
+        current_month_all_dispo_unique = current_month_dispo_delivery[
             ['Sales Document', 'Created on', 'Last_Delivery_Date', 'Order_Type', 'Total Value Order']
         ].sort_values('Last_Delivery_Date')
         
         display_styled_table(
             current_month_all_dispo_unique,
             f"Commandes dispo et potentiellement dispo du mois de {MOIS_FR[today.month]} {today.year}",
-            current_month_dispo_delivery['Open Value'].sum()
+            current_month_dispo_delivery['Total Value Order'].sum()
         )
     
     # NOUVELLES TABLES avec style amélioré
@@ -669,40 +655,39 @@ def display_dispo_tables(merged_df):
     
     with col1:
         # Table pour toutes les commandes dispo et potentiellement dispo jusqu'à aujourd'hui
-        dispo_until_today = merged_df[
-            ((merged_df['Order_Type'] == 'Dispo') | (merged_df['Order_Type'] == 'Potentiellement dispo')) & 
-            (pd.to_datetime(merged_df['Last_Delivery_Date']).dt.date <= today)
+        dispo_until_today = orders_df[
+            orders_df['Available'].to_numpy() & until_day(orders_df['Last_Delivery_Date'], today)
         ]
         
-        dispo_until_today_unique = dispo_until_today.drop_duplicates('Sales Document')[
+        dispo_until_today_unique = dispo_until_today[
             ['Sales Document', 'Created on', 'Last_Delivery_Date', 'Order_Type', 'Total Value Order']
         ].sort_values('Last_Delivery_Date')
         
         display_styled_table(
             dispo_until_today_unique,
             f"Commandes dispo et potentiellement dispo jusqu'à aujourd'hui ({today})",
-            dispo_until_today['Open Value'].sum()
+            dispo_until_today['Total Value Order'].sum()
         )
     
     with col2:
         # Table pour toutes les commandes dispo et potentiellement dispo jusqu'à la fin du mois en cours
-        dispo_until_end_of_month = merged_df[
-            ((merged_df['Order_Type'] == 'Dispo') | (merged_df['Order_Type'] == 'Potentiellement dispo')) & 
-            (pd.to_datetime(merged_df['Last_Delivery_Date']).dt.date <= last_day_of_month)
+        dispo_until_end_of_month = orders_df[
+            orders_df['Available'].to_numpy() & until_day(orders_df['Last_Delivery_Date'], last_day_of_month)
         ]
         
-        dispo_until_end_of_month_unique = dispo_until_end_of_month.drop_duplicates('Sales Document')[
+        dispo_until_end_of_month_unique = dispo_until_end_of_month[
             ['Sales Document', 'Created on', 'Last_Delivery_Date', 'Order_Type', 'Total Value Order']
         ].sort_values('Last_Delivery_Date')
         
         display_styled_table(
             dispo_until_end_of_month_unique,
             f"Commandes dispo et potentiellement dispo jusqu'à fin {MOIS_FR[today.month]} {today.year}",
-            dispo_until_end_of_month['Open Value'].sum()
+            dispo_until_end_of_month['Total Value Order'].sum()
         )
     st.markdown('</div>', unsafe_allow_html=True)
 
-def display_monthly_filter(merged_df):
+@st.fragment
+def display_monthly_filter(orders_df, cube):
     # CSS personnalisé pour améliorer la densité tout en gardant un peu d'espace
     st.markdown("""
     <style>
@@ -787,22 +772,18 @@ def display_monthly_filter(merged_df):
     st.markdown('<div class="section-container">', unsafe_allow_html=True)
     st.markdown("### 📅 Commandes Dispo et Potentiellement dispo par mois", unsafe_allow_html=True)
     
-    df_work = merged_df.copy()
-    df_work['Last_Delivery_Date'] = pd.to_datetime(df_work['Last_Delivery_Date'], errors='coerce')
-    
-    # Inclure à la fois les commandes dispo et potentiellement dispo
-    dispo_orders = df_work[
-        ((df_work['Order_Type'] == 'Dispo') | (df_work['Order_Type'] == 'Potentiellement dispo')) & 
-        (df_work['Last_Delivery_Date'].notna())
-    ].copy()
+    # Inclure à la fois les commandes dispo et potentiellement dispo (cellules du cube)
+    dispo_cube = cube[
+        cube['Available'] & 
+        (cube['Delivery_Date'].notna())
+    ]
     
-    if len(dispo_orders) == 0:
+    if len(dispo_cube) == 0:
         st.warning("Aucune commande Dispo ou Potentiellement dispo trouvée dans les données.")
         st.markdown('</div>', unsafe_allow_html=True)
         return
     
-    dispo_orders['Month_Year'] = dispo_orders['Last_Delivery_Date'].dt.strftime('%Y-%m')
-    months = sorted(dispo_orders['Month_Year'].unique().tolist())
+    months = sorted(dispo_cube['Delivery_Month'].unique().tolist())
     
     if not months:
         st.error("Aucune donnée valide après le filtrage des dates.")
@@ -826,20 +807,16 @@ def display_monthly_filter(merged_df):
     st.markdown('</div>', unsafe_allow_html=True)
     st.session_state.selected_month = selected_month
     
-    filtered_orders = dispo_orders[dispo_orders['Month_Year'] == selected_month]
+    month_cube = dispo_cube[dispo_cube['Delivery_Month'] == selected_month]
     
-    if len(filtered_orders) == 0:
+    if len(month_cube) == 0:
         st.info(f"Aucune commande trouvée pour {selected_month}")
         st.markdown('</div>', unsafe_allow_html=True)
         return
     
-    total_value = filtered_orders['Open Value'].sum()
-    
-    # Grouper par type de commande pour afficher les détails
-    grouped_orders = filtered_orders.groupby('Order_Type').agg({
-        'Open Value': 'sum',
-        'Sales Document': lambda x: len(pd.unique(x))
-    }).reset_index()
+    # Résumé par type de commande, lu dans le cube
+    grouped_orders = cube_by(month_cube, ['Order_Type'])
+    total_value = grouped_orders['Value'].sum()
     
     # Afficher le résumé mensuel avec un style amélioré et compact
     st.markdown('<div class="month-summary">', unsafe_allow_html=True)
@@ -882,9 +859,9 @@ def display_monthly_filter(merged_df):
             st.markdown(f"""
             <div class="order-type-card" style="border-top: 3px solid {badge_color};">
                 <span class="badge {badge_class}">{badge_emoji} {order_type}</span>
-                <h3 style="margin-top: 8px; color: {COLORS['text']};">{row['Sales Document']}</h3>
+                <h3 style="margin-top: 8px; color: {COLORS['text']};">{row['Orders']}</h3>
                 <p style="margin: 4px 0;">commandes</p>
-                <h4 style="margin-top: 12px; color: {COLORS['accent']};">{format_currency(row['Open Value'])}</h4>
+                <h4 style="margin-top: 12px; color: {COLORS['accent']};">{format_currency(row['Value'])}</h4>
             </div>
             """, unsafe_allow_html=True)
     st.markdown('</div>', unsafe_allow_html=True)
@@ -893,7 +870,8 @@ def display_monthly_filter(merged_df):
     st.markdown("##### Détails des commandes", unsafe_allow_html=True)
     
     # Préparer les données pour l'affichage
-    unique_orders = filtered_orders.drop_duplicates(subset=['Sales Document'])[
+    filtered_orders = orders_df[orders_df['Available'].to_numpy() & (orders_df['Delivery_Month'] == selected_month).to_numpy()]
+    unique_orders = filtered_orders[
         ['Sales Document', 'Created on', 'Last_Delivery_Date', 'Order_Type', 'Total Value Order']
     ].sort_values('Last_Delivery_Date')
 
@@ -920,7 +898,7 @@ def display_monthly_filter(merged_df):
     st.markdown('</div>', unsafe_allow_html=True)
     st.markdown('</div>', unsafe_allow_html=True)
 
-def display_completed_orders(merged_df):
+def display_completed_orders(orders_df):
     st.markdown('<div class="section-container">', unsafe_allow_html=True)
     st.markdown("### ✅ Commandes Completed et Block", unsafe_allow_html=True)
     
@@ -956,37 +934,37 @@ def display_completed_orders(merged_df):
     
     with col1:
         # Affichage des commandes Completed avec style
-        completed_orders = merged_df[merged_df['Order_Type'] == 'Completed']
-        completed_unique = completed_orders.drop_duplicates('Sales Document')[
+        completed_orders = orders_df[orders_df['Order_Type'] == 'Completed']
+        completed_unique = completed_orders[
             ['Sales Document', 'Created on', 'Total Value Order']
         ].sort_values('Created on')
         
         display_styled_order_table(
             completed_unique, 
             "Commandes Completed", 
-            completed_orders['Open Value'].sum()
+            completed_orders['Total Value Order'].sum()
         )
     
     with col2:
         # Affichage des commandes Block avec style
-        block_orders = merged_df[merged_df['Order_Type'] == 'Block']
-        block_unique = block_orders.drop_duplicates('Sales Document')[
+        block_orders = orders_df[orders_df['Order_Type'] == 'Block']
+        block_unique = block_orders[
             ['Sales Document', 'Created on', 'Total Value Order']
         ].sort_values('Created on')
         
         display_styled_order_table(
             block_unique, 
             "Commandes Block", 
-            block_orders['Open Value'].sum()
+            block_orders['Total Value Order'].sum()
         )
     st.markdown('</div>', unsafe_allow_html=True)
 
-def display_no_dispo_orders(merged_df):
+def display_no_dispo_orders(orders_df, merged_df):
     st.markdown('<div class="section-container">', unsafe_allow_html=True)
     st.markdown("### ❌ Commandes No Dispo", unsafe_allow_html=True)
     
-    no_dispo_orders = merged_df[merged_df['Order_Type'] == 'No dispo']
-    total_value = no_dispo_orders['Open Value'].sum()
+    no_dispo_orders = orders_df[orders_df['Order_Type'] == 'No dispo']
+    total_value = no_dispo_orders['Total Value Order'].sum()
     
     # Afficher des métriques résumées dans un conteneur stylisé
     st.markdown('<div class="metric-container">', unsafe_allow_html=True)
@@ -997,7 +975,7 @@ def display_no_dispo_orders(merged_df):
             f"""
             <div style="text-align: left;">
                 <p style="margin-bottom: 0;">Nombre de commandes No Dispo</p>
-                <p style="font-size: 2.5rem; font-weight: bold; margin-top: 0;">{len(no_dispo_orders['Sales Document'].unique())}</p>
+                <p style="font-size: 2.5rem; font-weight: bold; margin-top: 0;">{len(no_dispo_orders)}</p>
             </div>
             """, 
             unsafe_allow_html=True
@@ -1015,7 +993,8 @@ def display_no_dispo_orders(merged_df):
     st.markdown('</div>', unsafe_allow_html=True)
 
     st.markdown("##### Liste des commandes non disponibles", unsafe_allow_html=True)
-    no_dispo_products = no_dispo_orders[no_dispo_orders['Updated_Stock_Status'] == 'No dispo']
+    # Le détail des produits vient des lignes
+    no_dispo_products = merged_df[(merged_df['Order_Type'] == 'No dispo') & (merged_df['Updated_Stock_Status'] == 'No dispo')]
     
     if len(no_dispo_products) > 0:
         # Regrouper les données par commande
@@ -1052,171 +1031,59 @@ def display_no_dispo_orders(merged_df):
     st.markdown('</div>', unsafe_allow_html=True)
 
 
-def process_backlog_data(backlog, salesUOM, export, Puom, kit, MRP, securoc_df):
-    try:
-        # Convertir tous les Sales Document en chaînes de caractères
-        backlog['Sales Document'] = backlog['Sales Document'].astype(str)
-        backlog = backlog.iloc[1:]
-
-
-        # Préparer le fichier Securoc
-        securoc_df = securoc_df[['Material', 'Pegged reqmt']]
-        securoc_df = securoc_df.rename(columns={'Material': 'Component', 'Pegged reqmt': 'Y Material'})
-
-        # Vérifier les colonnes requises dans le fichier backlog
-        required_columns = ['Y Material', 'Sales Document', 'Created on', 'Open Value']
-        missing_columns = [col for col in required_columns if col not in backlog.columns]
-        if missing_columns:
-            raise ValueError(f"Colonnes manquantes dans le fichier backlog: {missing_columns}")
-
-        # Nettoyer le fichier Kit
-        kit = kit.rename(columns={'Header': 'Y Material'})
-        kit = kit[['Y Material', 'Header MRP Controller', 'Component']]
-
-        # Prétraitement des fichiers
-        backlog = backlog.replace('pak', 'pac')
-        backlog = backlog[backlog['Y Material'] != 'Y4963053']
-
-        # Sélection des colonnes nécessaires
-        colonnes = [
-            'Created on', 'Sales Document', 'Requested Delivery Date', 'Sales UOM', 'Base UOM',
-            'Header Delivery Block', 'Line Delivery Block', 'Y Material', 'MRP Controller',
-            'MRP Group', 'Vendor PO #', 'Open Value', 'Open Order Quantity', 'On Hand Qty',
-            'Delivery Qty - Complete', 'ATP QTY','DropShip'
-        ]
-        missing_cols = [col for col in colonnes if col not in backlog.columns]
-        if missing_cols:
-            raise ValueError(f"Colonnes manquantes dans le fichier backlog: {missing_cols}")
-        backlog = backlog[colonnes].copy()
-
-        # Créer un identifiant unique pour chaque ligne du backlog
-        backlog['original_index'] = backlog.index
-
-        # Fusion avec MRP pour obtenir les types
-        if 'MRP Controller' not in MRP.columns or 'Type' not in MRP.columns:
-            raise ValueError("Le fichier MRP doit contenir les colonnes 'MRP Controller' et 'Type'")
-        MRP = MRP[['MRP Controller', 'Type']]
-        mrp_dict = MRP.set_index('MRP Controller')['Type'].to_dict()
-        backlog['Type'] = backlog['MRP Controller'].map(mrp_dict)
-
-        # Traitement des types spéciaux
-        backlog.loc[(backlog['MRP Controller'] == 'M70') & (backlog['Y Material'] == 'Y4950101'), 'Type'] = 'SECUROC'
-        backlog.loc[(backlog['MRP Controller'] == 'M70') & (backlog['Y Material'] == 'Y4950100'), 'Type'] = 'BUY'
-
-        # Préparer le fichier Sales UOM
-        salesUOM = salesUOM.rename(columns={'Étiquettes de lignes': 'Y Material'})
-        salesUOM = salesUOM.drop('Alternative Unit of Measure', axis=1)
-
-        # Vérifier les colonnes requises dans le fichier Sales UOM
-        required_sales_cols = ['Y Material', 'Counter']
-        if not all(col in salesUOM.columns for col in required_sales_cols):
-            raise ValueError("Le fichier Sales UOM doit contenir les colonnes 'Y Material' et 'Counter'")
-        backlog = pd.merge(backlog, salesUOM, on='Y Material', how='left')
-
-        # Remplacer les valeurs NaN dans Counter par 1 (pour les matériels qui ne sont pas dans salesUOM)
-        backlog['Counter'] = backlog['Counter'].fillna(1)
-
-        # Préparer le fichier Export
-        required_export_cols = ['Purchasing Document', 'Delivery date', 'Y Material', 'Order Unit', 'Sch Opn Qty']
-        export = export.rename(columns={'Material': 'Y Material'})
-        export = export[required_export_cols]
-
-        # Initialiser et calculer Qte_sales
-        backlog['Qte_sales'] = 0.0
-        try:
-            backlog.loc[(backlog['Sales UOM'] == 'EA') & (backlog['Base UOM'] == 'PC'), 'Qte_sales'] = backlog['Open Order Quantity'].astype(float)
-            backlog.loc[(backlog['Sales UOM'] == 'PC') & (backlog['Base UOM'] == 'EA'), 'Qte_sales'] = backlog['Open Order Quantity'].astype(float)
-            backlog.loc[backlog['Sales UOM'] == backlog['Base UOM'], 'Qte_sales'] = backlog['Open Order Quantity'].astype(float)
-            backlog.loc[backlog['Sales UOM'] != backlog['Base UOM'], 'Qte_sales'] = (backlog['Open Order Quantity'] * backlog['Counter']).astype(float)
-        except Exception as e:
-            raise ValueError(f"Erreur lors du calcul de Qte_sales: {str(e)}")
-
-        # Préparer le fichier PUOM
-        required_puom_cols = ['Material', 'Order Unit', 'PUOM', 'Base UOM']
-        if not all(col in Puom.columns for col in required_puom_cols):
-            raise ValueError(f"Colonnes manquantes dans le fichier Puom: {[col for col in required_puom_cols if col not in Puom.columns]}")
-        Puom = Puom.rename(columns={'Material': 'Y Material'})
-        Puom = Puom[['Y Material', 'Order Unit', 'PUOM', 'Base UOM']]
-
-        # Fusionner Export et PUOM
-        SuppOrder = pd.merge(export, Puom, on='Y Material', how='left')
-        SuppOrder['Order Unit_y'] = SuppOrder['Order Unit_y'].fillna('PC')
-        SuppOrder['Base UOM'] = SuppOrder['Base UOM'].fillna('PC')
-        SuppOrder['PUOM'] = SuppOrder['PUOM'].fillna(1)
-        SuppOrder['Qty_Purchasing'] = SuppOrder['PUOM'] * SuppOrder['Sch Opn Qty']
-        colonneSuppOrder = ['Purchasing Document', 'Y Material', 'Delivery date', 'Base UOM', 'Qty_Purchasing']
-        SuppOrder = SuppOrder[colonneSuppOrder]
-
-        # Déterminer le statut des lignes backlog
-        backlog.loc[(backlog['Open Order Quantity'] == backlog['Delivery Qty - Complete']), 'Statut'] = 'Completed'
-        backlog.loc[(backlog['Open Order Quantity'] != backlog['Delivery Qty - Complete']) &
-                    (backlog['Header Delivery Block'] == 'No Block') &
-                    (backlog['Line Delivery Block'] == 'No Block'), 'Statut'] = 'No Block'
-        backlog.loc[backlog['Statut'].isnull(), 'Statut'] = 'Block'
-
-        # Vérifier la disponibilité des stocks
-        resultat = check_stock_availability(backlog, SuppOrder, kit, securoc_df)
-        if isinstance(resultat, str):
-            raise ValueError(f"Erreur dans check_stock_availability: {resultat}")
-
-        # Mettre à jour les statuts des stocks
-        merged_df = update_stock_status(resultat, SuppOrder, kit, securoc_df)
-        if isinstance(merged_df, str):
-            raise ValueError(f"Erreur dans update_stock_status: {merged_df}")
-
-
-        # Finalisation du traitement
-        merged_df['Sales Document'] = merged_df['Sales Document'].astype(str)
-        merged_df['Total Value Order'] = merged_df.groupby('Sales Document')['Open Value'].transform('sum')
-
-         # Fonction pour déterminer le type de commande
-        def determine_order_type(group):
-            statuses = set(group)
-            
-            # Block si au moins une ligne est Block
-            if 'Block' in statuses:
-                return 'Block'
-            
-            # No dispo si au moins une ligne est No dispo
-            elif 'No dispo' in statuses:
-                return 'No dispo'
-            
-            # Completed si toutes les lignes sont Completed
-            elif statuses == {'Completed'}:
-                return 'Completed'
-            
-            # Dispo si toutes les lignes sont Dispo ou (on trouve Dispo et Completed)
-            elif statuses == {'Dispo'} or statuses == {'Dispo', 'Completed'}:
-                return 'Dispo'
-            
-            # Potentiellement dispo dans plusieurs cas
-            elif (statuses == {'Potentiellement dispo'} or  # toutes potentiellement dispo
-                statuses == {'Potentiellement dispo', 'Dispo'} or  # potentiellement dispo et dispo
-                statuses == {'Potentiellement dispo', 'Completed'} or  # potentiellement dispo et completed
-                statuses == {'Potentiellement dispo', 'Dispo', 'Completed'}):  # les trois types
-                return 'Potentiellement dispo'
-            
-            # Autres cas
-            else:
-                return 'Others'
+@st.fragment
+def display_report_export(export_key, filtered_df, filtered_orders):
+    """
+    Format et bouton de téléchargement du rapport (à appeler dans la barre latérale).
+    Le rapport n'est construit qu'au clic, puis gardé en cache pour ce jeu de fichiers, ce filtre et ce format.
+    """
+    report_format = st.selectbox(
+        "Format du rapport", list(EXPORT_FORMATS),
+        format_func=lambda export_format: EXPORT_FORMATS[export_format]['label'],
+        key="report_format"
+    )
+    if report_format == 'xlsx' and len(filtered_df) + 1 > EXCEL_MAX_ROWS:
+        st.warning("Trop de lignes pour une feuille Excel : choisir l'export CSV ou Parquet.")
+        return
 
-        # Application de la logique de type de commande mise à jour
-        merged_df['Order_Type'] = merged_df.groupby('Sales Document')['Updated_Stock_Status'].transform(
-            lambda x: determine_order_type(x)
+    def build_report():
+        return cached_export(
+            export_key + (report_format,),
+            lambda: export_report(report_tables(filtered_df, filtered_orders), report_format)
         )
 
-        merged_df['Last_Delivery_Date'] = merged_df.groupby('Sales Document')['Last_Delivery_Date'].transform('max')
-
-
-        # Nettoyage final
-        merged_df = merged_df.sort_values('original_index')
-        merged_df = merged_df.drop('original_index', axis=1)
-
-        return merged_df
+    st.download_button(
+        label="📥 Télécharger le rapport",
+        data=build_report,
+        file_name=f"Rapport_Backlog.{EXPORT_FORMATS[report_format]['extension']}",
+        mime=EXPORT_FORMATS[report_format]['mime'],
+        # Télécharger ne relance pas la page
+        on_click="ignore",
+        use_container_width=True
+    )
 
-    except Exception as e:
-        print(f"Erreur détaillée dans process_backlog_data: {str(e)}")
-        raise Exception(f"Erreur lors du traitement des données: {str(e)}")
+def display_performance(panel, stage_timings):
+    """
+    Mesures par étape du dernier traitement calculé, et leur export JSON pour la supervision
+    """
+    if not stage_timings:
+        panel.caption("Aucune mesure : le résultat a été repris du cache.")
+        return
+    performance_df = pd.DataFrame({
+        'Étape': ['\u00a0\u00a0' * timing['depth'] + timing['stage'] for timing in stage_timings],
+        'Durée (s)': [round(timing['seconds'], 3) for timing in stage_timings],
+        'Lignes entrée': pd.array([timing.get('rows_in') for timing in stage_timings], dtype='Int64'),
+        'Lignes sortie': pd.array([timing.get('rows_out') for timing in stage_timings], dtype='Int64')
+    })
+    panel.dataframe(performance_df, hide_index=True, use_container_width=True)
+    panel.download_button(
+        label="📤 Exporter les mesures (JSON)",
+        data=timings_to_json(stage_timings),
+        file_name="performance_backlog.json",
+        mime="application/json",
+        on_click="ignore",
+        use_container_width=True
+    )
 
 def main():
     with st.sidebar:
@@ -1242,51 +1109,114 @@ def main():
             "Securoc": st.file_uploader("Fichier Securoc No Dispo", type=["xlsx"], key="securoc")
         }
 
+        # Fichiers de référence déjà enregistrés : leur import devient facultatif
+        stored_references = latest_reference_digests()
+        reused_references = [name for name in REFERENCE_FILES if not files[name] and name in stored_references]
+        if reused_references:
+            st.caption(f"ℹ️ {', '.join(reused_references)} non importé{'s' if len(reused_references) > 1 else ''} : "
+                       f"la dernière version enregistrée est utilisée.")
+
+    # Un fichier de référence manquant est repris du stock local s'il y a déjà été enregistré
+    missing_files = [
+        name for name, file in files.items()
+        if not file and not (name in REFERENCE_FILES and name in stored_references)
+    ]
+
     # Le contenu principal avec le filtre
-    if all(files.values()):
-        if 'merged_df' not in st.session_state:
+    if not missing_files:
+        uploaded_files = {name: file for name, file in files.items() if file}
+
+        # Les fichiers sont identifiés par leur contenu : un jeu déjà traité n'est ni relu ni recalculé
+        uploaded_digests = input_digests(uploaded_files)
+        digests = dict(uploaded_digests)
+        for name in REFERENCE_FILES:
+            if name not in uploaded_files:
+                digests[name] = stored_references[name]
+
+        # Mesures par étape du dernier traitement (durée, lignes). Pas de pic mémoire ici :
+        # tracemalloc est global au processus, donc partagé par toutes les sessions du serveur
+        performance_panel = st.sidebar.expander("📊 Performance")
+        performance_panel.caption("Pic mémoire par étape : `python cli.py dossier_exports/ --trace-memory`")
+
+        if 'merged_df' not in st.session_state or st.session_state.get('input_digests') != digests:
             with st.spinner("Traitement en cours..."):
-                df_dict = {name: pd.read_excel(file) for name, file in files.items()}
-                merged_df = process_backlog_data(
-                    df_dict["Backlog"], df_dict["Sales UOM"], df_dict["Orders"],
-                    df_dict["PUOM"], df_dict["Kits"], df_dict["MRP"], df_dict["Securoc"]
-                )
+                parse_timings = {name: {'engine': 'cache', 'seconds': 0.0} for name in files}
+
+                def compute():
+                    with record_stages() as stage_timings:
+                        with stage('Lecture des fichiers') as timing:
+                            df_dict, timings = load_workbooks(uploaded_files, uploaded_digests)
+                            timing['rows_out'] = sum(len(df) for df in df_dict.values())
+                        with stage('Préparation des références'):
+                            references, reference_timings = resolve_references(df_dict, digests)
+                        parse_timings.update(timings)
+                        parse_timings.update(reference_timings)
+                        # Seules les étapes dépendant des fichiers modifiés depuis le dernier traitement sont recalculées
+                        result, st.session_state.pipeline_state = run_pipeline(
+                            df_dict, digests, references, st.session_state.get('pipeline_state')
+                        )
+                    st.session_state.performance = stage_timings
+                    pipeline_state = st.session_state.pipeline_state
+                    return result, pipeline_state['orders'], pipeline_state['filter_index'], pipeline_state['cubes']
+                st.session_state.performance = None
+                merged_df, orders_df, filter_index, cubes = cached_result(digests, compute)
                 st.session_state.merged_df = merged_df
+                st.session_state.orders_df = orders_df
+                st.session_state.filter_index = filter_index
+                st.session_state.cubes = cubes
+                st.session_state.input_digests = digests
+                st.session_state.parse_timings = parse_timings
         else:
             merged_df = st.session_state.merged_df
+            orders_df = st.session_state.orders_df
+            filter_index = st.session_state.filter_index
+            cubes = st.session_state.cubes
+
+        # Temps de lecture de chaque fichier (0 s si repris du cache)
+        with st.sidebar.expander("⏱️ Temps de lecture des fichiers"):
+            for name, timing in st.session_state.get('parse_timings', {}).items():
+                st.caption(f"{name} : {timing['seconds']:.2f} s ({timing['engine']})")
+
+        display_performance(performance_panel, st.session_state.get('performance'))
 
         # NOUVEAU: Afficher le filtre principal en haut à gauche
         selected_filter = display_main_filter()
         
+        custom_filter = display_custom_filter(filter_index)
+        
         # NOUVEAU: Appliquer le filtre sur les données
-        filtered_df = apply_filter(merged_df, selected_filter)
+        # Les positions des lignes et commandes de chaque filtre principal sont précalculées (index des filtres)
+        order_mask = custom_order_mask(filter_index, orders_df, **custom_filter) if custom_filter else None
+        filtered_df, filtered_orders = select(filter_index, merged_df, orders_df, selected_filter, order_mask)
+        # Cube des indicateurs : précalculé pour chaque filtre principal, recalculé sur les seules lignes retenues sinon
+        cube = build_cube(filtered_df, filtered_orders) if custom_filter else cubes[selected_filter]
+        # Données affichées : jeu de fichiers et filtres (clé des graphiques et du rapport en cache)
+        view_key = (tuple(sorted(digests.items())), selected_filter, repr(sorted(custom_filter.items())))
         
         # Afficher un message informatif sur le filtre appliqué
-        if selected_filter != "Toutes les commandes":
-            total_commands_before = len(merged_df['Sales Document'].unique())
-            total_commands_after = len(filtered_df['Sales Document'].unique())
-            st.info(f"🔍 Filtre appliqué: **{selected_filter}** - {total_commands_after} commandes affichées sur {total_commands_before} au total")
+        if selected_filter != "Toutes les commandes" or custom_filter:
+            applied_filter = selected_filter if selected_filter != "Toutes les commandes" else ""
+            if custom_filter:
+                applied_filter = f"{applied_filter} + filtre personnalisé" if applied_filter else "Filtre personnalisé"
+            total_commands_before = len(orders_df)
+            total_commands_after = len(filtered_orders)
+            st.info(f"🔍 Filtre appliqué: **{applied_filter}** - {total_commands_after} commandes affichées sur {total_commands_before} au total")
 
         # Afficher les composants avec les données filtrées
-        create_order_metrics(filtered_df)
-        display_dispo_charts(filtered_df)
-        display_dispo_tables(filtered_df)
-        display_monthly_filter(filtered_df)
-        display_completed_orders(filtered_df)
-        display_no_dispo_orders(filtered_df)
+        # Indicateurs et graphiques lus dans le cube, listes de commandes dans la table des commandes (une ligne par commande)
+        # Les sections à widgets propres (mois, export) sont des fragments : leurs widgets ne relancent que
+        # la section, avec les données reçues lors de la dernière exécution complète ; les autres sections,
+        # sans widget, sont simplement recalculées à chaque exécution complète
+        create_order_metrics(cube)
+        display_dispo_charts(cube, view_key)
+        display_dispo_tables(filtered_orders)
+        display_monthly_filter(filtered_orders, cube)
+        display_completed_orders(filtered_orders)
+        display_no_dispo_orders(filtered_orders, filtered_df)
         
         # Export avec les données filtrées
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            filtered_df.to_excel(writer, index=False, sheet_name='Données_Complètes')
-        
-        st.sidebar.download_button(
-            label="📥 Télécharger le rapport",
-            data=output.getvalue(),
-            file_name="Rapport_Backlog.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            use_container_width=True
-        )
+        with st.sidebar:
+            display_report_export(view_key, filtered_df, filtered_orders)
     else:
         st.info("👈 Veuillez importer tous les fichiers nécessaires dans le menu latéral pour commencer l'analyse.")
 
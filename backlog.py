@@ -1,5 +1,615 @@
+import heapq
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 import pandas as pd
+from profiling import stage
+
+# Allocation parallèle par matériel : nombre de processus (1 = désactivée) et taille minimale
+# du backlog en dessous de laquelle le coût de lancement dépasse le gain
+ALLOCATION_WORKERS = int(os.environ.get('BACKLOG_ALLOCATION_WORKERS', '1'))
+MIN_PARALLEL_ROWS = 50000
+# Tours vectorisés de _fit_demands avant de servir les besoins restants un à un
+MAX_FIT_ROUNDS = 8
+
+# Colonnes lues par les allocations (seules celles-ci sont envoyées aux processus)
+ON_HAND_COLUMNS = ['Y Material', 'On Hand Qty', 'Created on', 'Sort_Order', 'Qte_sales']
+SUPPLIER_ORDER_COLUMNS = ['Y Material', 'Sort_Order', 'Remaining_Quantity', 'Created on']
+DELIVERY_COLUMNS = ['Y Material', 'Delivery date', 'Qty_Purchasing']
+
+_allocation_pool = None
+_allocation_pool_workers = 0
+_allocation_pool_lock = threading.Lock()
+
+def _group_starts(codes):
+    """
+    Repère la première ligne de chaque groupe dans un tableau de codes trié.
+    """
+    return np.r_[True, codes[1:] != codes[:-1]][:len(codes)]
+
+def _is_whole(values):
+    """
+    Quantités finies et entières, pour lesquelles les cumuls sont exacts.
+    """
+    return np.isfinite(values) & (values == np.floor(values))
+
+def document_mask(documents, row_mask):
+    """
+    Étend un masque ligne à toute la commande : True pour chaque ligne dont la
+    Sales Document contient au moins une ligne du masque (groupby-any en O(n)).
+    Les lignes sans Sales Document ne sont jamais rattachées à une commande.
+    """
+    codes, uniques = pd.factorize(pd.Series(documents))
+    row_mask = np.asarray(row_mask, dtype=bool)
+    known = codes >= 0
+    flagged = np.bincount(codes[known & row_mask], minlength=len(uniques)) > 0
+    result = np.zeros(len(codes), dtype=bool)
+    result[known] = flagged[codes[known]]
+    return result
+
+def material_mask(materials, material_set):
+    """
+    Appartenance (par table de hachage) des matériaux à un ensemble de référence.
+    Un matériau manquant n'appartient jamais à l'ensemble.
+    """
+    materials = pd.Series(materials)
+    return (materials.notna() & materials.isin(pd.unique(pd.Series(material_set).dropna()))).to_numpy()
+
+def build_vendor_po_index(df1):
+    """
+    Construit une seule fois l'index des commandes fournisseurs :
+    l'ensemble des couples (Purchasing Document, Y Material) présents dans df1.
+    """
+    pairs = df1[['Purchasing Document', 'Y Material']].dropna().drop_duplicates()
+    return pd.MultiIndex.from_frame(pairs)
+
+def vendor_po_keys(rows):
+    """
+    Clés (Vendor PO #, Y Material) des lignes, avec le masque des lignes ayant un Vendor PO
+    (les autres portent '-').
+    """
+    vendor_po = rows['Vendor PO #'].map(str)
+    keys = pd.MultiIndex.from_arrays([vendor_po, rows['Y Material']])
+    return keys, (vendor_po != '-').to_numpy()
+
+def match_vendor_po(rows, vendor_po_index):
+    """
+    Résout en une seule passe le statut des lignes ayant un Vendor PO :
+    - 'Potentiellement dispo' si le couple (Vendor PO, Y Material) existe dans les commandes fournisseurs
+    - 'Completed' si le Vendor PO est inconnu ou ne contient pas ce Y Material
+    - NaN si la ligne n'a pas de Vendor PO ('-')
+    """
+    keys, has_vendor_po = vendor_po_keys(rows)
+    material_match = keys.isin(vendor_po_index)
+
+    status = np.full(len(rows), np.nan, dtype=object)
+    status[has_vendor_po] = 'Completed'
+    status[has_vendor_po & material_match] = 'Potentiellement dispo'
+    return pd.Series(status, index=rows.index)
+
+def build_priority_order(rows):
+    """
+    Calcule en une passe l'ordre de priorité des lignes de chaque Y Material :
+    - par date de création croissante
+    - à date égale : commandes RW par leurs 5 derniers chiffres, commandes numériques
+      par numéro, et dates mélangeant les deux par Total Value Order décroissant
+    Retourne le Sort_Order (1, 2, ... par matériel) des lignes ayant une date de création.
+    """
+    material_codes, _ = pd.factorize(rows['Y Material'])
+    positions = np.flatnonzero((material_codes >= 0) & rows['Created on'].notna().to_numpy())
+
+    codes = material_codes[positions]
+    created_on = rows['Created on'].to_numpy()[positions].astype('datetime64[ns]').view('int64')
+    sales_document = rows['Sales Document'].iloc[positions].astype(str)
+
+    # Composition de chaque groupe (Y Material, Created on) : tout RW, tout numérique ou mixte
+    is_rw = sales_document.str.startswith('RW').to_numpy()
+    date_groups = [codes, created_on]
+    all_rw = pd.Series(is_rw).groupby(date_groups).transform('all').to_numpy()
+    all_numeric = pd.Series(~is_rw).groupby(date_groups).transform('all').to_numpy()
+
+    # Clé de départage, comparée uniquement à l'intérieur d'un même groupe
+    last_digits = sales_document.str[-5:]
+    numeric_part = pd.to_numeric(last_digits.where(last_digits.str.isdigit()), errors='coerce')
+    document_rank = pd.factorize(sales_document, sort=True)[0]
+    total_value = rows['Total Value Order'].to_numpy(dtype=float)[positions]
+    tie_break = np.select(
+        [all_rw, all_numeric],
+        [numeric_part.fillna(np.inf).to_numpy(dtype=float), document_rank],
+        -total_value
+    )
+
+    order = np.lexsort((tie_break, created_on, codes))
+    codes = codes[order]
+    group_start = np.flatnonzero(_group_starts(codes))
+    sort_order = np.arange(len(codes)) - np.repeat(group_start, np.diff(np.r_[group_start, len(codes)])) + 1
+
+    return pd.Series(sort_order, index=rows.index[positions[order]])
+
+def _allocate_sequentially(initial_stock, quantities):
+    """
+    Allocation ligne par ligne, utilisée pour les matériels dont les quantités ou le stock
+    (négatifs, manquants ou non entiers) ne permettent pas le calcul par somme cumulée.
+    """
+    remaining_quantity = initial_stock
+    available = np.zeros(len(quantities), dtype=bool)
+    remaining = np.empty(len(quantities), dtype=float)
+
+    for i, qte_sales in enumerate(quantities):
+        if remaining_quantity > 0:
+            available[i] = remaining_quantity >= qte_sales
+            remaining_quantity -= qte_sales
+        else:
+            remaining_quantity = -qte_sales
+        remaining[i] = remaining_quantity
+
+    return available, remaining
+
+def allocate_on_hand_stock(rows):
+    """
+    Alloue le stock On Hand aux lignes de tous les matériels en une seule passe.
+    Les lignes sont consommées par Y Material dans l'ordre de Sort_Order ; le stock
+    initial est le On Hand Qty de la première ligne du matériel. Une fois le stock
+    épuisé, le reste de chaque ligne vaut -Qte_sales.
+    Retourne Stock_Status et Remaining_Quantity pour les lignes ayant une date de création.
+    """
+    material_codes, _ = pd.factorize(rows['Y Material'])
+    first_positions = np.unique(material_codes, return_index=True)[1]
+    first_positions = first_positions[material_codes[first_positions] >= 0]
+    on_hand = rows['On Hand Qty'].to_numpy(dtype=float)
+    initial_stock = np.empty(len(rows))
+    initial_stock[material_codes[first_positions]] = on_hand[first_positions]
+
+    # Seules les lignes datées (et rattachées à un matériel) reçoivent un Sort_Order
+    allocated = (material_codes >= 0) & rows['Created on'].notna().to_numpy()
+    positions = np.flatnonzero(allocated)
+    positions = positions[np.lexsort((rows['Sort_Order'].to_numpy()[positions], material_codes[positions]))]
+
+    codes = material_codes[positions]
+    stock = initial_stock[codes]
+    quantities = rows['Qte_sales'].to_numpy(dtype=float)[positions]
+    group_start = _group_starts(codes)
+
+    # Reste après chaque ligne tant que le stock est positif : stock - q1 - q2 - ...
+    steps = -quantities
+    steps[group_start] = stock[group_start] - quantities[group_start]
+    running = pd.Series(steps).groupby(codes, sort=False).cumsum().to_numpy()
+    previous = np.where(group_start, stock, np.r_[np.nan, running[:-1]])
+
+    in_stock = previous > 0
+    available = in_stock & (running >= 0)
+    remaining = np.where(in_stock, running, -quantities)
+
+    # Quantités négatives, manquantes ou non entières, ou stock non entier : on rejoue l'ancien calcul
+    # ligne par ligne (la somme cumulée n'arrondit pas comme les soustractions successives)
+    irregular = ~_is_whole(quantities) | (quantities < 0) | ~_is_whole(stock)
+    for code in np.unique(codes[irregular]):
+        group = codes == code
+        available[group], remaining[group] = _allocate_sequentially(initial_stock[code], quantities[group])
+
+    return pd.DataFrame({
+        'Stock_Status': np.where(available, 'Dispo', 'No dispo'),
+        'Remaining_Quantity': remaining
+    }, index=rows.index[positions])
+
+def material_shards(materials, weights, n_shards):
+    """
+    Répartit les matériels en n_shards lots de charge équilibrée (LPT : le matériel le plus lourd
+    va au lot le moins chargé). Toutes les lignes d'un même matériel sont dans le même lot ;
+    les lignes sans matériel vont au lot 0.
+    Retourne le numéro de lot de chaque ligne.
+    """
+    codes, uniques = pd.factorize(materials)
+    known = codes >= 0
+    load = np.bincount(codes[known], weights=np.asarray(weights, dtype=float)[known], minlength=len(uniques))
+
+    shard_of_material = np.zeros(len(uniques), dtype=np.int64)
+    shards = [(0.0, shard) for shard in range(n_shards)]
+    for material in np.argsort(-load, kind='stable'):
+        shard_load, shard = heapq.heappop(shards)
+        shard_of_material[material] = shard
+        heapq.heappush(shards, (shard_load + load[material], shard))
+
+    return np.where(known, shard_of_material[np.where(known, codes, 0)], 0)
+
+def _get_allocation_pool(workers):
+    """
+    Pool de processus d'allocation, réutilisé d'un traitement à l'autre
+    """
+    global _allocation_pool, _allocation_pool_workers
+    with _allocation_pool_lock:
+        if _allocation_pool is None or _allocation_pool_workers != workers:
+            if _allocation_pool is not None:
+                _allocation_pool.shutdown()
+            _allocation_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            _allocation_pool_workers = workers
+        return _allocation_pool
+
+def allocate_by_material(allocate, products, deliveries=None, workers=None):
+    """
+    Exécute une allocation indépendante par Y Material (allocate_on_hand_stock ou allocate_supplier_orders)
+    en la découpant en lots de matériels traités en parallèle. Le résultat est identique à l'appel direct :
+    chaque matériel est alloué en entier dans un seul lot, avec ses livraisons.
+    En dessous de MIN_PARALLEL_ROWS lignes, ou avec un seul processus, l'allocation est faite directement.
+    """
+    workers = ALLOCATION_WORKERS if workers is None else workers
+    arguments = (products,) if deliveries is None else (products, deliveries)
+    if workers <= 1 or len(products) < MIN_PARALLEL_ROWS:
+        return allocate(*arguments)
+
+    # Charge d'un matériel : ses lignes de backlog et ses livraisons
+    materials = pd.concat([frame['Y Material'] for frame in arguments], ignore_index=True)
+    shard = material_shards(materials, np.ones(len(materials)), workers)
+    bounds = np.cumsum([0] + [len(frame) for frame in arguments])
+    frame_shards = [shard[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+    pool = _get_allocation_pool(workers)
+    futures = [
+        pool.submit(allocate, *[frame[frame_shard == lot] for frame, frame_shard in zip(arguments, frame_shards)])
+        for lot in range(workers) if (frame_shards[0] == lot).any()
+    ]
+    results = [future.result() for future in futures]
+    return pd.concat(results) if results else allocate(*arguments)
+
+def _allocate_deliveries_sequentially(needed, created_on, delivery_qty, delivery_dates):
+    """
+    Parcours ligne par ligne des livraisons d'un matériel, utilisé lorsque les quantités
+    (négatives, manquantes ou non entières) ne permettent pas la recherche par intervalles.
+    """
+    remaining_delivery_qty = pd.Series(delivery_qty).sum()
+    deliv_idx = 0
+    qty_accumulated = 0
+    last_delivery_date = None
+
+    available = np.zeros(len(needed), dtype=bool)
+    dates = np.array(created_on, dtype='datetime64[ns]')
+    remaining = np.empty(len(needed), dtype=float)
+
+    for i, needed_qty in enumerate(needed):
+        if qty_accumulated >= needed_qty:
+            # Couvert par la quantité déjà accumulée
+            delivery_date = last_delivery_date
+        elif remaining_delivery_qty >= needed_qty:
+            # Accumuler les livraisons suivantes jusqu'à couvrir le besoin
+            delivery_date = None
+            while deliv_idx < len(delivery_qty):
+                if qty_accumulated >= needed_qty:
+                    delivery_date = delivery_dates[deliv_idx - 1]
+                    break
+                qty_accumulated += delivery_qty[deliv_idx]
+                last_delivery_date = delivery_dates[deliv_idx]
+                deliv_idx += 1
+                if qty_accumulated >= needed_qty:
+                    delivery_date = last_delivery_date
+                    break
+            if delivery_date is None and deliv_idx > 0:
+                delivery_date = delivery_dates[deliv_idx - 1]
+        else:
+            # Pas assez de quantité : la ligne reste No dispo
+            remaining[i] = remaining_delivery_qty - needed_qty
+            continue
+
+        available[i] = True
+        dates[i] = np.datetime64('NaT') if delivery_date is None else delivery_date
+        remaining_delivery_qty -= needed_qty
+        remaining[i] = remaining_delivery_qty
+        qty_accumulated -= needed_qty
+
+    return available, dates, remaining
+
+def _fit_demands(codes, needed, capacity):
+    """
+    Sert les besoins dans l'ordre, matériel par matériel, tant qu'ils tiennent dans la capacité
+    restante ; un besoin trop grand est sauté et les suivants peuvent encore être servis.
+    Chaque tour vectorisé sert, pour chaque matériel, les besoins jusqu'au premier refusé. Le nombre
+    de tours peut croître avec le nombre de lignes d'un matériel (ex. capacité 100, besoins 2, 99, 2,
+    97, 2, 95... : un tour par besoin refusé) ; au-delà de MAX_FIT_ROUNDS tours, les besoins restants
+    sont servis en un seul parcours, le coût reste donc linéaire.
+    """
+    served = np.zeros(len(needed), dtype=bool)
+    capacity = capacity.copy()
+    pending = np.arange(len(needed))
+
+    for _ in range(MAX_FIT_ROUNDS):
+        if not len(pending):
+            break
+        cumulative = pd.Series(needed[pending]).groupby(codes[pending], sort=False).cumsum().to_numpy()
+        fits = cumulative <= capacity[codes[pending]]
+        served[pending[fits]] = True
+        np.subtract.at(capacity, codes[pending[fits]], needed[pending[fits]])
+
+        # Le premier besoin refusé de chaque matériel est définitivement No dispo ;
+        # seuls les suivants qui tiennent encore dans la capacité restante sont réexaminés
+        rejected = pending[~fits]
+        pending = rejected[~_group_starts(codes[rejected])]
+        pending = pending[needed[pending] <= capacity[codes[pending]]]
+
+    # Besoins restants (dans l'ordre, matériel par matériel) : même règle, un besoin à la fois
+    for position, code, quantity in zip(pending.tolist(), codes[pending].tolist(), needed[pending].tolist()):
+        if quantity <= capacity[code]:
+            served[position] = True
+            capacity[code] -= quantity
+
+    return served
+
+def allocate_supplier_orders(products, deliveries):
+    """
+    Affecte les livraisons fournisseurs aux lignes No dispo de tous les matériels en une passe.
+    - Les lignes de chaque Y Material sont servies dans l'ordre de Sort_Order, pour leur
+      quantité manquante abs(Remaining_Quantity), tant que le total livré restant le permet.
+    - La date de disponibilité d'une ligne servie est la date de la livraison à laquelle
+      le cumul des livraisons (triées par date) couvre le cumul des besoins servis :
+      recherche binaire sur les cumuls de tous les matériels à la fois.
+    Retourne Updated_Stock_Status, Last_Delivery_Date et Updated_Remaining_Quantity.
+    """
+    material_codes, _ = pd.factorize(pd.concat([products['Y Material'], deliveries['Y Material']], ignore_index=True))
+    product_codes = material_codes[:len(products)]
+    delivery_codes = material_codes[len(products):]
+
+    # Lignes triées par (matériel, Sort_Order) et livraisons par (matériel, date), dates manquantes en dernier
+    positions = np.flatnonzero(product_codes >= 0)
+    positions = positions[np.lexsort((products['Sort_Order'].to_numpy()[positions], product_codes[positions]))]
+    codes = product_codes[positions]
+    needed = np.abs(products['Remaining_Quantity'].to_numpy(dtype=float)[positions])
+    created_on = products['Created on'].to_numpy().astype('datetime64[ns]')[positions]
+
+    delivery_dates = deliveries['Delivery date'].to_numpy().astype('datetime64[ns]')
+    date_key = np.where(np.isnat(delivery_dates), np.iinfo(np.int64).max, delivery_dates.view('int64'))
+    delivery_positions = np.flatnonzero(delivery_codes >= 0)
+    delivery_positions = delivery_positions[np.lexsort((date_key[delivery_positions], delivery_codes[delivery_positions]))]
+    delivery_codes = delivery_codes[delivery_positions]
+    delivery_dates = delivery_dates[delivery_positions]
+    delivery_qty = deliveries['Qty_Purchasing'].to_numpy(dtype=float)[delivery_positions]
+
+    # Par défaut (matériel sans livraison) : la ligne reste No dispo à sa date de création
+    available = np.zeros(len(positions), dtype=bool)
+    dates = created_on.copy()
+    remaining = products['Remaining_Quantity'].to_numpy(dtype=float)[positions]
+
+    # Matériels à traiter ligne par ligne : quantités négatives, manquantes ou non entières
+    n_materials = material_codes.max() + 1 if len(material_codes) else 0
+    has_deliveries = np.bincount(delivery_codes, minlength=n_materials) > 0
+    irregular = np.zeros(n_materials, dtype=bool)
+    irregular[delivery_codes[~_is_whole(delivery_qty) | (delivery_qty < 0)]] = True
+    irregular[codes[~_is_whole(needed)]] = True
+
+    # Matériels réguliers : affectation des besoins puis recherche binaire des dates
+    rows = np.flatnonzero(has_deliveries[codes] & ~irregular[codes])
+    kept = ~irregular[delivery_codes]
+    kept_codes, kept_qty, kept_dates = delivery_codes[kept], delivery_qty[kept], delivery_dates[kept]
+    total_delivery_qty = np.bincount(kept_codes, weights=kept_qty, minlength=n_materials)
+
+    served = _fit_demands(codes[rows], needed[rows], total_delivery_qty)
+    served_cumulative = pd.Series(np.where(served, needed[rows], 0)).groupby(codes[rows], sort=False).cumsum().to_numpy()
+
+    # Cumul global des livraisons : chaque matériel y occupe un intervalle croissant
+    cumulative_delivery = np.cumsum(kept_qty)
+    material_offset = np.zeros(n_materials)
+    starts = _group_starts(kept_codes)
+    material_offset[kept_codes[starts]] = cumulative_delivery[starts] - kept_qty[starts]
+    delivery_index = np.searchsorted(cumulative_delivery, material_offset[codes[rows[served]]] + served_cumulative[served])
+
+    available[rows[served]] = True
+    dates[rows[served]] = np.where(served_cumulative[served] == 0, np.datetime64('NaT'), kept_dates[delivery_index])
+    remaining[rows] = total_delivery_qty[codes[rows]] - served_cumulative - np.where(served, 0, needed[rows])
+
+    # Matériels irréguliers : ancien parcours ligne par ligne
+    for code in np.flatnonzero(irregular & has_deliveries):
+        group = codes == code
+        material_deliveries = delivery_codes == code
+        available[group], dates[group], remaining[group] = _allocate_deliveries_sequentially(
+            needed[group], created_on[group], delivery_qty[material_deliveries], delivery_dates[material_deliveries]
+        )
+
+    return pd.DataFrame({
+        'Updated_Stock_Status': np.where(available, 'Potentiellement dispo', 'No dispo'),
+        'Last_Delivery_Date': dates,
+        'Updated_Remaining_Quantity': remaining
+    }, index=products.index[positions])
+
+def build_component_ledgers(deliveries, components):
+    """
+    Registre compact des livraisons des composants SECUROC, construit une seule fois :
+    les quantités et dates de chaque composant, triées par date de livraison, sont rangées
+    bout à bout ; le composant i occupe les positions bounds[i] à bounds[i + 1].
+    """
+    known = deliveries['Y Material'].notna() & deliveries['Y Material'].isin(components)
+    sorted_deliveries = {
+        component: group.sort_values('Delivery date', kind='stable')
+        for component, group in deliveries[known].groupby('Y Material', sort=False)
+    }
+    ledger = [sorted_deliveries[component] for component in components if component in sorted_deliveries]
+    ledger = pd.concat(ledger) if ledger else deliveries.iloc[:0]
+    lengths = [len(sorted_deliveries[component]) if component in sorted_deliveries else 0 for component in components]
+
+    quantities = ledger['Qty_Purchasing'].to_numpy(dtype=float)
+    dates = pd.DatetimeIndex(ledger['Delivery date'])
+    bounds = np.r_[0, np.cumsum(lengths, dtype=int)]
+    return quantities, dates, bounds
+
+def allocate_securoc_products(products, deliveries, securoc_df):
+    """
+    Affecte les livraisons des composants aux produits SECUROC, par ordre de création.
+    Un produit est Potentiellement dispo lorsque chacun de ses composants couvre abs(Qte_sales) ;
+    il consomme alors cette quantité sur chaque composant et prend la date de livraison la plus
+    tardive parmi ses composants. Sinon il reste No dispo, sans date.
+    Retourne Updated_Stock_Status et Last_Delivery_Date des produits.
+    """
+    products = products.sort_values(by=['Created on'], kind='stable')
+
+    # Nomenclature Y Material -> positions des composants, calculée une seule fois
+    components = securoc_df['Component'].unique()
+    bom_rows = securoc_df.drop_duplicates(['Y Material', 'Component'])
+    bom_codes = pd.Series(pd.Index(components).get_indexer(bom_rows['Component']))
+    bom = {material: codes.tolist() for material, codes in bom_codes.groupby(bom_rows['Y Material'].to_numpy(), sort=False)}
+
+    # Registre de chaque composant : stock accumulé et curseur dans ses livraisons
+    quantities, dates, bounds = build_component_ledgers(deliveries, components)
+    quantities = quantities.tolist()
+    starts, ends = bounds[:-1].tolist(), bounds[1:].tolist()
+    cursor = list(starts)
+    stock = [0] * len(components)
+
+    statuses, latest_dates = [], []
+    for material, qte_sales in zip(products['Y Material'], products['Qte_sales']):
+        required_qty = abs(qte_sales)
+        needed_components = bom.get(material, [])
+        all_components_available = True
+        latest_delivery_date = None
+
+        for component in needed_components:
+            is_available = False
+            delivery_date = None
+
+            if stock[component] >= required_qty:
+                # Stock restant suffisant : date de la dernière livraison utilisée
+                is_available = True
+                if cursor[component] > starts[component]:
+                    delivery_date = dates[cursor[component] - 1]
+            else:
+                # Ajouter les livraisons jusqu'à couvrir la quantité requise ; comme auparavant,
+                # le curseur n'avance que si la quantité est atteinte
+                position = cursor[component]
+                while position < ends[component] and stock[component] < required_qty:
+                    stock[component] += quantities[position]
+                    position += 1
+                    if stock[component] >= required_qty:
+                        is_available = True
+                        delivery_date = dates[position - 1]
+                        cursor[component] = position
+                        break
+
+            if not is_available:
+                all_components_available = False
+            elif delivery_date and (latest_delivery_date is None or delivery_date > latest_delivery_date):
+                latest_delivery_date = delivery_date
+
+        if all_components_available:
+            statuses.append('Potentiellement dispo')
+            latest_dates.append(latest_delivery_date)
+            for component in needed_components:
+                stock[component] -= required_qty
+        else:
+            statuses.append('No dispo')
+            latest_dates.append(None)
+
+    return pd.DataFrame({
+        'Updated_Stock_Status': statuses,
+        'Last_Delivery_Date': pd.DatetimeIndex(latest_dates)
+    }, index=products.index)
+
+def kit_resolution_levels(kits_df):
+    """
+    Ordre de résolution des kits imbriqués : niveau 0 si aucun composant n'est lui-même un kit,
+    sinon un niveau de plus que ses composants kits. Les kits pris dans un cycle passent en dernier.
+    """
+    kit_bom = kits_df.dropna(subset=['Y Material'])
+    kit_materials = set(kit_bom['Y Material'])
+    nested = kit_bom[kit_bom['Component'].isin(kit_materials)]
+    pending = {kit: set() for kit in kit_materials}
+    for kit, component in zip(nested['Y Material'], nested['Component']):
+        pending[kit].add(component)
+
+    levels = {}
+    level = 0
+    while pending:
+        ready = [kit for kit, components in pending.items() if components.issubset(levels)]
+        if not ready:
+            ready = list(pending)
+        for kit in ready:
+            levels[kit] = level
+            del pending[kit]
+        level += 1
+    return levels
+
+def resolve_kits(result_df, kit_rows, kits_df, status_column, available_status, unavailable_status):
+    """
+    Évalue toutes les lignes kit (M80) par une réduction groupée : un kit est disponible si,
+    dans la même Sales Document, la première ligne de chacun de ses composants a le statut
+    available_status. Un kit sans composant connu est disponible.
+    Les kits imbriqués sont évalués dans l'ordre des dépendances (composants avant kits).
+    Retourne le nouveau statut des lignes kit.
+    """
+    status = result_df[status_column].copy()
+    kit_bom = kits_df.dropna(subset=['Y Material'])[['Y Material', 'Component']]
+
+    # Index (Sales Document, Y Material) -> première ligne correspondante
+    first_rows = result_df[result_df['Y Material'].notna()].drop_duplicates(['Sales Document', 'Y Material'])
+    first_row_index = pd.MultiIndex.from_frame(first_rows[['Sales Document', 'Y Material']])
+
+    kit_lines = pd.DataFrame({
+        'row': kit_rows,
+        'Sales Document': result_df.loc[kit_rows, 'Sales Document'].to_numpy(),
+        'Y Material': result_df.loc[kit_rows, 'Y Material'].to_numpy()
+    })
+    levels = kit_resolution_levels(kits_df)
+    kit_lines['level'] = kit_lines['Y Material'].map(levels).fillna(0)
+
+    for level in sorted(kit_lines['level'].unique()):
+        lines = kit_lines[kit_lines['level'] == level]
+        pairs = lines.merge(kit_bom, on='Y Material')
+        positions = first_row_index.get_indexer(pd.MultiIndex.from_arrays([pairs['Sales Document'], pairs['Component']]))
+        component_status = status.loc[first_rows.index].to_numpy()[positions]
+        component_ok = (positions >= 0) & (component_status == available_status)
+
+        all_available = pd.Series(True, index=lines['row'].to_numpy())
+        all_available.update(pd.Series(component_ok).groupby(pairs['row'].to_numpy()).all())
+        status.loc[all_available.index] = np.where(all_available, available_status, unavailable_status)
+
+    return status.loc[kit_rows]
+
+def apply_securoc_availability(result_df, securoc_mask, securoc_df):
+    """
+    Étape 1, produits SECUROC : 'No dispo' si le produit figure dans le fichier Securoc, sinon 'Dispo'
+    """
+    securoc_materials = securoc_df['Y Material'].unique() if 'Y Material' in securoc_df.columns else []
+    result_df.loc[securoc_mask, 'Stock_Status'] = np.where(
+        material_mask(result_df.loc[securoc_mask, 'Y Material'], securoc_materials), 'No dispo', 'Dispo'
+    )
+
+def apply_kit_availability(result_df, m80_mask, kits_df):
+    """
+    Étape 1, kits (M80) : 'Dispo' si tous les composants de la commande sont Dispo
+    """
+    kit_status = resolve_kits(result_df, result_df.index[m80_mask], kits_df, 'Stock_Status', 'Dispo', 'No dispo')
+    result_df.loc[kit_status.index, 'Stock_Status'] = kit_status
+
+def evaluated_securoc_mask(result_df):
+    """
+    Lignes SECUROC dont le statut d'étape 1 vient du fichier Securoc
+    (No Block, sans Vendor PO résolu : Dispo ou No dispo)
+    """
+    return ((result_df['Statut'] == 'No Block') &
+            (result_df['Type'] == 'SECUROC') &
+            result_df['Stock_Status'].isin(['Dispo', 'No dispo']))
+
+def evaluated_kit_mask(result_df):
+    """
+    Lignes kit (M80) dont le statut d'étape 1 vient de la résolution des composants
+    """
+    return ((result_df['Statut'] == 'No Block') &
+            (result_df['MRP Controller'] == 'M80') &
+            (result_df['Type'] != 'SECUROC') &
+            result_df['Stock_Status'].isin(['Dispo', 'No dispo']))
+
+def refresh_securoc_availability(result_df, kits_df, securoc_df):
+    """
+    Recalcule l'étape 1 quand seul le fichier Securoc a changé :
+    seules les lignes SECUROC puis les kits (qui peuvent en dépendre) sont réévalués,
+    le reste de result_df (résultat précédent de check_stock_availability) est conservé.
+    """
+    try:
+        kit_mask = evaluated_kit_mask(result_df)
+        apply_securoc_availability(result_df, evaluated_securoc_mask(result_df), securoc_df)
+        apply_kit_availability(result_df, kit_mask, kits_df)
+        return result_df
+
+    except Exception as e:
+        print(f"Erreur détaillée: {str(e)}")  # Pour le debugging
+        return f"🔴 Unexpected Error: {type(e).__name__}: {e}"
 
 def check_stock_availability(df, df1, kits_df, securoc_df):
     try:
@@ -29,81 +639,34 @@ def check_stock_availability(df, df1, kits_df, securoc_df):
         result_df.loc[completed_mask, 'Stock_Status'] = 'Completed'
         result_df.loc[completed_mask, 'Sort_Order'] = -1
 
-        block_mask = result_df['Statut'] == 'Block'
-        blocked_sales_documents = result_df[block_mask]['Sales Document'].unique()
-
         # Mettre à jour le Stock_Status, Statut et Sort_Order pour les commandes bloquées
-        for sales_doc in blocked_sales_documents:
-            result_df.loc[result_df['Sales Document'] == sales_doc, ['Stock_Status', 'Statut', 'Sort_Order']] = ['Block', 'Block', -1]
+        blocked_orders_mask = document_mask(result_df['Sales Document'], result_df['Statut'] == 'Block')
+        result_df.loc[blocked_orders_mask, ['Stock_Status', 'Statut', 'Sort_Order']] = ['Block', 'Block', -1]
 
         # Création du masque pour "No Block"
         no_block_mask = result_df['Statut'] == 'No Block'
         
-        # Traitement des lignes No Block
-        no_block_rows = result_df[no_block_mask].copy()
-        
-        for idx, row in no_block_rows.iterrows():
-            vendor_po = str(row['Vendor PO #'])
-            y_material = row['Y Material']
-            
-            # Vérification pour Vendor PO
-            if vendor_po != '-':
-                # Vérifier si Vendor PO existe dans df1["Purchasing Document"]
-                vendor_exists = df1['Purchasing Document'].eq(vendor_po).any()
-                
-                if vendor_exists:
-                    # Vérifier si Y Material correspond entre df et df1
-                    material_match = df1[(df1['Purchasing Document'] == vendor_po) & 
-                                         (df1['Y Material'] == y_material)].shape[0] > 0
-                    
-                    if material_match:
-                        result_df.loc[idx, 'Stock_Status'] = 'Potentiellement dispo'
-                        result_df.loc[idx, 'Remaining_Quantity'] = 0
-                    else:
-                        result_df.loc[idx, 'Stock_Status'] = 'Completed'
-                else:
-                    result_df.loc[idx, 'Stock_Status'] = 'Completed'
+        # Traitement des lignes No Block ayant un Vendor PO (jointure sur l'index des commandes fournisseurs)
+        with stage('Vendor PO', rows_in=no_block_mask.sum()) as timing:
+            vendor_po_status = match_vendor_po(result_df[no_block_mask], build_vendor_po_index(df1))
+            potentiellement_dispo_idx = vendor_po_status.index[vendor_po_status == 'Potentiellement dispo']
+            completed_idx = vendor_po_status.index[vendor_po_status == 'Completed']
+
+            result_df.loc[potentiellement_dispo_idx, 'Stock_Status'] = 'Potentiellement dispo'
+            result_df.loc[potentiellement_dispo_idx, 'Remaining_Quantity'] = 0
+            result_df.loc[completed_idx, 'Stock_Status'] = 'Completed'
+            timing['rows_out'] = len(potentiellement_dispo_idx) + len(completed_idx)
         
         # 🔒 Gestion des produits SECUROC (seulement pour ceux qui n'ont pas encore été traités)
         securoc_mask = no_block_mask & (result_df['Type'] == 'SECUROC') & (result_df['Stock_Status'] == 'x')
-        securoc_materials = securoc_df['Y Material'].unique() if 'Y Material' in securoc_df.columns else []
-
-        for idx, row in result_df[securoc_mask].iterrows():
-            result_df.at[idx, 'Stock_Status'] = 'No dispo' if row['Y Material'] in securoc_materials else 'Dispo'
-
-        # Tri des produits SECUROC avec Stock_Status = 'x'
-        securoc_to_sort_mask = securoc_mask & (result_df['Stock_Status'] == 'x')
-        for material, group in result_df[securoc_to_sort_mask].groupby('Y Material'):
-            temp_group = group.copy()
-            sort_order = 1  # Réinitialisation du compteur pour chaque groupe
-            temp_group = temp_group.sort_values('Created on', ascending=True)
-
-            # Tri par date
-            for date, date_group in temp_group.groupby('Created on'):
-                # Si plusieurs commandes à la même date
-                if len(date_group) > 1:
-                    all_rw = all(str(x).startswith("RW") for x in date_group['Sales Document'])
-                    all_numeric = all(not str(x).startswith("RW") for x in date_group['Sales Document'])
-
-                    if all_rw:
-                        # Pour les commandes RW, trier par les 5 derniers chiffres
-                        date_group['numeric_part'] = date_group['Sales Document'].apply(
-                            lambda x: int(str(x)[-5:]) if str(x)[-5:].isdigit() else float('inf')
-                        )
-                        sorted_indices = date_group.sort_values('numeric_part', ascending=True).index
-                    elif all_numeric:
-                        # Pour les commandes numériques, tri simple
-                        sorted_indices = date_group.sort_values('Sales Document', ascending=True).index
-                    else:
-                        # Si mélange de types, tri par valeur totale de commande
-                        sorted_indices = date_group.sort_values('Total Value Order', ascending=False).index
-                else:
-                    sorted_indices = date_group.index
-
-                # Attribution des Sort_Order pour ce groupe de date
-                for idx in sorted_indices:
-                    result_df.at[idx, 'Sort_Order'] = sort_order
-                    sort_order += 1
+        with stage('Produits SECUROC', rows_in=securoc_mask.sum()) as timing:
+            apply_securoc_availability(result_df, securoc_mask, securoc_df)
+
+            # Tri des produits SECUROC avec Stock_Status = 'x'
+            securoc_to_sort_mask = securoc_mask & (result_df['Stock_Status'] == 'x')
+            sort_order = build_priority_order(result_df[securoc_to_sort_mask])
+            result_df.loc[sort_order.index, 'Sort_Order'] = sort_order
+            timing['rows_out'] = int(securoc_mask.sum())
 
         # 📌 Gestion des Produits No Block et non SECUROC (hors M80) qui n'ont pas encore été traités
         non_securoc_mask = (no_block_mask &
@@ -111,72 +674,23 @@ def check_stock_availability(df, df1, kits_df, securoc_df):
                           (result_df['Type'] != 'SECUROC') &
                           (result_df['Stock_Status'] == 'x'))
 
-        for material, group in result_df[non_securoc_mask].groupby('Y Material'):
-            temp_group = group.copy()
-            sort_order = 1  # Réinitialisation du compteur pour chaque groupe
-            remaining_quantity = temp_group.iloc[0]['On Hand Qty']
-            temp_group = temp_group.sort_values('Created on', ascending=True)
-
-            # Tri par date
-            for date, date_group in temp_group.groupby('Created on'):
-                # Si plusieurs commandes à la même date
-                if len(date_group) > 1:
-                    all_rw = all(str(x).startswith("RW") for x in date_group['Sales Document'])
-                    all_numeric = all(not str(x).startswith("RW") for x in date_group['Sales Document'])
-
-                    if all_rw:
-                        # Pour les commandes RW, trier par les 5 derniers chiffres
-                        date_group['numeric_part'] = date_group['Sales Document'].apply(
-                            lambda x: int(str(x)[-5:]) if str(x)[-5:].isdigit() else float('inf')
-                        )
-                        sorted_indices = date_group.sort_values('numeric_part', ascending=True).index
-                    elif all_numeric:
-                        # Pour les commandes numériques, tri simple
-                        sorted_indices = date_group.sort_values('Sales Document', ascending=True).index
-                    else:
-                        # Si mélange de types, tri par valeur totale de commande
-                        sorted_indices = date_group.sort_values('Total Value Order', ascending=False).index
-                else:
-                    sorted_indices = date_group.index
-
-                # Attribution des Sort_Order et calcul des disponibilités
-                for idx in sorted_indices:
-                    row = temp_group.loc[idx]
-                    result_df.at[idx, 'Sort_Order'] = sort_order
-                    sort_order += 1
-
-                    if remaining_quantity > 0:
-                        if remaining_quantity >= row['Qte_sales']:
-                            result_df.at[idx, 'Stock_Status'] = 'Dispo'
-                            remaining_quantity -= row['Qte_sales']
-                        else:
-                            result_df.at[idx, 'Stock_Status'] = 'No dispo'
-                            remaining_quantity -= row['Qte_sales']
-                    else:
-                        result_df.at[idx, 'Stock_Status'] = 'No dispo'
-                        remaining_quantity = -row['Qte_sales']
-
-                    result_df.at[idx, 'Remaining_Quantity'] = remaining_quantity
+        with stage('Allocation du stock On Hand', rows_in=non_securoc_mask.sum()) as timing:
+            # Ordre de priorité des lignes par matériel
+            sort_order = build_priority_order(result_df[non_securoc_mask])
+            result_df.loc[sort_order.index, 'Sort_Order'] = sort_order
+
+            # Allocation FIFO du stock On Hand, en une passe pour tous les matériels
+            allocation = allocate_by_material(allocate_on_hand_stock, result_df[non_securoc_mask][ON_HAND_COLUMNS])
+            result_df.loc[allocation.index, 'Stock_Status'] = allocation['Stock_Status']
+            result_df.loc[allocation.index, 'Remaining_Quantity'] = allocation['Remaining_Quantity']
+            timing['rows_out'] = len(allocation)
 
         # 📦 Gestion des Kits (MRP Controller == M80)
         m80_mask = no_block_mask & (result_df['MRP Controller'] == 'M80') & (result_df['Stock_Status'] == 'x')
-        for idx, row in result_df[m80_mask].iterrows():
-            result_df.at[idx, 'Sort_Order'] = 0
-            kit_number = row['Y Material']
-            kit_components = kits_df[kits_df['Y Material'] == kit_number]
-
-            all_available = True
-            for _, kit_row in kit_components.iterrows():
-                component_rows = result_df[
-                    (result_df['Y Material'] == kit_row['Component']) &
-                    (result_df['Sales Document'] == row['Sales Document'])
-                ]
-
-                if component_rows.empty or component_rows['Stock_Status'].values[0] != 'Dispo':
-                    all_available = False
-                    break
-
-            result_df.at[idx, 'Stock_Status'] = 'Dispo' if all_available else 'No dispo'
+        with stage('Kits', rows_in=m80_mask.sum()) as timing:
+            result_df.loc[m80_mask, 'Sort_Order'] = 0
+            apply_kit_availability(result_df, m80_mask, kits_df)
+            timing['rows_out'] = int(m80_mask.sum())
 
         return result_df
 
@@ -186,6 +700,83 @@ def check_stock_availability(df, df1, kits_df, securoc_df):
     
 
 
+def stage_two_mask(result_df):
+    """
+    Lignes à allouer sur les commandes fournisseurs : No Block et No dispo, hors M50 et M32
+    """
+    return ((result_df['Stock_Status'] == 'No dispo') &
+            (result_df['Statut'] == 'No Block') &
+            (result_df['MRP Controller'] != 'M50') &
+            (result_df['MRP Controller'] != 'M32'))
+
+def supplier_order_pool(result_df, export_df):
+    """
+    Commandes fournisseurs encore allouables : export_df sans les combinaisons
+    Vendor PO + Y Material déjà prises par les lignes Potentiellement dispo (anti-jointure)
+    """
+    vendor_po_pairs, has_vendor_po = vendor_po_keys(result_df[result_df['Stock_Status'] == 'Potentiellement dispo'])
+    export_keys = pd.MultiIndex.from_frame(export_df[['Purchasing Document', 'Y Material']])
+    return export_df[~export_keys.isin(vendor_po_pairs[has_vendor_po])]
+
+def allocate_securoc_updates(result_df, filtered_export_df, securoc_df):
+    """
+    Étape 2, produits SECUROC No dispo : livraisons des composants bloquants.
+    Retourne le nombre de lignes réallouées.
+    """
+    securoc_mask = stage_two_mask(result_df) & (result_df['Type'] == 'SECUROC') & (result_df['MRP Controller'] != 'M80')
+
+    securoc_ymaterials = securoc_df['Y Material'].unique()
+    allocation = allocate_securoc_products(
+        result_df[securoc_mask & material_mask(result_df['Y Material'], securoc_ymaterials)],
+        filtered_export_df,
+        securoc_df
+    )
+    result_df.loc[allocation.index, ['Updated_Stock_Status', 'Last_Delivery_Date']] = allocation
+    return len(allocation)
+
+def apply_kit_updates(result_df, kits_df):
+    """
+    Étape 2, kits No dispo : 'Potentiellement dispo' si tous les composants le sont.
+    Retourne le nombre de kits réévalués.
+    """
+    m80_mask = stage_two_mask(result_df) & (result_df['MRP Controller'] == 'M80')
+    kit_status = resolve_kits(
+        result_df, result_df.index[m80_mask], kits_df,
+        'Updated_Stock_Status', 'Potentiellement dispo', 'No dispo'
+    )
+    result_df.loc[kit_status.index, 'Updated_Stock_Status'] = kit_status
+    return len(kit_status)
+
+def refresh_securoc_updates(result_df, previous_df, export_df, kits_df, securoc_df):
+    """
+    Recalcule l'étape 2 quand seul le fichier Securoc a changé.
+    result_df : étape 1 rafraîchie (refresh_securoc_availability) ; previous_df : résultat précédent
+    de update_stock_status. Les allocations des autres produits sont reprises telles quelles,
+    seules les lignes SECUROC et les kits sont réalloués.
+    """
+    try:
+        export_df['Delivery date'] = pd.to_datetime(export_df['Delivery date'], format='%m/%d/%Y', errors='coerce')
+
+        updated_columns = ['Updated_Stock_Status', 'Last_Delivery_Date', 'Updated_Remaining_Quantity']
+        for column in updated_columns:
+            result_df[column] = previous_df[column]
+
+        # Lignes SECUROC et kits : retour aux valeurs initiales de l'étape 2 avant réallocation
+        reset_mask = evaluated_securoc_mask(result_df) | evaluated_kit_mask(result_df)
+        result_df.loc[reset_mask, 'Updated_Stock_Status'] = result_df.loc[reset_mask, 'Stock_Status']
+        result_df.loc[reset_mask, 'Last_Delivery_Date'] = result_df.loc[reset_mask, 'Created on']
+        result_df.loc[reset_mask, 'Updated_Remaining_Quantity'] = result_df.loc[reset_mask, 'Remaining_Quantity']
+
+        filtered_export_df = supplier_order_pool(result_df, export_df)
+        allocate_securoc_updates(result_df, filtered_export_df, securoc_df)
+        apply_kit_updates(result_df, kits_df)
+
+        return result_df
+
+    except Exception as e:
+        print(f"Erreur détaillée: {str(e)}")  # Pour le debugging
+        return f"🔴 Unexpected Error: {type(e).__name__}: {e}"
+
 def update_stock_status(result_df, export_df, kits_df, securoc_df):
     """
     Met à jour les statuts de stock en fonction des commandes fournisseurs et des livraisons prévues.
@@ -216,261 +807,47 @@ def update_stock_status(result_df, export_df, kits_df, securoc_df):
 
         potentiellement_dispo_mask = result_df['Stock_Status'] == 'Potentiellement dispo'
         
-        for idx, row in result_df[potentiellement_dispo_mask].iterrows():
-            vendor_po = str(row['Vendor PO #'])
-            y_material = row['Y Material']
-            
-            if vendor_po != '-':
-                # Trouver la ligne correspondante dans export_df
-                for _, export_row in export_df.iterrows():
-                    if (export_row['Purchasing Document'] == vendor_po and 
-                        export_row['Y Material'] == y_material):
-                        delivery_date = export_row['Delivery date']
-                        result_df.loc[idx, 'Last_Delivery_Date'] = delivery_date
-                        result_df.loc[idx, 'Updated_Stock_Status'] = 'Potentiellement dispo'
-
-        # 2. Filtrer uniquement pour les produits No Block et No dispo, en excluant M50 et M32
-        no_block_no_dispo_mask = (
-            (result_df['Stock_Status'] == 'No dispo') & 
-            (result_df['Statut'] == 'No Block') &
-            (result_df['MRP Controller'] != 'M50') &
-            (result_df['MRP Controller'] != 'M32')
-        )
-        
-        # Créons une liste des combinaisons Vendor PO + Y Material déjà traitées
-        already_processed = set()
-        for idx, row in result_df[potentiellement_dispo_mask].iterrows():
-            vendor_po = str(row['Vendor PO #'])
-            y_material = row['Y Material']
-            if vendor_po != '-':
-                already_processed.add((vendor_po, y_material))
-        
-        # Filtrer les lignes d'export_df qui ont déjà été traitées
-        filtered_export_df = export_df.copy()
-        rows_to_drop = []
-        
-        for idx, row in filtered_export_df.iterrows():
-            purchasing_doc = row['Purchasing Document']
-            y_material = row['Y Material']
-            if (purchasing_doc, y_material) in already_processed:
-                rows_to_drop.append(idx)
-        
-        filtered_export_df = filtered_export_df.drop(rows_to_drop)
-        
+        potentiellement_dispo_idx = result_df.index[potentiellement_dispo_mask]
+        vendor_po_pairs, has_vendor_po = vendor_po_keys(result_df[potentiellement_dispo_mask])
+
+        # Date de livraison de la commande fournisseur correspondante (jointure ; la dernière ligne d'export_df l'emporte)
+        pair_columns = ['Purchasing Document', 'Y Material']
+        delivery_by_pair = (export_df.dropna(subset=pair_columns)
+                            .drop_duplicates(pair_columns, keep='last')
+                            .set_index(pair_columns)['Delivery date'])
+        matched = delivery_by_pair.index.get_indexer(vendor_po_pairs)
+        matched_rows = has_vendor_po & (matched >= 0)
+        result_df.loc[potentiellement_dispo_idx[matched_rows], 'Last_Delivery_Date'] = delivery_by_pair.to_numpy()[matched[matched_rows]]
+        result_df.loc[potentiellement_dispo_idx[matched_rows], 'Updated_Stock_Status'] = 'Potentiellement dispo'
+
+        # 2. Allocation des commandes fournisseurs restantes aux produits No Block et No dispo (hors M50 et M32)
+        with stage('Livraisons disponibles', rows_in=len(export_df)) as timing:
+            filtered_export_df = supplier_order_pool(result_df, export_df)
+            timing['rows_out'] = len(filtered_export_df)
+
         # 2.1 Gérer les produits SECUROC
-        securoc_mask = no_block_no_dispo_mask & (result_df['Type'] == 'SECUROC') & (result_df['MRP Controller'] != 'M80')
-
-        # Obtenir tous les composants uniques de SECUROC
-        all_components = securoc_df['Component'].unique()
-
-        # Dictionnaire pour stocker le stock restant de chaque composant
-        component_stock = {comp: 0 for comp in all_components}
-        # Dictionnaire pour stocker l'index de livraison courant
-        delivery_indexes = {comp: 0 for comp in all_components}
-        # Dictionnaire pour stocker les livraisons de chaque composant
-        component_deliveries = {}
-
-        # Précharger toutes les livraisons de composants (en utilisant filtered_export_df)
-        for component in all_components:
-            component_deliveries[component] = filtered_export_df[
-                filtered_export_df['Y Material'] == component
-            ].sort_values('Delivery date').reset_index(drop=True)
-
-        # Trier les YMaterials de SECUROC par date de création
-        securoc_ymaterials = securoc_df['Y Material'].unique()
-        securoc_products = result_df[
-            securoc_mask & 
-            result_df['Y Material'].isin(securoc_ymaterials)
-        ].sort_values(by=['Created on']).reset_index()
-
-        # Traiter chaque produit SECUROC dans l'ordre
-        for idx, product in securoc_products.iterrows():
-            ymaterial = product['Y Material']
-            required_qty = abs(product['Qte_sales'])  # Utiliser Qte_sales au lieu de ATP QTY
-            product_idx = product['index']  # Index original dans result_df
-            
-            # Obtenir tous les composants nécessaires pour ce YMaterial
-            needed_components = securoc_df[securoc_df['Y Material'] == ymaterial]['Component'].unique()
-            
-            all_components_available = True
-            component_status = {}
-            latest_delivery_date = None
-            
-            # Vérifier et mettre à jour la disponibilité de chaque composant
-            for component in needed_components:
-                is_available = False
-                delivery_date = None
-                
-                # Vérifier si le stock restant est suffisant
-                if component_stock[component] >= required_qty:
-                    is_available = True
-                    # Utiliser la date de la dernière livraison utilisée
-                    delivery_date = component_deliveries[component].iloc[delivery_indexes[component]-1]['Delivery date'] if delivery_indexes[component] > 0 else None
-                else:
-                    # Récupérer les livraisons de ce composant
-                    comp_deliveries = component_deliveries[component]
-                    total_deliveries = len(comp_deliveries)
-                    current_idx = delivery_indexes[component]
-                    
-                    # Ajouter des livraisons jusqu'à couvrir la quantité requise
-                    while current_idx < total_deliveries and component_stock[component] < required_qty:
-                        delivery = comp_deliveries.iloc[current_idx]
-                        component_stock[component] += delivery['Qty_Purchasing']
-                        delivery_date = delivery['Delivery date']
-                        current_idx += 1
-                        
-                        if component_stock[component] >= required_qty:
-                            is_available = True
-                            # Mettre à jour l'index pour la prochaine utilisation
-                            delivery_indexes[component] = current_idx
-                            break
-                
-                # Si le composant n'est pas disponible, le produit ne peut pas être disponible
-                if not is_available:
-                    all_components_available = False
-                
-                # Mettre à jour le statut du composant pour ce produit
-                component_status[component] = {
-                    'available': is_available,
-                    'date': delivery_date
-                }
-                
-                # Mettre à jour la date de livraison la plus tardive
-                if is_available and delivery_date:
-                    if latest_delivery_date is None or delivery_date > latest_delivery_date:
-                        latest_delivery_date = delivery_date
-            
-            # Mettre à jour le statut du produit
-            if all_components_available:
-                result_df.loc[product_idx, 'Updated_Stock_Status'] = 'Potentiellement dispo'
-                result_df.loc[product_idx, 'Last_Delivery_Date'] = latest_delivery_date
-                
-                # Déduire les quantités des stocks de composants
-                for component in needed_components:
-                    component_stock[component] -= required_qty
-            else:
-                result_df.loc[product_idx, 'Updated_Stock_Status'] = 'No dispo'
-                result_df.loc[product_idx, 'Last_Delivery_Date'] = None
+        with stage('Produits SECUROC') as timing:
+            timing['rows_out'] = allocate_securoc_updates(result_df, filtered_export_df, securoc_df)
 
         # 2.2 Gérer les produits No Block (non SECUROC et non M80)
-        no_kit_mask = (no_block_no_dispo_mask & 
+        no_kit_mask = (stage_two_mask(result_df) &
                     (result_df['MRP Controller'] != 'M80') & 
                     (result_df['Type'] != 'SECUROC'))
 
-        grouped_products = result_df[no_kit_mask].groupby('Y Material')
-        # Utiliser filtered_export_df au lieu de export_df pour les livraisons
-        grouped_deliveries = filtered_export_df.groupby('Y Material')
-
-        for material, product_group in grouped_products:
-            # Vérifier si le matériel a des livraisons
-            if material not in grouped_deliveries.groups:
-                # Pas de livraisons disponibles, tous les produits restent non disponibles
-                for idx, prod_row in product_group.iterrows():
-                    result_df.at[idx, 'Updated_Stock_Status'] = 'No dispo'
-                    result_df.at[idx, 'Last_Delivery_Date'] = prod_row['Created on']
-                    result_df.at[idx, 'Updated_Remaining_Quantity'] = prod_row['Remaining_Quantity']
-                continue
-            
-            # Trier les produits par ordre de priorité et les livraisons par date
-            product_group = product_group.sort_values(by=['Sort_Order'])
-            delivery_group = grouped_deliveries.get_group(material).sort_values(by=['Delivery date'])
-            
-            # Calculer la somme totale des quantités de livraison disponibles
-            total_delivery_qty = delivery_group['Qty_Purchasing'].sum()
-            remaining_delivery_qty = total_delivery_qty  # Quantité de livraison restante
-            
-            # Initialiser les variables pour suivre les livraisons à travers les produits
-            deliv_idx = 0
-            qty_accumulated = 0
-            last_delivery_date = None  # Stocke la date de la dernière livraison utilisée
-            delivery_array = delivery_group.to_dict('records')
-            
-            # Parcourir chaque produit pour ce matériel
-            for idx, prod_row in product_group.iterrows():
-                current_remaining = prod_row['Remaining_Quantity']  # Déjà négatif par défaut
-                needed_qty = abs(current_remaining)  # Quantité nécessaire (positive)
-                
-                # Vérifier si la quantité accumulée des livraisons précédentes peut déjà couvrir ce produit
-                if qty_accumulated >= needed_qty:
-                    # Ce produit peut être potentiellement disponible avec la quantité déjà accumulée
-                    delivery_date = last_delivery_date
-                    
-                    # Mettre à jour les informations du produit
-                    new_remaining = remaining_delivery_qty - needed_qty
-                    result_df.at[idx, 'Updated_Stock_Status'] = 'Potentiellement dispo'
-                    result_df.at[idx, 'Last_Delivery_Date'] = delivery_date
-                    result_df.at[idx, 'Updated_Remaining_Quantity'] = new_remaining
-                    
-                    # Mettre à jour la quantité de livraison restante pour les produits suivants
-                    remaining_delivery_qty = new_remaining
-                    
-                    # Soustraire la quantité nécessaire pour ce produit de la quantité accumulée
-                    qty_accumulated -= needed_qty
-                
-                # Vérifier si la quantité restante de livraison peut couvrir ce produit
-                elif remaining_delivery_qty >= needed_qty:
-                    # Ce produit peut être potentiellement disponible
-                    delivery_date = None
-                    
-                    # Continuer à parcourir les livraisons à partir du point où nous nous sommes arrêtés
-                    while deliv_idx < len(delivery_array):
-                        # Si la quantité accumulée est déjà suffisante pour ce produit
-                        if qty_accumulated >= needed_qty:
-                            delivery_date = delivery_array[deliv_idx - 1]['Delivery date']
-                            break
-                        
-                        # Sinon, accumuler la quantité de la livraison actuelle
-                        deliv_row = delivery_array[deliv_idx]
-                        qty_accumulated += deliv_row['Qty_Purchasing']
-                        last_delivery_date = deliv_row['Delivery date']  # Mettre à jour la dernière date de livraison
-                        
-                        # Si cette livraison nous fait dépasser le seuil
-                        if qty_accumulated >= needed_qty:
-                            delivery_date = deliv_row['Delivery date']
-                            deliv_idx += 1
-                            break
-                        
-                        deliv_idx += 1
-                    
-                    # Si nous avons parcouru toutes les livraisons sans trouver de date
-                    if delivery_date is None and deliv_idx > 0:
-                        delivery_date = delivery_array[deliv_idx - 1]['Delivery date']
-                    
-                    # Mettre à jour les informations du produit
-                    new_remaining = remaining_delivery_qty - needed_qty
-                    result_df.at[idx, 'Updated_Stock_Status'] = 'Potentiellement dispo'
-                    result_df.at[idx, 'Last_Delivery_Date'] = delivery_date
-                    result_df.at[idx, 'Updated_Remaining_Quantity'] = new_remaining
-                    
-                    # Mettre à jour la quantité de livraison restante pour les produits suivants
-                    remaining_delivery_qty = new_remaining
-                    
-                    # Soustraire la quantité nécessaire pour ce produit de la quantité accumulée
-                    qty_accumulated -= needed_qty
-                else:
-                    # Pas assez de quantité pour ce produit
-                    new_remaining = remaining_delivery_qty - needed_qty  # Sera négatif
-                    result_df.at[idx, 'Updated_Stock_Status'] = 'No dispo'
-                    result_df.at[idx, 'Last_Delivery_Date'] = prod_row['Created on']
-                    result_df.at[idx, 'Updated_Remaining_Quantity'] = new_remaining
-            
-            # Nous gardons la quantité accumulée pour les prochains produits même si celui-ci est "No dispo"
-        # 2.3 Gérer les kits No Block et MRP Controller == M80
-        m80_mask = no_block_no_dispo_mask & (result_df['MRP Controller'] == 'M80')
-        for idx, row in result_df[m80_mask].iterrows():
-            kit_number = row['Y Material']
-            kit_components = kits_df[kits_df['Y Material'] == kit_number]
-            all_available = True
-
-            for _, kit_row in kit_components.iterrows():
-                component_rows = result_df[(result_df['Y Material'] == kit_row['Component']) &
-                                           (result_df['Sales Document'] == row['Sales Document'])]
-
-                if component_rows.empty or component_rows['Updated_Stock_Status'].values[0] != 'Potentiellement dispo':
-                    all_available = False
-                    break
+        # Allocation des livraisons fournisseurs (filtered_export_df) à tous les matériels en une passe
+        with stage('Allocation des commandes fournisseurs', rows_in=no_kit_mask.sum()) as timing:
+            allocation = allocate_by_material(
+                allocate_supplier_orders,
+                result_df[no_kit_mask][SUPPLIER_ORDER_COLUMNS],
+                filtered_export_df[DELIVERY_COLUMNS]
+            )
+            allocated_columns = ['Updated_Stock_Status', 'Last_Delivery_Date', 'Updated_Remaining_Quantity']
+            result_df.loc[allocation.index, allocated_columns] = allocation[allocated_columns]
+            timing['rows_out'] = len(allocation)
 
-            result_df.at[idx, 'Updated_Stock_Status'] = 'Potentiellement dispo' if all_available else 'No dispo'
+        # 2.3 Gérer les kits No Block et MRP Controller == M80
+        with stage('Kits') as timing:
+            timing['rows_out'] = apply_kit_updates(result_df, kits_df)
 
         return result_df
 
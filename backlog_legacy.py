@@ -0,0 +1,651 @@
+"""
+Moteur de traitement d'origine, conservé tel quel comme référence, aux tris près : tous les
+sort_values sont stables (kind='stable') pour que l'ordre des lignes ex aequo soit celui du fichier,
+comme dans le moteur optimisé, et que la référence soit déterministe.
+Le moteur optimisé (backlog.py, pipeline.py) doit donner exactement les mêmes résultats : voir equivalence.py.
+"""
+import numpy as np
+import pandas as pd
+
+def check_stock_availability(df, df1, kits_df, securoc_df):
+    try:
+        # 🚀 Nettoyage et validation des DataFrames
+        df['Sales Document'] = df['Sales Document'].astype(str).str.strip()
+        df1['Purchasing Document'] = df1['Purchasing Document'].astype(str).str.strip()
+
+        # ✅ Vérification des colonnes essentielles
+        required_columns = ['Statut', 'MRP Controller', 'Vendor PO #', 'Y Material',
+                          'Sales Document', 'On Hand Qty', 'Qte_sales', 'Open Value', 'Created on', 'Type', 'DropShip']
+
+        if not set(required_columns).issubset(df.columns):
+            raise ValueError(f"❌ Colonnes manquantes dans df: {set(required_columns) - set(df.columns)}")
+
+        # 🏗️ Création du DataFrame de sortie
+        result_df = df.copy()
+        result_df['Stock_Status'] = 'x'
+        result_df['Remaining_Quantity'] = result_df['On Hand Qty']
+        result_df['Sort_Order'] = 0
+        result_df['Created on'] = pd.to_datetime(result_df['Created on'], format='%m/%d/%Y', errors='coerce')
+
+        # 🏷️ Calcul de la valeur totale par Sales Document
+        result_df['Total Value Order'] = result_df.groupby('Sales Document')['Open Value'].transform('sum')
+
+        # ✅ Gestion des statuts
+        completed_mask = result_df['Statut'] == 'Completed'
+        result_df.loc[completed_mask, 'Stock_Status'] = 'Completed'
+        result_df.loc[completed_mask, 'Sort_Order'] = -1
+
+        block_mask = result_df['Statut'] == 'Block'
+        blocked_sales_documents = result_df[block_mask]['Sales Document'].unique()
+
+        # Mettre à jour le Stock_Status, Statut et Sort_Order pour les commandes bloquées
+        for sales_doc in blocked_sales_documents:
+            result_df.loc[result_df['Sales Document'] == sales_doc, ['Stock_Status', 'Statut', 'Sort_Order']] = ['Block', 'Block', -1]
+
+        # Création du masque pour "No Block"
+        no_block_mask = result_df['Statut'] == 'No Block'
+        
+        # Traitement des lignes No Block
+        no_block_rows = result_df[no_block_mask].copy()
+        
+        for idx, row in no_block_rows.iterrows():
+            vendor_po = str(row['Vendor PO #'])
+            y_material = row['Y Material']
+            
+            # Vérification pour Vendor PO
+            if vendor_po != '-':
+                # Vérifier si Vendor PO existe dans df1["Purchasing Document"]
+                vendor_exists = df1['Purchasing Document'].eq(vendor_po).any()
+                
+                if vendor_exists:
+                    # Vérifier si Y Material correspond entre df et df1
+                    material_match = df1[(df1['Purchasing Document'] == vendor_po) & 
+                                         (df1['Y Material'] == y_material)].shape[0] > 0
+                    
+                    if material_match:
+                        result_df.loc[idx, 'Stock_Status'] = 'Potentiellement dispo'
+                        result_df.loc[idx, 'Remaining_Quantity'] = 0
+                    else:
+                        result_df.loc[idx, 'Stock_Status'] = 'Completed'
+                else:
+                    result_df.loc[idx, 'Stock_Status'] = 'Completed'
+        
+        # 🔒 Gestion des produits SECUROC (seulement pour ceux qui n'ont pas encore été traités)
+        securoc_mask = no_block_mask & (result_df['Type'] == 'SECUROC') & (result_df['Stock_Status'] == 'x')
+        securoc_materials = securoc_df['Y Material'].unique() if 'Y Material' in securoc_df.columns else []
+
+        for idx, row in result_df[securoc_mask].iterrows():
+            result_df.at[idx, 'Stock_Status'] = 'No dispo' if row['Y Material'] in securoc_materials else 'Dispo'
+
+        # Tri des produits SECUROC avec Stock_Status = 'x'
+        securoc_to_sort_mask = securoc_mask & (result_df['Stock_Status'] == 'x')
+        for material, group in result_df[securoc_to_sort_mask].groupby('Y Material'):
+            temp_group = group.copy()
+            sort_order = 1  # Réinitialisation du compteur pour chaque groupe
+            temp_group = temp_group.sort_values('Created on', ascending=True, kind='stable')
+
+            # Tri par date
+            for date, date_group in temp_group.groupby('Created on'):
+                # Si plusieurs commandes à la même date
+                if len(date_group) > 1:
+                    all_rw = all(str(x).startswith("RW") for x in date_group['Sales Document'])
+                    all_numeric = all(not str(x).startswith("RW") for x in date_group['Sales Document'])
+
+                    if all_rw:
+                        # Pour les commandes RW, trier par les 5 derniers chiffres
+                        date_group['numeric_part'] = date_group['Sales Document'].apply(
+                            lambda x: int(str(x)[-5:]) if str(x)[-5:].isdigit() else float('inf')
+                        )
+                        sorted_indices = date_group.sort_values('numeric_part', ascending=True, kind='stable').index
+                    elif all_numeric:
+                        # Pour les commandes numériques, tri simple
+                        sorted_indices = date_group.sort_values('Sales Document', ascending=True, kind='stable').index
+                    else:
+                        # Si mélange de types, tri par valeur totale de commande
+                        sorted_indices = date_group.sort_values('Total Value Order', ascending=False, kind='stable').index
+                else:
+                    sorted_indices = date_group.index
+
+                # Attribution des Sort_Order pour ce groupe de date
+                for idx in sorted_indices:
+                    result_df.at[idx, 'Sort_Order'] = sort_order
+                    sort_order += 1
+
+        # 📌 Gestion des Produits No Block et non SECUROC (hors M80) qui n'ont pas encore été traités
+        non_securoc_mask = (no_block_mask &
+                          ~result_df['MRP Controller'].isin(['M80']) &
+                          (result_df['Type'] != 'SECUROC') &
+                          (result_df['Stock_Status'] == 'x'))
+
+        for material, group in result_df[non_securoc_mask].groupby('Y Material'):
+            temp_group = group.copy()
+            sort_order = 1  # Réinitialisation du compteur pour chaque groupe
+            remaining_quantity = temp_group.iloc[0]['On Hand Qty']
+            temp_group = temp_group.sort_values('Created on', ascending=True, kind='stable')
+
+            # Tri par date
+            for date, date_group in temp_group.groupby('Created on'):
+                # Si plusieurs commandes à la même date
+                if len(date_group) > 1:
+                    all_rw = all(str(x).startswith("RW") for x in date_group['Sales Document'])
+                    all_numeric = all(not str(x).startswith("RW") for x in date_group['Sales Document'])
+
+                    if all_rw:
+                        # Pour les commandes RW, trier par les 5 derniers chiffres
+                        date_group['numeric_part'] = date_group['Sales Document'].apply(
+                            lambda x: int(str(x)[-5:]) if str(x)[-5:].isdigit() else float('inf')
+                        )
+                        sorted_indices = date_group.sort_values('numeric_part', ascending=True, kind='stable').index
+                    elif all_numeric:
+                        # Pour les commandes numériques, tri simple
+                        sorted_indices = date_group.sort_values('Sales Document', ascending=True, kind='stable').index
+                    else:
+                        # Si mélange de types, tri par valeur totale de commande
+                        sorted_indices = date_group.sort_values('Total Value Order', ascending=False, kind='stable').index
+                else:
+                    sorted_indices = date_group.index
+
+                # Attribution des Sort_Order et calcul des disponibilités
+                for idx in sorted_indices:
+                    row = temp_group.loc[idx]
+                    result_df.at[idx, 'Sort_Order'] = sort_order
+                    sort_order += 1
+
+                    if remaining_quantity > 0:
+                        if remaining_quantity >= row['Qte_sales']:
+                            result_df.at[idx, 'Stock_Status'] = 'Dispo'
+                            remaining_quantity -= row['Qte_sales']
+                        else:
+                            result_df.at[idx, 'Stock_Status'] = 'No dispo'
+                            remaining_quantity -= row['Qte_sales']
+                    else:
+                        result_df.at[idx, 'Stock_Status'] = 'No dispo'
+                        remaining_quantity = -row['Qte_sales']
+
+                    result_df.at[idx, 'Remaining_Quantity'] = remaining_quantity
+
+        # 📦 Gestion des Kits (MRP Controller == M80)
+        m80_mask = no_block_mask & (result_df['MRP Controller'] == 'M80') & (result_df['Stock_Status'] == 'x')
+        for idx, row in result_df[m80_mask].iterrows():
+            result_df.at[idx, 'Sort_Order'] = 0
+            kit_number = row['Y Material']
+            kit_components = kits_df[kits_df['Y Material'] == kit_number]
+
+            all_available = True
+            for _, kit_row in kit_components.iterrows():
+                component_rows = result_df[
+                    (result_df['Y Material'] == kit_row['Component']) &
+                    (result_df['Sales Document'] == row['Sales Document'])
+                ]
+
+                if component_rows.empty or component_rows['Stock_Status'].values[0] != 'Dispo':
+                    all_available = False
+                    break
+
+            result_df.at[idx, 'Stock_Status'] = 'Dispo' if all_available else 'No dispo'
+
+        return result_df
+
+    except Exception as e:
+        print(f"Erreur détaillée: {str(e)}")  # Pour le debugging
+        return f"🔴 Unexpected Error: {type(e).__name__}: {e}"
+    
+
+
+def update_stock_status(result_df, export_df, kits_df, securoc_df):
+    """
+    Met à jour les statuts de stock en fonction des commandes fournisseurs et des livraisons prévues.
+    Version mise à jour: 
+    - Traite uniquement les lignes No Block et No dispo
+    - Exclut les MRP Controller M50 et M32
+    - Les lignes déjà traitées dans df1 ne sont pas revues
+    """
+    try:
+        # Convertir les dates pour éviter les erreurs
+        result_df['Created on'] = pd.to_datetime(result_df['Created on'], format='%m/%d/%Y', errors='coerce')
+        export_df['Delivery date'] = pd.to_datetime(export_df['Delivery date'], format='%m/%d/%Y', errors='coerce')
+
+        # Ajouter les nouvelles colonnes
+        result_df['Updated_Stock_Status'] = result_df['Stock_Status']
+        result_df['Last_Delivery_Date'] = result_df['Created on']
+        result_df['Updated_Remaining_Quantity'] = result_df['Remaining_Quantity']
+
+        # 1. Garder les produits Completed, Block, Dispo et Potentiellement dispo inchangés
+        completed_mask = result_df['Stock_Status'] == 'Completed'
+        block_mask = result_df['Stock_Status'] == 'Block'
+        dispo_mask = result_df['Stock_Status'] == 'Dispo'
+        
+        unchanged_mask = completed_mask | block_mask | dispo_mask
+        result_df.loc[unchanged_mask, 'Updated_Stock_Status'] = result_df['Stock_Status']
+        result_df.loc[unchanged_mask, 'Last_Delivery_Date'] = result_df['Created on']
+        result_df.loc[unchanged_mask, 'Updated_Remaining_Quantity'] = result_df['Remaining_Quantity']
+
+        potentiellement_dispo_mask = result_df['Stock_Status'] == 'Potentiellement dispo'
+        
+        for idx, row in result_df[potentiellement_dispo_mask].iterrows():
+            vendor_po = str(row['Vendor PO #'])
+            y_material = row['Y Material']
+            
+            if vendor_po != '-':
+                # Trouver la ligne correspondante dans export_df
+                for _, export_row in export_df.iterrows():
+                    if (export_row['Purchasing Document'] == vendor_po and 
+                        export_row['Y Material'] == y_material):
+                        delivery_date = export_row['Delivery date']
+                        result_df.loc[idx, 'Last_Delivery_Date'] = delivery_date
+                        result_df.loc[idx, 'Updated_Stock_Status'] = 'Potentiellement dispo'
+
+        # 2. Filtrer uniquement pour les produits No Block et No dispo, en excluant M50 et M32
+        no_block_no_dispo_mask = (
+            (result_df['Stock_Status'] == 'No dispo') & 
+            (result_df['Statut'] == 'No Block') &
+            (result_df['MRP Controller'] != 'M50') &
+            (result_df['MRP Controller'] != 'M32')
+        )
+        
+        # Créons une liste des combinaisons Vendor PO + Y Material déjà traitées
+        already_processed = set()
+        for idx, row in result_df[potentiellement_dispo_mask].iterrows():
+            vendor_po = str(row['Vendor PO #'])
+            y_material = row['Y Material']
+            if vendor_po != '-':
+                already_processed.add((vendor_po, y_material))
+        
+        # Filtrer les lignes d'export_df qui ont déjà été traitées
+        filtered_export_df = export_df.copy()
+        rows_to_drop = []
+        
+        for idx, row in filtered_export_df.iterrows():
+            purchasing_doc = row['Purchasing Document']
+            y_material = row['Y Material']
+            if (purchasing_doc, y_material) in already_processed:
+                rows_to_drop.append(idx)
+        
+        filtered_export_df = filtered_export_df.drop(rows_to_drop)
+        
+        # 2.1 Gérer les produits SECUROC
+        securoc_mask = no_block_no_dispo_mask & (result_df['Type'] == 'SECUROC') & (result_df['MRP Controller'] != 'M80')
+
+        # Obtenir tous les composants uniques de SECUROC
+        all_components = securoc_df['Component'].unique()
+
+        # Dictionnaire pour stocker le stock restant de chaque composant
+        component_stock = {comp: 0 for comp in all_components}
+        # Dictionnaire pour stocker l'index de livraison courant
+        delivery_indexes = {comp: 0 for comp in all_components}
+        # Dictionnaire pour stocker les livraisons de chaque composant
+        component_deliveries = {}
+
+        # Précharger toutes les livraisons de composants (en utilisant filtered_export_df)
+        for component in all_components:
+            component_deliveries[component] = filtered_export_df[
+                filtered_export_df['Y Material'] == component
+            ].sort_values('Delivery date', kind='stable').reset_index(drop=True)
+
+        # Trier les YMaterials de SECUROC par date de création
+        securoc_ymaterials = securoc_df['Y Material'].unique()
+        securoc_products = result_df[
+            securoc_mask & 
+            result_df['Y Material'].isin(securoc_ymaterials)
+        ].sort_values(by=['Created on'], kind='stable').reset_index()
+
+        # Traiter chaque produit SECUROC dans l'ordre
+        for idx, product in securoc_products.iterrows():
+            ymaterial = product['Y Material']
+            required_qty = abs(product['Qte_sales'])  # Utiliser Qte_sales au lieu de ATP QTY
+            product_idx = product['index']  # Index original dans result_df
+            
+            # Obtenir tous les composants nécessaires pour ce YMaterial
+            needed_components = securoc_df[securoc_df['Y Material'] == ymaterial]['Component'].unique()
+            
+            all_components_available = True
+            component_status = {}
+            latest_delivery_date = None
+            
+            # Vérifier et mettre à jour la disponibilité de chaque composant
+            for component in needed_components:
+                is_available = False
+                delivery_date = None
+                
+                # Vérifier si le stock restant est suffisant
+                if component_stock[component] >= required_qty:
+                    is_available = True
+                    # Utiliser la date de la dernière livraison utilisée
+                    delivery_date = component_deliveries[component].iloc[delivery_indexes[component]-1]['Delivery date'] if delivery_indexes[component] > 0 else None
+                else:
+                    # Récupérer les livraisons de ce composant
+                    comp_deliveries = component_deliveries[component]
+                    total_deliveries = len(comp_deliveries)
+                    current_idx = delivery_indexes[component]
+                    
+                    # Ajouter des livraisons jusqu'à couvrir la quantité requise
+                    while current_idx < total_deliveries and component_stock[component] < required_qty:
+                        delivery = comp_deliveries.iloc[current_idx]
+                        component_stock[component] += delivery['Qty_Purchasing']
+                        delivery_date = delivery['Delivery date']
+                        current_idx += 1
+                        
+                        if component_stock[component] >= required_qty:
+                            is_available = True
+                            # Mettre à jour l'index pour la prochaine utilisation
+                            delivery_indexes[component] = current_idx
+                            break
+                
+                # Si le composant n'est pas disponible, le produit ne peut pas être disponible
+                if not is_available:
+                    all_components_available = False
+                
+                # Mettre à jour le statut du composant pour ce produit
+                component_status[component] = {
+                    'available': is_available,
+                    'date': delivery_date
+                }
+                
+                # Mettre à jour la date de livraison la plus tardive
+                if is_available and delivery_date:
+                    if latest_delivery_date is None or delivery_date > latest_delivery_date:
+                        latest_delivery_date = delivery_date
+            
+            # Mettre à jour le statut du produit
+            if all_components_available:
+                result_df.loc[product_idx, 'Updated_Stock_Status'] = 'Potentiellement dispo'
+                result_df.loc[product_idx, 'Last_Delivery_Date'] = latest_delivery_date
+                
+                # Déduire les quantités des stocks de composants
+                for component in needed_components:
+                    component_stock[component] -= required_qty
+            else:
+                result_df.loc[product_idx, 'Updated_Stock_Status'] = 'No dispo'
+                result_df.loc[product_idx, 'Last_Delivery_Date'] = None
+
+        # 2.2 Gérer les produits No Block (non SECUROC et non M80)
+        no_kit_mask = (no_block_no_dispo_mask & 
+                    (result_df['MRP Controller'] != 'M80') & 
+                    (result_df['Type'] != 'SECUROC'))
+
+        grouped_products = result_df[no_kit_mask].groupby('Y Material')
+        # Utiliser filtered_export_df au lieu de export_df pour les livraisons
+        grouped_deliveries = filtered_export_df.groupby('Y Material')
+
+        for material, product_group in grouped_products:
+            # Vérifier si le matériel a des livraisons
+            if material not in grouped_deliveries.groups:
+                # Pas de livraisons disponibles, tous les produits restent non disponibles
+                for idx, prod_row in product_group.iterrows():
+                    result_df.at[idx, 'Updated_Stock_Status'] = 'No dispo'
+                    result_df.at[idx, 'Last_Delivery_Date'] = prod_row['Created on']
+                    result_df.at[idx, 'Updated_Remaining_Quantity'] = prod_row['Remaining_Quantity']
+                continue
+            
+            # Trier les produits par ordre de priorité et les livraisons par date
+            product_group = product_group.sort_values(by=['Sort_Order'], kind='stable')
+            delivery_group = grouped_deliveries.get_group(material).sort_values(by=['Delivery date'], kind='stable')
+            
+            # Calculer la somme totale des quantités de livraison disponibles
+            total_delivery_qty = delivery_group['Qty_Purchasing'].sum()
+            remaining_delivery_qty = total_delivery_qty  # Quantité de livraison restante
+            
+            # Initialiser les variables pour suivre les livraisons à travers les produits
+            deliv_idx = 0
+            qty_accumulated = 0
+            last_delivery_date = None  # Stocke la date de la dernière livraison utilisée
+            delivery_array = delivery_group.to_dict('records')
+            
+            # Parcourir chaque produit pour ce matériel
+            for idx, prod_row in product_group.iterrows():
+                current_remaining = prod_row['Remaining_Quantity']  # Déjà négatif par défaut
+                needed_qty = abs(current_remaining)  # Quantité nécessaire (positive)
+                
+                # Vérifier si la quantité accumulée des livraisons précédentes peut déjà couvrir ce produit
+                if qty_accumulated >= needed_qty:
+                    # Ce produit peut être potentiellement disponible avec la quantité déjà accumulée
+                    delivery_date = last_delivery_date
+                    
+                    # Mettre à jour les informations du produit
+                    new_remaining = remaining_delivery_qty - needed_qty
+                    result_df.at[idx, 'Updated_Stock_Status'] = 'Potentiellement dispo'
+                    result_df.at[idx, 'Last_Delivery_Date'] = delivery_date
+                    result_df.at[idx, 'Updated_Remaining_Quantity'] = new_remaining
+                    
+                    # Mettre à jour la quantité de livraison restante pour les produits suivants
+                    remaining_delivery_qty = new_remaining
+                    
+                    # Soustraire la quantité nécessaire pour ce produit de la quantité accumulée
+                    qty_accumulated -= needed_qty
+                
+                # Vérifier si la quantité restante de livraison peut couvrir ce produit
+                elif remaining_delivery_qty >= needed_qty:
+                    # Ce produit peut être potentiellement disponible
+                    delivery_date = None
+                    
+                    # Continuer à parcourir les livraisons à partir du point où nous nous sommes arrêtés
+                    while deliv_idx < len(delivery_array):
+                        # Si la quantité accumulée est déjà suffisante pour ce produit
+                        if qty_accumulated >= needed_qty:
+                            delivery_date = delivery_array[deliv_idx - 1]['Delivery date']
+                            break
+                        
+                        # Sinon, accumuler la quantité de la livraison actuelle
+                        deliv_row = delivery_array[deliv_idx]
+                        qty_accumulated += deliv_row['Qty_Purchasing']
+                        last_delivery_date = deliv_row['Delivery date']  # Mettre à jour la dernière date de livraison
+                        
+                        # Si cette livraison nous fait dépasser le seuil
+                        if qty_accumulated >= needed_qty:
+                            delivery_date = deliv_row['Delivery date']
+                            deliv_idx += 1
+                            break
+                        
+                        deliv_idx += 1
+                    
+                    # Si nous avons parcouru toutes les livraisons sans trouver de date
+                    if delivery_date is None and deliv_idx > 0:
+                        delivery_date = delivery_array[deliv_idx - 1]['Delivery date']
+                    
+                    # Mettre à jour les informations du produit
+                    new_remaining = remaining_delivery_qty - needed_qty
+                    result_df.at[idx, 'Updated_Stock_Status'] = 'Potentiellement dispo'
+                    result_df.at[idx, 'Last_Delivery_Date'] = delivery_date
+                    result_df.at[idx, 'Updated_Remaining_Quantity'] = new_remaining
+                    
+                    # Mettre à jour la quantité de livraison restante pour les produits suivants
+                    remaining_delivery_qty = new_remaining
+                    
+                    # Soustraire la quantité nécessaire pour ce produit de la quantité accumulée
+                    qty_accumulated -= needed_qty
+                else:
+                    # Pas assez de quantité pour ce produit
+                    new_remaining = remaining_delivery_qty - needed_qty  # Sera négatif
+                    result_df.at[idx, 'Updated_Stock_Status'] = 'No dispo'
+                    result_df.at[idx, 'Last_Delivery_Date'] = prod_row['Created on']
+                    result_df.at[idx, 'Updated_Remaining_Quantity'] = new_remaining
+            
+            # Nous gardons la quantité accumulée pour les prochains produits même si celui-ci est "No dispo"
+        # 2.3 Gérer les kits No Block et MRP Controller == M80
+        m80_mask = no_block_no_dispo_mask & (result_df['MRP Controller'] == 'M80')
+        for idx, row in result_df[m80_mask].iterrows():
+            kit_number = row['Y Material']
+            kit_components = kits_df[kits_df['Y Material'] == kit_number]
+            all_available = True
+
+            for _, kit_row in kit_components.iterrows():
+                component_rows = result_df[(result_df['Y Material'] == kit_row['Component']) &
+                                           (result_df['Sales Document'] == row['Sales Document'])]
+
+                if component_rows.empty or component_rows['Updated_Stock_Status'].values[0] != 'Potentiellement dispo':
+                    all_available = False
+                    break
+
+            result_df.at[idx, 'Updated_Stock_Status'] = 'Potentiellement dispo' if all_available else 'No dispo'
+
+        return result_df
+
+    except Exception as e:
+        print(f"Erreur détaillée: {str(e)}")  # Pour le debugging
+        return f"🔴 Unexpected Error: {type(e).__name__}: {e}"
+
+def process_backlog_data(backlog, salesUOM, export, Puom, kit, MRP, securoc_df):
+    try:
+        # Convertir tous les Sales Document en chaînes de caractères
+        backlog['Sales Document'] = backlog['Sales Document'].astype(str)
+        backlog = backlog.iloc[1:]
+
+
+        # Préparer le fichier Securoc
+        securoc_df = securoc_df[['Material', 'Pegged reqmt']]
+        securoc_df = securoc_df.rename(columns={'Material': 'Component', 'Pegged reqmt': 'Y Material'})
+
+        # Vérifier les colonnes requises dans le fichier backlog
+        required_columns = ['Y Material', 'Sales Document', 'Created on', 'Open Value']
+        missing_columns = [col for col in required_columns if col not in backlog.columns]
+        if missing_columns:
+            raise ValueError(f"Colonnes manquantes dans le fichier backlog: {missing_columns}")
+
+        # Nettoyer le fichier Kit
+        kit = kit.rename(columns={'Header': 'Y Material'})
+        kit = kit[['Y Material', 'Header MRP Controller', 'Component']]
+
+        # Prétraitement des fichiers
+        backlog = backlog.replace('pak', 'pac')
+        backlog = backlog[backlog['Y Material'] != 'Y4963053']
+
+        # Sélection des colonnes nécessaires
+        colonnes = [
+            'Created on', 'Sales Document', 'Requested Delivery Date', 'Sales UOM', 'Base UOM',
+            'Header Delivery Block', 'Line Delivery Block', 'Y Material', 'MRP Controller',
+            'MRP Group', 'Vendor PO #', 'Open Value', 'Open Order Quantity', 'On Hand Qty',
+            'Delivery Qty - Complete', 'ATP QTY','DropShip'
+        ]
+        missing_cols = [col for col in colonnes if col not in backlog.columns]
+        if missing_cols:
+            raise ValueError(f"Colonnes manquantes dans le fichier backlog: {missing_cols}")
+        backlog = backlog[colonnes].copy()
+
+        # Créer un identifiant unique pour chaque ligne du backlog
+        backlog['original_index'] = backlog.index
+
+        # Fusion avec MRP pour obtenir les types
+        if 'MRP Controller' not in MRP.columns or 'Type' not in MRP.columns:
+            raise ValueError("Le fichier MRP doit contenir les colonnes 'MRP Controller' et 'Type'")
+        MRP = MRP[['MRP Controller', 'Type']]
+        mrp_dict = MRP.set_index('MRP Controller')['Type'].to_dict()
+        backlog['Type'] = backlog['MRP Controller'].map(mrp_dict)
+
+        # Traitement des types spéciaux
+        backlog.loc[(backlog['MRP Controller'] == 'M70') & (backlog['Y Material'] == 'Y4950101'), 'Type'] = 'SECUROC'
+        backlog.loc[(backlog['MRP Controller'] == 'M70') & (backlog['Y Material'] == 'Y4950100'), 'Type'] = 'BUY'
+
+        # Préparer le fichier Sales UOM
+        salesUOM = salesUOM.rename(columns={'Étiquettes de lignes': 'Y Material'})
+        salesUOM = salesUOM.drop('Alternative Unit of Measure', axis=1)
+
+        # Vérifier les colonnes requises dans le fichier Sales UOM
+        required_sales_cols = ['Y Material', 'Counter']
+        if not all(col in salesUOM.columns for col in required_sales_cols):
+            raise ValueError("Le fichier Sales UOM doit contenir les colonnes 'Y Material' et 'Counter'")
+        backlog = pd.merge(backlog, salesUOM, on='Y Material', how='left')
+
+        # Remplacer les valeurs NaN dans Counter par 1 (pour les matériels qui ne sont pas dans salesUOM)
+        backlog['Counter'] = backlog['Counter'].fillna(1)
+
+        # Préparer le fichier Export
+        required_export_cols = ['Purchasing Document', 'Delivery date', 'Y Material', 'Order Unit', 'Sch Opn Qty']
+        export = export.rename(columns={'Material': 'Y Material'})
+        export = export[required_export_cols]
+
+        # Initialiser et calculer Qte_sales
+        backlog['Qte_sales'] = 0.0
+        try:
+            backlog.loc[(backlog['Sales UOM'] == 'EA') & (backlog['Base UOM'] == 'PC'), 'Qte_sales'] = backlog['Open Order Quantity'].astype(float)
+            backlog.loc[(backlog['Sales UOM'] == 'PC') & (backlog['Base UOM'] == 'EA'), 'Qte_sales'] = backlog['Open Order Quantity'].astype(float)
+            backlog.loc[backlog['Sales UOM'] == backlog['Base UOM'], 'Qte_sales'] = backlog['Open Order Quantity'].astype(float)
+            backlog.loc[backlog['Sales UOM'] != backlog['Base UOM'], 'Qte_sales'] = (backlog['Open Order Quantity'] * backlog['Counter']).astype(float)
+        except Exception as e:
+            raise ValueError(f"Erreur lors du calcul de Qte_sales: {str(e)}")
+
+        # Préparer le fichier PUOM
+        required_puom_cols = ['Material', 'Order Unit', 'PUOM', 'Base UOM']
+        if not all(col in Puom.columns for col in required_puom_cols):
+            raise ValueError(f"Colonnes manquantes dans le fichier Puom: {[col for col in required_puom_cols if col not in Puom.columns]}")
+        Puom = Puom.rename(columns={'Material': 'Y Material'})
+        Puom = Puom[['Y Material', 'Order Unit', 'PUOM', 'Base UOM']]
+
+        # Fusionner Export et PUOM
+        SuppOrder = pd.merge(export, Puom, on='Y Material', how='left')
+        SuppOrder['Order Unit_y'] = SuppOrder['Order Unit_y'].fillna('PC')
+        SuppOrder['Base UOM'] = SuppOrder['Base UOM'].fillna('PC')
+        SuppOrder['PUOM'] = SuppOrder['PUOM'].fillna(1)
+        SuppOrder['Qty_Purchasing'] = SuppOrder['PUOM'] * SuppOrder['Sch Opn Qty']
+        colonneSuppOrder = ['Purchasing Document', 'Y Material', 'Delivery date', 'Base UOM', 'Qty_Purchasing']
+        SuppOrder = SuppOrder[colonneSuppOrder]
+
+        # Déterminer le statut des lignes backlog
+        backlog.loc[(backlog['Open Order Quantity'] == backlog['Delivery Qty - Complete']), 'Statut'] = 'Completed'
+        backlog.loc[(backlog['Open Order Quantity'] != backlog['Delivery Qty - Complete']) &
+                    (backlog['Header Delivery Block'] == 'No Block') &
+                    (backlog['Line Delivery Block'] == 'No Block'), 'Statut'] = 'No Block'
+        backlog.loc[backlog['Statut'].isnull(), 'Statut'] = 'Block'
+
+        # Vérifier la disponibilité des stocks
+        resultat = check_stock_availability(backlog, SuppOrder, kit, securoc_df)
+        if isinstance(resultat, str):
+            raise ValueError(f"Erreur dans check_stock_availability: {resultat}")
+
+        # Mettre à jour les statuts des stocks
+        merged_df = update_stock_status(resultat, SuppOrder, kit, securoc_df)
+        if isinstance(merged_df, str):
+            raise ValueError(f"Erreur dans update_stock_status: {merged_df}")
+
+
+        # Finalisation du traitement
+        merged_df['Sales Document'] = merged_df['Sales Document'].astype(str)
+        merged_df['Total Value Order'] = merged_df.groupby('Sales Document')['Open Value'].transform('sum')
+
+         # Fonction pour déterminer le type de commande
+        def determine_order_type(group):
+            statuses = set(group)
+            
+            # Block si au moins une ligne est Block
+            if 'Block' in statuses:
+                return 'Block'
+            
+            # No dispo si au moins une ligne est No dispo
+            elif 'No dispo' in statuses:
+                return 'No dispo'
+            
+            # Completed si toutes les lignes sont Completed
+            elif statuses == {'Completed'}:
+                return 'Completed'
+            
+            # Dispo si toutes les lignes sont Dispo ou (on trouve Dispo et Completed)
+            elif statuses == {'Dispo'} or statuses == {'Dispo', 'Completed'}:
+                return 'Dispo'
+            
+            # Potentiellement dispo dans plusieurs cas
+            elif (statuses == {'Potentiellement dispo'} or  # toutes potentiellement dispo
+                statuses == {'Potentiellement dispo', 'Dispo'} or  # potentiellement dispo et dispo
+                statuses == {'Potentiellement dispo', 'Completed'} or  # potentiellement dispo et completed
+                statuses == {'Potentiellement dispo', 'Dispo', 'Completed'}):  # les trois types
+                return 'Potentiellement dispo'
+            
+            # Autres cas
+            else:
+                return 'Others'
+
+        # Application de la logique de type de commande mise à jour
+        merged_df['Order_Type'] = merged_df.groupby('Sales Document')['Updated_Stock_Status'].transform(
+            lambda x: determine_order_type(x)
+        )
+
+        merged_df['Last_Delivery_Date'] = merged_df.groupby('Sales Document')['Last_Delivery_Date'].transform('max')
+
+
+        # Nettoyage final
+        merged_df = merged_df.sort_values('original_index', kind='stable')
+        merged_df = merged_df.drop('original_index', axis=1)
+
+        return merged_df
+
+    except Exception as e:
+        print(f"Erreur détaillée dans process_backlog_data: {str(e)}")
+        raise Exception(f"Erreur lors du traitement des données: {str(e)}")
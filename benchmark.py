@@ -0,0 +1,98 @@
+"""
+Mesure du traitement à différentes tailles de backlog, sur des extractions synthétiques (voir synthetic.py).
+
+Pour chaque taille : un passage chronométré, puis un passage sous tracemalloc pour le pic mémoire
+de chaque étape (tracemalloc ralentit le traitement, ses durées ne sont pas retenues).
+
+Exemples :
+    python benchmark.py
+    python benchmark.py --sizes 10000 100000 --json resultats_benchmark.json
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+import backlog
+from pipeline import process_backlog_data
+from profiling import format_timings, record_stages, stage
+from synthetic import generate_backlog_lines
+
+DEFAULT_SIZES = [10000, 100000, 1000000]
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Mesure du traitement sur des backlogs synthétiques")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help="Nombres de lignes de backlog (par défaut : 10000 100000 1000000)")
+    parser.add_argument('--seed', type=int, default=0, help="Graine du générateur")
+    parser.add_argument('--skip-memory', action='store_true', help="Ne pas mesurer le pic mémoire")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Nombre de processus pour l'allocation par matériel (par défaut : 1)")
+    parser.add_argument('--json', dest='json_path', help="Fichier JSON où enregistrer les mesures")
+    return parser.parse_args(argv)
+
+def _run(inputs):
+    # Étape englobante : son pic mémoire est celui de tout le traitement
+    with record_stages() as timings:
+        start = time.perf_counter()
+        with stage('Traitement complet', rows_in=len(inputs['Backlog'])) as timing:
+            merged_df = process_backlog_data(
+                inputs['Backlog'], inputs['Sales UOM'], inputs['Orders'], inputs['PUOM'],
+                inputs['Kits'], inputs['MRP'], inputs['Securoc']
+            )
+            timing['rows_out'] = len(merged_df)
+        wall = time.perf_counter() - start
+    return merged_df, timings, wall
+
+def benchmark_size(n_lines, seed=0, measure_memory=True):
+    """
+    Mesures du traitement complet pour un backlog synthétique d'environ n_lines lignes
+    """
+    inputs = generate_backlog_lines(n_lines, seed=seed)
+    merged_df, timings, wall = _run(inputs)
+
+    if measure_memory:
+        tracemalloc.start()
+        try:
+            _, memory_timings, _ = _run(inputs)
+            peak_mb = memory_timings[0]['peak_mb']
+        finally:
+            tracemalloc.stop()
+        # Les deux passages exécutent les mêmes étapes, dans le même ordre
+        for timing, memory_timing in zip(timings, memory_timings):
+            timing['peak_mb'] = memory_timing.get('peak_mb', 0.0)
+    else:
+        peak_mb = None
+
+    return {
+        'lines': len(inputs['Backlog']) - 1,
+        'orders': merged_df['Sales Document'].nunique(),
+        'wall_seconds': wall,
+        'peak_mb': peak_mb,
+        'stages': timings
+    }
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.workers is not None:
+        backlog.ALLOCATION_WORKERS = args.workers
+
+    results = []
+    for n_lines in args.sizes:
+        result = benchmark_size(n_lines, seed=args.seed, measure_memory=not args.skip_memory)
+        results.append(result)
+        print(f"\n=== {result['lines']} lignes, {result['orders']} commandes ===")
+        print(format_timings(result['stages']))
+        summary = f"Durée totale : {result['wall_seconds']:.3f} s"
+        if result['peak_mb'] is not None:
+            summary += f", pic mémoire : {result['peak_mb']:.1f} Mo"
+        print(summary)
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
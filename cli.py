@@ -0,0 +1,161 @@
+"""
+Traitement du backlog en ligne de commande, sans interface (ni streamlit ni plotly).
+
+Exemples :
+    python cli.py dossier_exports/ --output resultats/ --format xlsx parquet
+    python cli.py --backlog Backlog.xlsx --sales-uom SalesUOM.xlsx --orders ZMM13.xlsx \\
+        --puom PUOM.xlsx --kits Kits.xlsx --mrp MRP.xlsx --securoc Securoc.xlsx
+"""
+import argparse
+import io
+import os
+import sys
+import tracemalloc
+
+import backlog
+from ingestion import file_digest, load_workbooks
+from pipeline import ENGINES, REFERENCE_FILES, build_order_summary, process_backlog_data, run_pipeline
+from profiling import format_timings, record_stages, stage, timings_to_json
+from reference_store import latest_reference_digests, resolve_references
+from report import REPORT_TABLES, report_tables, write_table, write_xlsx
+
+# Fichier attendu -> option de la ligne de commande et mots-clés reconnus dans un nom de fichier
+INPUT_FILES = {
+    'Backlog': ('backlog', ['backlog']),
+    'Sales UOM': ('sales_uom', ['sales']),
+    'Orders': ('orders', ['orders', 'zmm13']),
+    'PUOM': ('puom', ['puom']),
+    'Kits': ('kits', ['kit']),
+    'MRP': ('mrp', ['mrp']),
+    'Securoc': ('securoc', ['securoc'])
+}
+OUTPUT_FORMATS = ['xlsx', 'parquet', 'csv']
+
+def find_input_files(directory):
+    """
+    Associe chaque fichier attendu à un classeur .xlsx du dossier, d'après son nom
+    """
+    workbooks = [name for name in sorted(os.listdir(directory))
+                 if name.lower().endswith('.xlsx') and not name.startswith('~$')]
+    found = {}
+    for name, (_, keywords) in INPUT_FILES.items():
+        matches = [workbook for workbook in workbooks
+                   if any(keyword in workbook.lower() for keyword in keywords)]
+        if len(matches) > 1:
+            raise ValueError(f"Plusieurs fichiers possibles pour {name} dans {directory}: {matches}")
+        if matches:
+            found[name] = os.path.join(directory, matches[0])
+    return found
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Traitement du backlog sans interface")
+    parser.add_argument('directory', nargs='?', help="Dossier contenant les sept classeurs .xlsx")
+    for name, (option, _) in INPUT_FILES.items():
+        parser.add_argument(f"--{option.replace('_', '-')}", dest=option, help=f"Fichier {name}")
+    parser.add_argument('--output', default='.', help="Dossier de sortie (par défaut : dossier courant)")
+    parser.add_argument('--format', nargs='+', choices=OUTPUT_FORMATS, default=['xlsx'], dest='formats',
+                        help="Formats de sortie")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Nombre de processus pour l'allocation par matériel (par défaut : 1)")
+    parser.add_argument('--engine', choices=ENGINES, default='optimized',
+                        help="Moteur de traitement ; legacy : moteur d'origine, lent, conservé comme référence")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="Mesurer le pic mémoire de chaque étape (tracemalloc, ralentit le traitement)")
+    parser.add_argument('--profile-json', help="Fichier JSON où enregistrer les mesures par étape")
+    return parser.parse_args(argv)
+
+def resolve_input_paths(args):
+    """
+    Chemins des fichiers d'entrée : options explicites, sinon recherche dans le dossier.
+    Les fichiers de référence absents sont repris du stock local s'ils y ont été enregistrés.
+    """
+    paths = find_input_files(args.directory) if args.directory else {}
+    for name, (option, _) in INPUT_FILES.items():
+        if getattr(args, option):
+            paths[name] = getattr(args, option)
+
+    # Le moteur d'origine ne sait pas relire les références du stock local
+    stored_references = latest_reference_digests() if args.engine != 'legacy' else {}
+    missing = [name for name in INPUT_FILES
+               if name not in paths and not (name in REFERENCE_FILES and name in stored_references)]
+    if missing:
+        raise ValueError(f"Fichiers manquants: {missing}")
+    return paths, stored_references
+
+def write_outputs(merged_df, orders_df, output_dir, formats):
+    """
+    Écrit le rapport (lignes, commandes, détail No dispo, prévision mensuelle) dans chacun des formats
+    demandés : un classeur multi-feuilles en xlsx, un fichier par table en Parquet et en CSV.
+    Retourne la liste des fichiers écrits.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    tables = report_tables(merged_df, orders_df)
+    written = []
+    if 'xlsx' in formats:
+        path = os.path.join(output_dir, 'Rapport_Backlog.xlsx')
+        write_xlsx(tables, path)
+        written.append(path)
+    for export_format in ('parquet', 'csv'):
+        if export_format in formats:
+            for name, df in tables.items():
+                path = os.path.join(output_dir, f"{REPORT_TABLES[name][1]}.{export_format}")
+                write_table(df, export_format, path)
+                written.append(path)
+    return written
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.workers is not None:
+        backlog.ALLOCATION_WORKERS = args.workers
+
+    if args.trace_memory:
+        tracemalloc.start()
+    try:
+        paths, stored_references = resolve_input_paths(args)
+
+        with record_stages() as timings:
+            with stage('Lecture des fichiers') as timing:
+                files = {}
+                for name, path in paths.items():
+                    with open(path, 'rb') as f:
+                        files[name] = io.BytesIO(f.read())
+                digests = {name: file_digest(file.getvalue()) for name, file in files.items()}
+                df_dict, _ = load_workbooks(files, digests)
+                timing['rows_out'] = sum(len(df) for df in df_dict.values())
+
+            if args.engine == 'legacy':
+                merged_df = process_backlog_data(*[df_dict[name] for name in INPUT_FILES], engine='legacy')
+                with stage('Synthèse des commandes'):
+                    orders_df = build_order_summary(merged_df)
+            else:
+                # Les références importées sont enregistrées : l'application pourra les reprendre sans import
+                with stage('Préparation des références'):
+                    for name in REFERENCE_FILES:
+                        if name not in digests:
+                            digests[name] = stored_references[name]
+                    references, _ = resolve_references(df_dict, digests)
+
+                merged_df, state = run_pipeline(df_dict, digests, references)
+                orders_df = state['orders']
+
+            with stage('Écriture des résultats'):
+                written = write_outputs(merged_df, orders_df, args.output, args.formats)
+
+    except Exception as e:
+        print(f"Erreur lors du traitement des données: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if args.trace_memory:
+            tracemalloc.stop()
+
+    print(format_timings(timings))
+    if args.profile_json:
+        with open(args.profile_json, 'w', encoding='utf-8') as f:
+            f.write(timings_to_json(timings, engine=args.engine, rows=len(merged_df), orders=len(orders_df)))
+    print(f"\n{len(merged_df)} lignes, {len(orders_df)} commandes")
+    for path in written:
+        print(f"→ {path}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,146 @@
+import numpy as np
+import pandas as pd
+
+from filters import ORDER_FILTERS, month_labels, order_line_codes, until_day
+
+# Dimensions du cube ; Order_Type et Delivery_Date (jour de Last_Delivery_Date) sont ceux de la commande
+CUBE_DIMENSIONS = ['Order_Type', 'Delivery_Date', 'Type', 'MRP Controller']
+# Types de commande comptés comme disponibles (colonne Available de la table des commandes)
+AVAILABLE_ORDER_TYPES = ['Dispo', 'Potentiellement dispo']
+# Période des graphiques selon l'étendue des dates (en jours) : jour jusqu'à 3 mois, semaine jusqu'à 2 ans, mois au-delà
+CHART_BUCKETS = [(92, 'D'), (731, 'W')]
+BUCKET_LABELS = {'D': 'jour', 'W': 'semaine', 'M': 'mois'}
+
+def cube_cells(merged_df, orders_df, line_codes=None):
+    """
+    Dimensions (codes entiers et valeurs distinctes ; pour Delivery_Date, jours en entiers et leur type datetime64)
+    et mesures de chaque ligne, calculées une fois et agrégées ensuite pour chaque filtre (voir aggregate_cells).
+    line_codes : position de la commande de chaque ligne de merged_df dans orders_df (voir filters.order_line_codes).
+    """
+    if line_codes is None:
+        line_codes = order_line_codes(orders_df, merged_df)
+    known = line_codes >= 0
+    order_type_codes, order_types = pd.factorize(orders_df['Order_Type'])
+    type_codes, types = pd.factorize(merged_df['Type'])
+    mrp_codes, mrp_controllers = pd.factorize(merged_df['MRP Controller'])
+    delivery_days = pd.DatetimeIndex(orders_df['Last_Delivery_Date']).normalize().to_numpy()
+
+    # Chaque commande est comptée sur sa première ligne
+    first_line = np.zeros(len(line_codes), dtype=bool)
+    first_line[np.flatnonzero(known)[np.unique(line_codes[known], return_index=True)[1]]] = True
+    order_values = orders_df['Total Value Order'].to_numpy(dtype=float)[line_codes]
+    return {
+        'known': known,
+        'dimensions': {
+            'Order_Type': (order_type_codes[line_codes], pd.Index(order_types)),
+            'Delivery_Date': (delivery_days[line_codes].view('int64'), delivery_days.dtype),
+            'Type': (type_codes, pd.Index(types)),
+            'MRP Controller': (mrp_codes, pd.Index(mrp_controllers))
+        },
+        'measures': {
+            'Lines': np.ones(len(line_codes), dtype=int),
+            'Open Value': merged_df['Open Value'].to_numpy(dtype=float),
+            'Orders': first_line.astype(int),
+            'Value': np.where(first_line, order_values, 0.0)
+        }
+    }
+
+def aggregate_cells(cells, rows=None):
+    """
+    Cube des lignes retenues (positions rows de commandes entières, toutes si None) :
+    une ligne par combinaison de CUBE_DIMENSIONS présente, avec les mesures cumulées
+    - Lines, Open Value : nombre et valeur ouverte des lignes
+    - Orders, Value : nombre de commandes et Total Value Order, chaque commande comptée une seule
+      fois, dans la cellule de sa première ligne ; ces deux mesures s'additionnent donc sur toutes
+      les dimensions (par Type ou MRP Controller, une commande compte pour celui de sa première ligne)
+    et Delivery_Month (AAAA-MM), Available (commande Dispo ou Potentiellement dispo).
+    """
+    rows = np.flatnonzero(cells['known']) if rows is None else rows[cells['known'][rows]]
+    frame = pd.DataFrame({name: codes[rows] for name, (codes, _) in cells['dimensions'].items()})
+    for name, values in cells['measures'].items():
+        frame[name] = values[rows]
+    # Regroupement sur les codes entiers, puis décodage des seules cellules du cube
+    cube = frame.groupby(CUBE_DIMENSIONS, sort=False).sum().reset_index()
+    for name, (_, uniques) in cells['dimensions'].items():
+        codes = cube[name].to_numpy()
+        if name == 'Delivery_Date':
+            cube[name] = codes.view(uniques)
+        else:
+            cube[name] = uniques.take(codes, allow_fill=True, fill_value=np.nan)
+    cube['Delivery_Month'] = month_labels(cube['Delivery_Date'])
+    cube['Available'] = cube['Order_Type'].isin(AVAILABLE_ORDER_TYPES).to_numpy()
+    return cube
+
+def build_cube(merged_df, orders_df):
+    """
+    Cube des indicateurs d'un jeu de lignes et de sa table des commandes (voir aggregate_cells)
+    """
+    return aggregate_cells(cube_cells(merged_df, orders_df))
+
+def build_filter_cubes(merged_df, orders_df, filter_index):
+    """
+    Cube de chaque filtre principal, calculé une fois par traitement : {libellé du filtre: cube}
+    """
+    cells = cube_cells(merged_df, orders_df, filter_index['line_codes'])
+    return {
+        label: aggregate_cells(cells, None if flag is None else filter_index['filters'][label][1])
+        for label, flag in ORDER_FILTERS.items()
+    }
+
+def cube_totals(cube, available=False, until=None):
+    """
+    Nombre de commandes et valeur totale (Total Value Order) d'un cube,
+    éventuellement limités aux commandes disponibles jusqu'au jour until inclus
+    """
+    mask = np.ones(len(cube), dtype=bool)
+    if available:
+        mask &= cube['Available'].to_numpy()
+    if until is not None:
+        mask &= until_day(cube['Delivery_Date'], until)
+    return int(cube['Orders'].to_numpy()[mask].sum()), float(cube['Value'].to_numpy()[mask].sum())
+
+def cube_by(cube, dimensions, measures=('Orders', 'Value')):
+    """
+    Mesures du cube cumulées par dimensions (cellules sans valeur pour une dimension exclues)
+    """
+    return cube.groupby(dimensions, sort=True)[list(measures)].sum().reset_index()
+
+def chart_bucket(dates):
+    """
+    Période de regroupement ('D', 'W' ou 'M') adaptée à l'étendue des dates (voir CHART_BUCKETS)
+    """
+    if dates.notna().sum() == 0:
+        return 'D'
+    span = (dates.max() - dates.min()).days
+    for max_days, bucket in CHART_BUCKETS:
+        if span <= max_days:
+            return bucket
+    return 'M'
+
+def bucket_start(dates, bucket):
+    """
+    Début de la période de chaque date : le jour, le lundi de la semaine ou le premier du mois
+    """
+    days = dates.to_numpy().astype('datetime64[D]')
+    if bucket == 'W':
+        # Le 1970-01-01 (jour 0) était un jeudi : (jour + 3) % 7 est le rang dans la semaine à partir du lundi
+        days = days - (days.astype('int64') + 3) % 7
+    elif bucket == 'M':
+        days = days.astype('datetime64[M]').astype('datetime64[D]')
+    return pd.DatetimeIndex(days)
+
+def availability_series(cube, measure, bucket=None):
+    """
+    Série des commandes Dispo et Potentiellement dispo par période et type de commande, en une seule
+    agrégation des cellules du cube. measure : 'Orders' ou 'Value' ; bucket : 'D', 'W' ou 'M'
+    (par défaut selon l'étendue des dates, voir chart_bucket).
+    Retourne (DataFrame Date / Order_Type / measure trié par date, bucket).
+    """
+    dispo = cube[cube['Available'].to_numpy() & cube['Delivery_Date'].notna().to_numpy()]
+    bucket = bucket or chart_bucket(dispo['Delivery_Date'])
+    periods = pd.DataFrame({
+        'Date': bucket_start(dispo['Delivery_Date'], bucket),
+        'Order_Type': dispo['Order_Type'].to_numpy(),
+        measure: dispo[measure].to_numpy()
+    })
+    return periods.groupby(['Date', 'Order_Type'], sort=True)[measure].sum().reset_index(), bucket
@@ -0,0 +1,141 @@
+"""
+Comparaison ligne à ligne du moteur optimisé avec le moteur d'origine (backlog_legacy.py).
+
+Les deux moteurs sont exécutés sur les mêmes entrées, générées (synthetic.py) ou enregistrées
+(dossier des sept classeurs .xlsx, comme pour cli.py), et chaque écart est listé.
+
+Exemples :
+    python equivalence.py --sizes 2000 5000 --seeds 0 1 2
+    python equivalence.py dossier_exports/
+"""
+import argparse
+import io
+import os
+import sys
+
+import pandas as pd
+
+from cli import find_input_files
+from ingestion import file_digest, load_workbooks
+from pipeline import process_backlog_data
+from synthetic import generate_backlog_lines
+
+# Colonnes qui doivent être identiques entre les deux moteurs
+COMPARED_COLUMNS = [
+    'Stock_Status', 'Sort_Order', 'Remaining_Quantity',
+    'Updated_Stock_Status', 'Last_Delivery_Date', 'Order_Type'
+]
+# Colonnes affichées pour situer une ligne en écart
+CONTEXT_COLUMNS = ['Sales Document', 'Y Material', 'MRP Controller', 'Type']
+INPUT_NAMES = ['Backlog', 'Sales UOM', 'Orders', 'PUOM', 'Kits', 'MRP', 'Securoc']
+
+def run_engine(inputs, engine):
+    """
+    Traitement complet d'un jeu d'entrées {nom du fichier: DataFrame} avec le moteur demandé
+    """
+    return process_backlog_data(*[inputs[name].copy() for name in INPUT_NAMES], engine=engine)
+
+def _same_values(reference, candidate):
+    reference = reference.astype(object).reset_index(drop=True)
+    candidate = candidate.astype(object).reset_index(drop=True)
+    return ((reference == candidate) | (reference.isna() & candidate.isna())).to_numpy()
+
+def compare_results(reference, candidate, columns=COMPARED_COLUMNS):
+    """
+    Écarts entre deux résultats, ligne à ligne.
+    Retourne un DataFrame (une ligne par valeur différente) : position de la ligne, contexte,
+    colonne, valeur de référence et valeur obtenue. Vide si les résultats sont identiques.
+    """
+    if len(reference) != len(candidate):
+        raise ValueError(f"Nombre de lignes différent : {len(reference)} (référence) / {len(candidate)}")
+    missing = [column for column in columns if column not in reference.columns or column not in candidate.columns]
+    if missing:
+        raise ValueError(f"Colonnes absentes d'un des résultats : {missing}")
+
+    context = [column for column in CONTEXT_COLUMNS if column in reference.columns]
+    mismatches = []
+    for column in columns:
+        rows = ~_same_values(reference[column], candidate[column])
+        if not rows.any():
+            continue
+        positions = rows.nonzero()[0]
+        mismatch = reference.iloc[positions][context].reset_index(drop=True)
+        mismatch.insert(0, 'Ligne', positions)
+        mismatch['Colonne'] = column
+        mismatch['Référence'] = reference[column].iloc[positions].to_numpy()
+        mismatch['Obtenu'] = candidate[column].iloc[positions].to_numpy()
+        mismatches.append(mismatch)
+    if not mismatches:
+        return pd.DataFrame(columns=['Ligne'] + context + ['Colonne', 'Référence', 'Obtenu'])
+    return pd.concat(mismatches, ignore_index=True)
+
+def check_equivalence(inputs):
+    """
+    Exécute les deux moteurs sur un jeu d'entrées et retourne (nombre de lignes, écarts)
+    """
+    reference = run_engine(inputs, 'legacy')
+    candidate = run_engine(inputs, 'optimized')
+    return len(reference), compare_results(reference, candidate)
+
+def format_report(label, n_rows, mismatches, max_rows=20):
+    """
+    Compte rendu lisible d'une comparaison : nombre d'écarts par colonne et premières lignes en écart
+    """
+    if mismatches.empty:
+        return f"{label} : {n_rows} lignes, résultats identiques"
+    lines = [f"{label} : {n_rows} lignes, {mismatches['Ligne'].nunique()} lignes en écart"]
+    for column, count in mismatches['Colonne'].value_counts().items():
+        lines.append(f"  {column} : {count} écarts")
+    shown = mismatches.head(max_rows)
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        lines.append(shown.to_string(index=False))
+    if len(mismatches) > max_rows:
+        lines.append(f"  ... {len(mismatches) - max_rows} écarts de plus")
+    return '\n'.join(lines)
+
+def load_recorded_inputs(directory):
+    """
+    Jeu d'entrées enregistré : les sept classeurs d'un dossier, lus comme par l'application
+    """
+    paths = find_input_files(directory)
+    missing = [name for name in INPUT_NAMES if name not in paths]
+    if missing:
+        raise ValueError(f"Fichiers manquants dans {directory}: {missing}")
+    files = {}
+    for name in INPUT_NAMES:
+        with open(paths[name], 'rb') as f:
+            files[name] = io.BytesIO(f.read())
+    digests = {name: file_digest(file.getvalue()) for name, file in files.items()}
+    df_dict, _ = load_workbooks(files, digests)
+    return df_dict
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Comparaison du moteur optimisé avec le moteur d'origine")
+    parser.add_argument('directories', nargs='*', help="Dossiers d'entrées enregistrées (sept classeurs .xlsx)")
+    parser.add_argument('--sizes', type=int, nargs='*', default=[2000],
+                        help="Tailles des backlogs générés (par défaut : 2000 ; aucune : pas de jeu généré)")
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0, 1, 2], help="Graines du générateur")
+    parser.add_argument('--max-rows', type=int, default=20, help="Nombre d'écarts affichés par jeu")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    datasets = [(f"Généré {n_lines} lignes, graine {seed}", lambda n_lines=n_lines, seed=seed: generate_backlog_lines(n_lines, seed=seed))
+                for n_lines in args.sizes for seed in args.seeds]
+    datasets += [(f"Enregistré {os.path.basename(os.path.normpath(directory))}", lambda directory=directory: load_recorded_inputs(directory))
+                 for directory in args.directories]
+
+    failed = False
+    for label, load in datasets:
+        try:
+            n_rows, mismatches = check_equivalence(load())
+        except Exception as e:
+            print(f"{label} : erreur - {e}")
+            failed = True
+            continue
+        print(format_report(label, n_rows, mismatches, args.max_rows))
+        failed = failed or not mismatches.empty
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
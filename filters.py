@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+
+# Produit INSTAL
+INSTAL_MATERIAL = 'Y5010646'
+
+# Filtres principaux : libellé affiché → indicateur de la table des commandes (None : toutes les commandes)
+ORDER_FILTERS = {
+    "Toutes les commandes": None,
+    "Commandes avec matériel BUY": 'has_BUY',
+    "Commandes avec matériel SECUROC": 'has_SECUROC',
+    "Commandes avec produit INSTAL (Y5010646)": 'has_INSTAL'
+}
+
+def until_day(dates, day):
+    """
+    Dates (datetime64, heure comprise) tombant au plus tard le jour donné ; NaT exclus
+    """
+    return (dates < pd.Timestamp(day) + pd.Timedelta(days=1)).to_numpy()
+
+def within_days(dates, first_day, last_day):
+    """
+    Dates (datetime64, heure comprise) tombant entre deux jours inclus ; NaT exclus
+    """
+    return (dates >= pd.Timestamp(first_day)).to_numpy() & until_day(dates, last_day)
+
+def month_labels(dates):
+    """
+    Mois (AAAA-MM) de chaque date, NaN pour NaT ; équivaut à dates.dt.strftime('%Y-%m')
+    mais seuls les mois distincts sont formatés
+    """
+    codes, months = pd.factorize(dates.to_numpy().astype('datetime64[M]'))
+    labels = np.datetime_as_string(np.asarray(months, dtype='datetime64[M]'), unit='M').astype(object)
+    return pd.Series(np.append(labels, np.nan)[codes], index=dates.index, dtype='str')
+
+def order_line_codes(orders_df, merged_df):
+    """
+    Position dans la table des commandes de la commande de chaque ligne ; -1 pour une ligne sans Sales Document
+    """
+    codes = pd.Index(orders_df['Sales Document']).get_indexer(merged_df['Sales Document'])
+    codes[merged_df['Sales Document'].isna().to_numpy()] = -1
+    return codes
+
+def orders_with_lines(line_codes, line_mask, n_orders):
+    """
+    Masque par commande : True si au moins une ligne de la commande est dans line_mask
+    """
+    selected = line_codes[(line_codes >= 0) & np.asarray(line_mask, dtype=bool)]
+    return np.bincount(selected, minlength=n_orders) > 0
+
+def add_order_flags(orders_df, merged_df, line_codes):
+    """
+    Indicateurs par commande utilisés par les filtres principaux (voir ORDER_FILTERS)
+    """
+    n_orders = len(orders_df)
+    orders_df['has_BUY'] = orders_with_lines(line_codes, (merged_df['Type'] == 'BUY').to_numpy(), n_orders)
+    orders_df['has_SECUROC'] = orders_with_lines(line_codes, (merged_df['Type'] == 'SECUROC').to_numpy(), n_orders)
+    orders_df['has_INSTAL'] = orders_with_lines(line_codes, (merged_df['Y Material'] == INSTAL_MATERIAL).to_numpy(), n_orders)
+    return orders_df
+
+def line_positions(line_codes, order_mask):
+    """
+    Positions des lignes des commandes retenues par order_mask, dans l'ordre du backlog
+    """
+    selected = np.append(np.asarray(order_mask, dtype=bool), False)
+    # Les lignes sans commande (code -1) pointent sur le False ajouté en fin de masque
+    return np.flatnonzero(selected[line_codes])
+
+def build_filter_index(merged_df, orders_df):
+    """
+    Index des filtres, calculé une fois par traitement : commande de chaque ligne, codes des
+    MRP Controller et des matériels (filtres personnalisés) et, pour chaque filtre principal,
+    les positions des commandes et des lignes retenues. Changer de filtre principal n'est
+    alors qu'une sélection par positions (voir select).
+    """
+    line_codes = order_line_codes(orders_df, merged_df)
+    mrp_codes, mrp_controllers = pd.factorize(merged_df['MRP Controller'], sort=True)
+    material_codes, materials = pd.factorize(merged_df['Y Material'], sort=True)
+    index = {
+        'line_codes': line_codes,
+        'mrp_codes': mrp_codes,
+        'mrp_controllers': pd.Index(mrp_controllers),
+        'material_codes': material_codes,
+        'materials': pd.Index(materials),
+        'filters': {}
+    }
+    for label, flag in ORDER_FILTERS.items():
+        if flag is not None:
+            order_mask = orders_df[flag].to_numpy(dtype=bool)
+            index['filters'][label] = (np.flatnonzero(order_mask), line_positions(line_codes, order_mask))
+    return index
+
+def custom_order_mask(index, orders_df, mrp_controllers=None, materials=None, created=None, delivered=None):
+    """
+    Masque par commande d'un filtre personnalisé ; chaque critère renseigné doit être vérifié :
+    - mrp_controllers / materials : au moins une ligne de la commande a l'un de ces MRP Controller / matériels
+    - created / delivered : (premier jour, dernier jour) inclus pour la date de création / la dernière date de livraison
+    """
+    n_orders = len(orders_df)
+    order_mask = np.ones(n_orders, dtype=bool)
+    for codes, uniques, values in ((index['mrp_codes'], index['mrp_controllers'], mrp_controllers),
+                                   (index['material_codes'], index['materials'], materials)):
+        if values:
+            wanted = uniques.get_indexer(list(values))
+            line_mask = np.isin(codes, wanted[wanted >= 0])
+            order_mask &= orders_with_lines(index['line_codes'], line_mask, n_orders)
+    for column, days in (('Created on', created), ('Last_Delivery_Date', delivered)):
+        if days:
+            order_mask &= within_days(orders_df[column], *days)
+    return order_mask
+
+def select(index, merged_df, orders_df, label="Toutes les commandes", order_mask=None):
+    """
+    Lignes et commandes retenues par un filtre principal (positions précalculées),
+    éventuellement restreintes par un masque par commande (voir custom_order_mask).
+    Retourne (lignes filtrées, commandes filtrées) ; sans filtre, les tables d'origine.
+    """
+    if ORDER_FILTERS.get(label) is None:
+        if order_mask is None:
+            return merged_df, orders_df
+        order_positions = np.flatnonzero(order_mask)
+        rows = line_positions(index['line_codes'], order_mask)
+    else:
+        order_positions, rows = index['filters'][label]
+        if order_mask is not None:
+            order_positions = order_positions[order_mask[order_positions]]
+            rows = rows[order_mask[index['line_codes'][rows]]]
+    return merged_df.take(rows), orders_df.take(order_positions)
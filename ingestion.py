@@ -0,0 +1,256 @@
+import hashlib
+import importlib.util
+import io
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait
+
+import pandas as pd
+
+# Taille maximale des caches (partagés par toutes les sessions du même processus serveur)
+MAX_CACHED_WORKBOOKS = 32
+MAX_CACHED_RESULTS = 8
+MAX_CACHED_EXPORTS = 8
+
+_workbook_cache = OrderedDict()
+_result_cache = OrderedDict()
+_export_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+# Schéma de lecture de chaque fichier : colonnes utiles, types et formats de date.
+# Seules ces colonnes sont chargées ; les colonnes absentes sont signalées par process_backlog_data.
+INPUT_SCHEMAS = {
+    'Backlog': {
+        'columns': [
+            'Created on', 'Sales Document', 'Requested Delivery Date', 'Sales UOM', 'Base UOM',
+            'Header Delivery Block', 'Line Delivery Block', 'Y Material', 'MRP Controller',
+            'MRP Group', 'Vendor PO #', 'Open Value', 'Open Order Quantity', 'On Hand Qty',
+            'Delivery Qty - Complete', 'ATP QTY', 'DropShip'
+        ],
+        'dtypes': {
+            'MRP Controller': 'category',
+            'Sales UOM': 'category',
+            'Base UOM': 'category',
+            'Header Delivery Block': 'category',
+            'Line Delivery Block': 'category',
+            # Quantité affichée uniquement, jamais utilisée dans les cumuls de stock
+            'ATP QTY': 'float32'
+        },
+        'dates': {'Created on': '%m/%d/%Y'}
+    },
+    'Sales UOM': {
+        'columns': ['Étiquettes de lignes', 'Alternative Unit of Measure', 'Counter']
+    },
+    'Orders': {
+        'columns': ['Purchasing Document', 'Delivery date', 'Material', 'Order Unit', 'Sch Opn Qty'],
+        'dates': {'Delivery date': '%m/%d/%Y'}
+    },
+    'PUOM': {
+        'columns': ['Material', 'Order Unit', 'PUOM', 'Base UOM']
+    },
+    'Kits': {
+        'columns': ['Header', 'Header MRP Controller', 'Component']
+    },
+    'MRP': {
+        'columns': ['MRP Controller', 'Type']
+    },
+    'Securoc': {
+        'columns': ['Material', 'Pegged reqmt']
+    }
+}
+
+# Pool de processus de lecture, créé à la première utilisation et réutilisé ensuite
+_parse_pool = None
+_pool_lock = threading.Lock()
+# Pool prêt : tous ses processus ont démarré (démarrer un processus 'spawn' coûte de l'ordre d'une seconde)
+_pool_ready = threading.Event()
+# En dessous de ce volume total (octets), les fichiers sont lus dans le processus courant :
+# le pool n'est pas plus rapide sur de petits fichiers
+PARALLEL_MIN_BYTES = 2 * 2**20
+
+def excel_engine():
+    """
+    Moteur de lecture Excel : calamine (bien plus rapide) s'il est installé
+    et supporté par pandas (>= 2.2), sinon openpyxl
+    """
+    if importlib.util.find_spec('python_calamine') is None:
+        return 'openpyxl'
+    major, minor = (int(part) for part in pd.__version__.split('.')[:2])
+    return 'calamine' if (major, minor) >= (2, 2) else 'openpyxl'
+
+def apply_schema(name, df):
+    """
+    Convertit les colonnes d'un fichier lu selon son schéma (types et formats de date).
+    Une colonne qui ne se convertit pas (valeur inattendue) est laissée telle quelle.
+    """
+    schema = INPUT_SCHEMAS.get(name, {})
+    for column, dtype in schema.get('dtypes', {}).items():
+        if column in df.columns:
+            try:
+                df[column] = df[column].astype(dtype)
+            except (ValueError, TypeError):
+                pass
+    for column, date_format in schema.get('dates', {}).items():
+        if column in df.columns:
+            df[column] = pd.to_datetime(df[column], format=date_format, errors='coerce')
+    return df
+
+def _parse_workbook(name, data, engine):
+    """
+    Lit un classeur Excel (exécuté dans un processus de lecture), en ne chargeant
+    que les colonnes de son schéma.
+    Retourne (DataFrame, moteur utilisé, durée en secondes).
+    """
+    start = time.perf_counter()
+    columns = INPUT_SCHEMAS.get(name, {}).get('columns')
+    usecols = (lambda column: column in columns) if columns else None
+    try:
+        df = pd.read_excel(io.BytesIO(data), engine=engine, usecols=usecols)
+    except Exception:
+        if engine == 'openpyxl':
+            raise
+        # Repli sur openpyxl si calamine ne sait pas lire ce fichier
+        engine = 'openpyxl'
+        df = pd.read_excel(io.BytesIO(data), engine=engine, usecols=usecols)
+    return apply_schema(name, df), engine, time.perf_counter() - start
+
+def _parse_workers():
+    return max(1, min(7, os.cpu_count() or 1))
+
+def _get_parse_pool():
+    """
+    Pool de processus partagé ; 'spawn' évite de forker le serveur Streamlit multi-thread
+    """
+    global _parse_pool
+    with _pool_lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(
+                max_workers=_parse_workers(),
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            # Un processus est démarré par tâche tant qu'aucun n'est libre : une tâche vide par
+            # processus les démarre tous, en arrière-plan ; le pool est prêt quand elles sont terminées
+            warm_up = [_parse_pool.submit(_warm_up) for _ in range(_parse_workers())]
+            threading.Thread(target=_wait_warm_up, args=(warm_up,), daemon=True).start()
+        return _parse_pool
+
+def _warm_up():
+    # Tâche vide : son exécution importe ce module (et pandas) dans le processus de lecture
+    return None
+
+def _wait_warm_up(futures):
+    wait(futures)
+    _pool_ready.set()
+
+def _parse_in_pool(to_parse):
+    """
+    Lecture parallèle seulement si elle est rentable : plusieurs fichiers, au moins PARALLEL_MIN_BYTES
+    au total, plusieurs processeurs et un pool déjà prêt. Un gros import sur un pool pas encore créé
+    est lu dans le processus courant et lance le démarrage du pool pour les imports suivants.
+    """
+    if len(to_parse) < 2 or _parse_workers() < 2 or sum(len(data) for data in to_parse.values()) < PARALLEL_MIN_BYTES:
+        return False
+    _get_parse_pool()
+    return _pool_ready.is_set()
+
+def file_digest(data):
+    """
+    Empreinte SHA-256 du contenu d'un fichier importé
+    """
+    return hashlib.sha256(data).hexdigest()
+
+def _copy(value):
+    # Une entrée est un DataFrame, un tuple de DataFrames ou un export en octets (non modifiable, non copié)
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, tuple):
+        return tuple(item.copy() for item in value)
+    return value.copy()
+
+def _cache_get(cache, key):
+    """
+    Lit une entrée du cache LRU et la marque comme récemment utilisée.
+    Retourne une copie pour que l'appelant ne modifie jamais l'entrée partagée.
+    """
+    with _cache_lock:
+        if key not in cache:
+            return None
+        cache.move_to_end(key)
+        return _copy(cache[key])
+
+def _cache_put(cache, key, value, max_size):
+    """
+    Ajoute une entrée au cache LRU en évinçant les plus anciennes au-delà de max_size
+    """
+    with _cache_lock:
+        cache[key] = _copy(value)
+        cache.move_to_end(key)
+        while len(cache) > max_size:
+            cache.popitem(last=False)
+
+def input_digests(files):
+    """
+    Empreintes des fichiers importés, sans les parser
+    """
+    return {name: file_digest(uploaded_file.getvalue()) for name, uploaded_file in files.items()}
+
+def load_workbooks(files, digests):
+    """
+    Lit tous les fichiers importés, à partir de leurs empreintes déjà calculées.
+    Les fichiers déjà parsés sont repris du cache ; les autres sont lus en parallèle
+    dans le pool de processus (la durée totale est alors celle du plus gros fichier)
+    ou, pour de petits fichiers ou un pool pas encore prêt, l'un après l'autre (voir _parse_in_pool).
+    Retourne (DataFrames par fichier, temps de lecture par fichier).
+    Le temps de lecture est un dict {'engine', 'seconds'} ; engine vaut 'cache' pour un fichier déjà lu.
+    """
+    df_dict = {}
+    timings = {}
+    to_parse = {}
+    for name, uploaded_file in files.items():
+        df = _cache_get(_workbook_cache, digests[name])
+        if df is None:
+            to_parse[name] = uploaded_file.getvalue()
+        else:
+            df_dict[name] = df
+            timings[name] = {'engine': 'cache', 'seconds': 0.0}
+
+    engine = excel_engine()
+    if _parse_in_pool(to_parse):
+        pool = _get_parse_pool()
+        futures = {name: pool.submit(_parse_workbook, name, data, engine) for name, data in to_parse.items()}
+        parsed = {name: future.result() for name, future in futures.items()}
+    else:
+        parsed = {name: _parse_workbook(name, data, engine) for name, data in to_parse.items()}
+
+    for name, (df, used_engine, seconds) in parsed.items():
+        _cache_put(_workbook_cache, digests[name], df, MAX_CACHED_WORKBOOKS)
+        df_dict[name] = df
+        timings[name] = {'engine': used_engine, 'seconds': seconds}
+
+    return {name: df_dict[name] for name in files}, {name: timings[name] for name in files}
+
+def cached_result(digests, compute):
+    """
+    Retourne le résultat du traitement pour ce jeu d'entrées (identifié par les empreintes
+    de tous les fichiers), en n'appelant compute() que si ce jeu n'a jamais été traité.
+    """
+    key = tuple(sorted(digests.items()))
+    result = _cache_get(_result_cache, key)
+    if result is None:
+        result = compute()
+        _cache_put(_result_cache, key, result, MAX_CACHED_RESULTS)
+    return result
+
+def cached_export(key, build):
+    """
+    Retourne l'export (octets) identifié par key, en n'appelant build() que s'il n'a jamais été produit.
+    key doit identifier les données et le filtre exportés (empreintes des fichiers, filtre, format).
+    """
+    data = _cache_get(_export_cache, key)
+    if data is None:
+        data = build()
+        _cache_put(_export_cache, key, data, MAX_CACHED_EXPORTS)
+    return data
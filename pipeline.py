@@ -0,0 +1,411 @@
+import os
+
+import numpy as np
+import pandas as pd
+import backlog_legacy
+from profiling import stage
+from filters import add_order_flags, build_filter_index, month_labels, order_line_codes
+from cube import AVAILABLE_ORDER_TYPES, build_filter_cubes
+from backlog import (
+    check_stock_availability, update_stock_status, build_vendor_po_index,
+    refresh_securoc_availability, refresh_securoc_updates
+)
+
+# Moteur de traitement : 'optimized' (par défaut) ou 'legacy', le moteur d'origine conservé comme référence
+ENGINES = ['optimized', 'legacy']
+DEFAULT_ENGINE = os.environ.get('BACKLOG_ENGINE', 'optimized')
+
+# Fichiers importés dont dépend chaque préparation : une préparation n'est refaite que si l'un d'eux change
+STAGE_INPUTS = {
+    'backlog': ['Backlog', 'Sales UOM', 'MRP'],
+    'supplier_orders': ['Orders', 'PUOM'],
+    'kits': ['Kits'],
+    'securoc': ['Securoc']
+}
+
+# Statuts de ligne encodés en bits : chaque combinaison de statuts d'une commande devient un entier
+ORDER_STATUS_BITS = ['Block', 'No dispo', 'Completed', 'Dispo', 'Potentiellement dispo']
+OTHER_STATUS = 'Autre'
+ORDER_STATUS_FLAGS = ORDER_STATUS_BITS + [OTHER_STATUS]
+
+def determine_order_type(statuses):
+    """
+    Détermine le type de commande à partir de l'ensemble des statuts de ses lignes
+    """
+    # Block si au moins une ligne est Block
+    if 'Block' in statuses:
+        return 'Block'
+
+    # No dispo si au moins une ligne est No dispo
+    elif 'No dispo' in statuses:
+        return 'No dispo'
+
+    # Completed si toutes les lignes sont Completed
+    elif statuses == {'Completed'}:
+        return 'Completed'
+
+    # Dispo si toutes les lignes sont Dispo ou (on trouve Dispo et Completed)
+    elif statuses == {'Dispo'} or statuses == {'Dispo', 'Completed'}:
+        return 'Dispo'
+
+    # Potentiellement dispo dans plusieurs cas
+    elif (statuses == {'Potentiellement dispo'} or  # toutes potentiellement dispo
+        statuses == {'Potentiellement dispo', 'Dispo'} or  # potentiellement dispo et dispo
+        statuses == {'Potentiellement dispo', 'Completed'} or  # potentiellement dispo et completed
+        statuses == {'Potentiellement dispo', 'Dispo', 'Completed'}):  # les trois types
+        return 'Potentiellement dispo'
+
+    # Autres cas
+    else:
+        return 'Others'
+
+# Table précalculée : combinaison de bits -> Order_Type
+ORDER_TYPE_TABLE = np.array([
+    determine_order_type({flag for bit, flag in enumerate(ORDER_STATUS_FLAGS) if combination >> bit & 1})
+    for combination in range(1 << len(ORDER_STATUS_FLAGS))
+], dtype=object)
+
+def replace_value(df, old, new):
+    """
+    Remplace une valeur dans tout le DataFrame, colonnes catégorielles comprises
+    """
+    category_columns = df.select_dtypes('category').columns
+    other_columns = df.columns.difference(category_columns, sort=False)
+    df = df.copy()
+    df[other_columns] = df[other_columns].replace(old, new)
+    for column in category_columns:
+        if old in df[column].cat.categories:
+            df[column] = df[column].astype(object).replace(old, new).astype('category')
+    return df
+
+def prepare_sales_uom(salesUOM):
+    """
+    Nettoie le fichier Sales UOM : Y Material et Counter par matériel
+    """
+    salesUOM = salesUOM.rename(columns={'Étiquettes de lignes': 'Y Material'})
+    salesUOM = salesUOM.drop('Alternative Unit of Measure', axis=1)
+
+    # Vérifier les colonnes requises dans le fichier Sales UOM
+    required_sales_cols = ['Y Material', 'Counter']
+    if not all(col in salesUOM.columns for col in required_sales_cols):
+        raise ValueError("Le fichier Sales UOM doit contenir les colonnes 'Y Material' et 'Counter'")
+    return salesUOM
+
+def prepare_puom(Puom):
+    """
+    Nettoie le fichier PUOM : unité et coefficient d'achat par matériel
+    """
+    required_puom_cols = ['Material', 'Order Unit', 'PUOM', 'Base UOM']
+    if not all(col in Puom.columns for col in required_puom_cols):
+        raise ValueError(f"Colonnes manquantes dans le fichier Puom: {[col for col in required_puom_cols if col not in Puom.columns]}")
+    Puom = Puom.rename(columns={'Material': 'Y Material'})
+    return Puom[['Y Material', 'Order Unit', 'PUOM', 'Base UOM']]
+
+def prepare_kits(kit):
+    """
+    Nettoie le fichier Kits : nomenclature kit (Y Material) -> composants
+    """
+    kit = kit.rename(columns={'Header': 'Y Material'})
+    return kit[['Y Material', 'Header MRP Controller', 'Component']]
+
+def prepare_mrp(MRP):
+    """
+    Nettoie le fichier MRP : table MRP Controller -> Type
+    """
+    if 'MRP Controller' not in MRP.columns or 'Type' not in MRP.columns:
+        raise ValueError("Le fichier MRP doit contenir les colonnes 'MRP Controller' et 'Type'")
+    return MRP[['MRP Controller', 'Type']]
+
+# Fichiers de référence : ils changent rarement et peuvent être repris du stock local
+REFERENCE_PREPARERS = {
+    'Sales UOM': prepare_sales_uom,
+    'PUOM': prepare_puom,
+    'Kits': prepare_kits,
+    'MRP': prepare_mrp
+}
+REFERENCE_FILES = list(REFERENCE_PREPARERS)
+
+def prepare_references(salesUOM, Puom, kit, MRP):
+    """
+    Nettoie les quatre fichiers de référence.
+    Retourne un dict {nom du fichier: DataFrame nettoyé}, réutilisable tel quel d'une exécution à l'autre.
+    """
+    raw = {'Sales UOM': salesUOM, 'PUOM': Puom, 'Kits': kit, 'MRP': MRP}
+    return {name: prepare(raw[name]) for name, prepare in REFERENCE_PREPARERS.items()}
+
+def prepare_securoc(securoc_df):
+    """
+    Nettoie le fichier Securoc : composants (Component) bloquants par produit (Y Material)
+    """
+    securoc_df = securoc_df[['Material', 'Pegged reqmt']]
+    return securoc_df.rename(columns={'Material': 'Component', 'Pegged reqmt': 'Y Material'})
+
+def prepare_backlog(backlog, salesUOM, MRP):
+    """
+    Prépare les lignes du backlog : colonnes utiles, Type, quantité en unité de vente (Qte_sales) et Statut
+    """
+    # Convertir tous les Sales Document en chaînes de caractères
+    backlog['Sales Document'] = backlog['Sales Document'].astype(str)
+    backlog = backlog.iloc[1:]
+
+    # Vérifier les colonnes requises dans le fichier backlog
+    required_columns = ['Y Material', 'Sales Document', 'Created on', 'Open Value']
+    missing_columns = [col for col in required_columns if col not in backlog.columns]
+    if missing_columns:
+        raise ValueError(f"Colonnes manquantes dans le fichier backlog: {missing_columns}")
+
+    # Prétraitement des fichiers
+    backlog = replace_value(backlog, 'pak', 'pac')
+    backlog = backlog[backlog['Y Material'] != 'Y4963053']
+
+    # Sélection des colonnes nécessaires
+    colonnes = [
+        'Created on', 'Sales Document', 'Requested Delivery Date', 'Sales UOM', 'Base UOM',
+        'Header Delivery Block', 'Line Delivery Block', 'Y Material', 'MRP Controller',
+        'MRP Group', 'Vendor PO #', 'Open Value', 'Open Order Quantity', 'On Hand Qty',
+        'Delivery Qty - Complete', 'ATP QTY','DropShip'
+    ]
+    missing_cols = [col for col in colonnes if col not in backlog.columns]
+    if missing_cols:
+        raise ValueError(f"Colonnes manquantes dans le fichier backlog: {missing_cols}")
+    backlog = backlog[colonnes].copy()
+
+    # Créer un identifiant unique pour chaque ligne du backlog
+    backlog['original_index'] = backlog.index
+
+    with stage('Fusions MRP et Sales UOM', rows_in=len(backlog)) as timing:
+        # Fusion avec MRP pour obtenir les types
+        mrp_dict = MRP.set_index('MRP Controller')['Type'].to_dict()
+        # Mapping sur les valeurs pour que Type reste une colonne texte modifiable (MRP Controller peut être catégoriel)
+        backlog['Type'] = backlog['MRP Controller'].astype(object).map(mrp_dict)
+
+        # Traitement des types spéciaux
+        backlog.loc[(backlog['MRP Controller'] == 'M70') & (backlog['Y Material'] == 'Y4950101'), 'Type'] = 'SECUROC'
+        backlog.loc[(backlog['MRP Controller'] == 'M70') & (backlog['Y Material'] == 'Y4950100'), 'Type'] = 'BUY'
+
+        backlog = pd.merge(backlog, salesUOM, on='Y Material', how='left')
+
+        # Remplacer les valeurs NaN dans Counter par 1 (pour les matériels qui ne sont pas dans salesUOM)
+        backlog['Counter'] = backlog['Counter'].fillna(1)
+        timing['rows_out'] = len(backlog)
+
+    # Initialiser et calculer Qte_sales
+    with stage('Conversion Qte_sales', rows_in=len(backlog)) as timing:
+        backlog['Qte_sales'] = 0.0
+        try:
+            # Comparaison sur les valeurs : deux colonnes catégorielles n'ont pas les mêmes catégories
+            sales_uom = backlog['Sales UOM'].astype(object)
+            base_uom = backlog['Base UOM'].astype(object)
+            backlog.loc[(sales_uom == 'EA') & (base_uom == 'PC'), 'Qte_sales'] = backlog['Open Order Quantity'].astype(float)
+            backlog.loc[(sales_uom == 'PC') & (base_uom == 'EA'), 'Qte_sales'] = backlog['Open Order Quantity'].astype(float)
+            backlog.loc[sales_uom == base_uom, 'Qte_sales'] = backlog['Open Order Quantity'].astype(float)
+            backlog.loc[sales_uom != base_uom, 'Qte_sales'] = (backlog['Open Order Quantity'] * backlog['Counter']).astype(float)
+        except Exception as e:
+            raise ValueError(f"Erreur lors du calcul de Qte_sales: {str(e)}")
+        timing['rows_out'] = len(backlog)
+
+    # Déterminer le statut des lignes backlog
+    backlog.loc[(backlog['Open Order Quantity'] == backlog['Delivery Qty - Complete']), 'Statut'] = 'Completed'
+    backlog.loc[(backlog['Open Order Quantity'] != backlog['Delivery Qty - Complete']) &
+                (backlog['Header Delivery Block'] == 'No Block') &
+                (backlog['Line Delivery Block'] == 'No Block'), 'Statut'] = 'No Block'
+    backlog.loc[backlog['Statut'].isnull(), 'Statut'] = 'Block'
+
+    return backlog
+
+def prepare_supplier_orders(export, Puom):
+    """
+    Prépare les commandes fournisseurs (SuppOrder) : quantités converties en unité de base via PUOM
+    """
+    required_export_cols = ['Purchasing Document', 'Delivery date', 'Y Material', 'Order Unit', 'Sch Opn Qty']
+    export = export.rename(columns={'Material': 'Y Material'})
+    export = export[required_export_cols]
+
+    # Fusionner Export et PUOM
+    SuppOrder = pd.merge(export, Puom, on='Y Material', how='left')
+    SuppOrder['Order Unit_y'] = SuppOrder['Order Unit_y'].fillna('PC')
+    SuppOrder['Base UOM'] = SuppOrder['Base UOM'].fillna('PC')
+    SuppOrder['PUOM'] = SuppOrder['PUOM'].fillna(1)
+    SuppOrder['Qty_Purchasing'] = SuppOrder['PUOM'] * SuppOrder['Sch Opn Qty']
+    colonneSuppOrder = ['Purchasing Document', 'Y Material', 'Delivery date', 'Base UOM', 'Qty_Purchasing']
+    SuppOrder = SuppOrder[colonneSuppOrder].copy()
+
+    # Même normalisation que check_stock_availability, pour pouvoir réutiliser SuppOrder sans repasser par l'étape 1
+    SuppOrder['Purchasing Document'] = SuppOrder['Purchasing Document'].astype(str).str.strip()
+    return SuppOrder
+
+def vendor_po_signature(SuppOrder):
+    """
+    Empreinte de l'ensemble des couples (Purchasing Document, Y Material) : c'est la seule
+    information des commandes fournisseurs utilisée par l'étape 1 (check_stock_availability)
+    """
+    pairs = build_vendor_po_index(SuppOrder).to_frame(index=False)
+    return np.sort(pd.util.hash_pandas_object(pairs, index=False).to_numpy())
+
+def finalize_orders(merged_df):
+    """
+    Ajoute les indicateurs par commande (Total Value Order, Order_Type, Last_Delivery_Date)
+    et remet les lignes dans l'ordre du backlog
+    """
+    merged_df['Sales Document'] = merged_df['Sales Document'].astype(str)
+
+    # Type de commande, valeur totale et dernière date de livraison en une seule agrégation
+    order_codes = pd.factorize(merged_df['Sales Document'])[0]
+    status_flags = pd.DataFrame({
+        status: (merged_df['Updated_Stock_Status'] == status).to_numpy()
+        for status in ORDER_STATUS_BITS
+    })
+    status_flags[OTHER_STATUS] = ~status_flags.any(axis=1)
+    status_flags['Open Value'] = merged_df['Open Value'].to_numpy()
+    status_flags['Last_Delivery_Date'] = merged_df['Last_Delivery_Date'].to_numpy()
+
+    aggregations = {flag: 'max' for flag in ORDER_STATUS_FLAGS}
+    aggregations.update({'Open Value': 'sum', 'Last_Delivery_Date': 'max'})
+    orders = status_flags.groupby(order_codes, sort=False).agg(aggregations).sort_index()
+
+    order_bits = sum(orders[flag].to_numpy().astype(np.int64) << bit for bit, flag in enumerate(ORDER_STATUS_FLAGS))
+    merged_df['Total Value Order'] = orders['Open Value'].to_numpy()[order_codes]
+    merged_df['Order_Type'] = ORDER_TYPE_TABLE[order_bits][order_codes]
+    merged_df['Last_Delivery_Date'] = orders['Last_Delivery_Date'].to_numpy()[order_codes]
+
+    # Nettoyage final
+    merged_df = merged_df.sort_values('original_index')
+    return merged_df.drop('original_index', axis=1)
+
+def build_order_summary(merged_df):
+    """
+    Table des commandes, partagée par toutes les sections du tableau de bord : une ligne par commande
+    (dans l'ordre du backlog) avec date de création, type, valeur, dernière date de livraison (dates converties),
+    mois de disponibilité, indicateur Dispo / Potentiellement dispo, nombre de lignes par statut
+    et indicateurs des filtres principaux (has_BUY, has_SECUROC, has_INSTAL).
+    Les valeurs par commande sont celles de la première ligne de la commande.
+    """
+    orders = merged_df.drop_duplicates('Sales Document')[
+        ['Sales Document', 'Created on', 'Last_Delivery_Date', 'Order_Type', 'Total Value Order']
+    ].reset_index(drop=True)
+    orders['Created on'] = pd.to_datetime(orders['Created on'], errors='coerce')
+    orders['Last_Delivery_Date'] = pd.to_datetime(orders['Last_Delivery_Date'], errors='coerce')
+    orders['Delivery_Month'] = month_labels(orders['Last_Delivery_Date'])
+    orders['Available'] = orders['Order_Type'].isin(AVAILABLE_ORDER_TYPES).to_numpy()
+
+    order_codes = order_line_codes(orders, merged_df)
+    known = order_codes >= 0
+    orders['Lines'] = np.bincount(order_codes[known], minlength=len(orders))
+    status_codes, statuses = pd.factorize(merged_df['Updated_Stock_Status'], sort=True)
+    for code, status in enumerate(statuses):
+        orders[f"Lines_{status}"] = np.bincount(order_codes[known & (status_codes == code)], minlength=len(orders))
+    return add_order_flags(orders, merged_df, order_codes)
+
+def run_pipeline(df_dict, digests, references, previous=None):
+    """
+    Traitement du backlog en ne recalculant que ce qui dépend des fichiers modifiés.
+    df_dict : fichiers Backlog, Orders et Securoc bruts ; references : fichiers de référence nettoyés ;
+    digests : empreinte de chacun des sept fichiers ; previous : état retourné par l'appel précédent.
+    - Orders / PUOM modifiés : l'étape 1 est reprise si les couples Vendor PO sont inchangés,
+      l'allocation des commandes fournisseurs (étape 2) est recalculée
+    - Securoc modifié : seules les lignes SECUROC et les kits sont réévalués
+    - Backlog, Sales UOM, MRP ou Kits modifiés : recalcul complet
+    Retourne (merged_df, état) ; la table des commandes (build_order_summary) est dans état['orders']
+    et l'index des filtres (voir filters.build_filter_index) dans état['filter_index'],
+    les cubes des indicateurs par filtre principal (voir cube.build_filter_cubes) dans état['cubes'].
+    """
+    if previous is None:
+        changed = set(digests)
+    else:
+        changed = {name for name, digest in digests.items() if previous['digests'].get(name) != digest}
+
+    def is_stale(stage):
+        return previous is None or any(name in changed for name in STAGE_INPUTS[stage])
+
+    state = {'digests': dict(digests)}
+    with stage('Préparation du backlog', rows_in=len(df_dict['Backlog'])) as timing:
+        state['backlog'] = (prepare_backlog(df_dict['Backlog'], references['Sales UOM'], references['MRP'])
+                            if is_stale('backlog') else previous['backlog'])
+        timing['rows_out'] = len(state['backlog'])
+    with stage('Préparation des commandes fournisseurs', rows_in=len(df_dict['Orders'])) as timing:
+        state['supplier_orders'] = (prepare_supplier_orders(df_dict['Orders'], references['PUOM'])
+                                    if is_stale('supplier_orders') else previous['supplier_orders'])
+        state['vendor_po'] = (vendor_po_signature(state['supplier_orders'])
+                              if is_stale('supplier_orders') else previous['vendor_po'])
+        timing['rows_out'] = len(state['supplier_orders'])
+    state['kits'] = references['Kits']
+    state['securoc'] = prepare_securoc(df_dict['Securoc']) if is_stale('securoc') else previous['securoc']
+
+    full_stage_one = (previous is None or is_stale('backlog') or is_stale('kits') or
+                      not np.array_equal(state['vendor_po'], previous['vendor_po']))
+
+    # Étape 1 : disponibilité sur stock
+    with stage('Étape 1 : disponibilité sur stock', rows_in=len(state['backlog'])) as timing:
+        if full_stage_one:
+            stage_one = check_stock_availability(state['backlog'], state['supplier_orders'], state['kits'], state['securoc'])
+        elif is_stale('securoc'):
+            stage_one = refresh_securoc_availability(previous['stage_one'].copy(), state['kits'], state['securoc'])
+        else:
+            stage_one = previous['stage_one']
+        timing['rows_out'] = len(stage_one) if not isinstance(stage_one, str) else 0
+    if isinstance(stage_one, str):
+        raise ValueError(f"Erreur dans check_stock_availability: {stage_one}")
+
+    # Étape 2 : allocation des commandes fournisseurs
+    with stage('Étape 2 : commandes fournisseurs', rows_in=len(stage_one)) as timing:
+        if full_stage_one or is_stale('supplier_orders'):
+            stage_two = update_stock_status(stage_one.copy(), state['supplier_orders'], state['kits'], state['securoc'])
+        elif is_stale('securoc'):
+            stage_two = refresh_securoc_updates(
+                stage_one.copy(), previous['stage_two'], state['supplier_orders'], state['kits'], state['securoc']
+            )
+        else:
+            stage_two = previous['stage_two']
+        timing['rows_out'] = len(stage_two) if not isinstance(stage_two, str) else 0
+    if isinstance(stage_two, str):
+        raise ValueError(f"Erreur dans update_stock_status: {stage_two}")
+
+    state['stage_one'] = stage_one
+    state['stage_two'] = stage_two
+    with stage('Type de commande par commande', rows_in=len(stage_two)) as timing:
+        merged_df = finalize_orders(stage_two.copy())
+        timing['rows_out'] = len(merged_df)
+    with stage('Synthèse des commandes', rows_in=len(merged_df)) as timing:
+        state['orders'] = build_order_summary(merged_df)
+        timing['rows_out'] = len(state['orders'])
+    with stage('Index des filtres', rows_in=len(merged_df)):
+        state['filter_index'] = build_filter_index(merged_df, state['orders'])
+    with stage('Cube des indicateurs', rows_in=len(merged_df)) as timing:
+        state['cubes'] = build_filter_cubes(merged_df, state['orders'], state['filter_index'])
+        timing['rows_out'] = sum(len(cube) for cube in state['cubes'].values())
+    return merged_df, state
+
+def process_backlog_data(backlog, salesUOM, export, Puom, kit, MRP, securoc_df, references=None, engine=None):
+    """
+    Traitement complet du backlog.
+    references : fichiers de référence déjà nettoyés (voir prepare_references) ; s'il est fourni,
+    salesUOM, Puom, kit et MRP sont ignorés.
+    engine : 'optimized' ou 'legacy' (par défaut DEFAULT_ENGINE) ; le moteur legacy a besoin des fichiers bruts.
+    """
+    engine = engine or DEFAULT_ENGINE
+    if engine not in ENGINES:
+        raise ValueError(f"Moteur inconnu: {engine} (moteurs disponibles : {ENGINES})")
+    if engine == 'legacy':
+        # Copies sans colonnes catégorielles : le moteur d'origine modifie ses entrées
+        # et a été écrit pour des colonnes texte simples
+        frames = [df.copy() for df in (backlog, salesUOM, export, Puom, kit, MRP, securoc_df)]
+        for df in frames:
+            for column in df.columns[df.dtypes == 'category']:
+                df[column] = df[column].astype(object)
+        with stage('Moteur de référence (legacy)', rows_in=len(backlog)) as timing:
+            merged_df = backlog_legacy.process_backlog_data(*frames)
+            timing['rows_out'] = len(merged_df)
+        return merged_df
+
+    try:
+        if references is None:
+            with stage('Préparation des références'):
+                references = prepare_references(salesUOM, Puom, kit, MRP)
+
+        df_dict = {'Backlog': backlog, 'Orders': export, 'Securoc': securoc_df}
+        merged_df, _ = run_pipeline(df_dict, {}, references)
+        return merged_df
+
+    except Exception as e:
+        print(f"Erreur détaillée dans process_backlog_data: {str(e)}")
+        raise Exception(f"Erreur lors du traitement des données: {str(e)}")
@@ -0,0 +1,102 @@
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Mesures des étapes du traitement en cours (None : pas de mesure demandée)
+_stage_timings = ContextVar('stage_timings', default=None)
+# Pics de mémoire des étapes englobantes encore ouvertes (une étape imbriquée remet le pic à zéro)
+_open_peaks = ContextVar('open_peaks', default=())
+
+@contextmanager
+def record_stages():
+    """
+    Mesure les étapes (voir stage) exécutées dans le bloc.
+    Produit la liste des mesures, dans l'ordre où les étapes commencent :
+    [{'stage': nom, 'depth': niveau d'imbrication, 'seconds': durée, 'rows_in', 'rows_out'}, ...] ;
+    si tracemalloc est actif, chaque mesure contient aussi 'peak_mb', le pic de mémoire allouée pendant l'étape.
+    """
+    timings = []
+    token = _stage_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _stage_timings.reset(token)
+
+@contextmanager
+def stage(name, rows_in=None):
+    """
+    Délimite une étape du traitement ; sans record_stages actif, ne mesure rien.
+    Produit la mesure de l'étape : l'appelant peut y indiquer le nombre de lignes produites (timing['rows_out']).
+    """
+    timings = _stage_timings.get()
+    if timings is None:
+        yield {}
+        return
+    open_peaks = _open_peaks.get()
+    timing = {'stage': name, 'depth': len(open_peaks)}
+    if rows_in is not None:
+        timing['rows_in'] = int(rows_in)
+    timings.append(timing)
+
+    tracing = tracemalloc.is_tracing()
+    peak = [0]
+    if tracing:
+        # Le pic atteint jusqu'ici compte pour les étapes englobantes avant d'être remis à zéro
+        current, previous_peak = tracemalloc.get_traced_memory()
+        for parent_peak in open_peaks:
+            parent_peak[0] = max(parent_peak[0], previous_peak)
+        tracemalloc.reset_peak()
+        baseline = current
+    token = _open_peaks.set(open_peaks + (peak,))
+    start = time.perf_counter()
+    try:
+        yield timing
+    finally:
+        timing['seconds'] = time.perf_counter() - start
+        _open_peaks.reset(token)
+        if tracing and tracemalloc.is_tracing():
+            peak[0] = max(peak[0], tracemalloc.get_traced_memory()[1])
+            for parent_peak in open_peaks:
+                parent_peak[0] = max(parent_peak[0], peak[0])
+            timing['peak_mb'] = (peak[0] - baseline) / 2**20
+
+def format_timings(timings):
+    """
+    Tableau texte des mesures par étape (étapes imbriquées en retrait), avec le total
+    """
+    labels = ['  ' * timing.get('depth', 0) + timing['stage'] for timing in timings]
+    width = max([len(label) for label in labels] + [len('Total')])
+    with_memory = any('peak_mb' in timing for timing in timings)
+    header = (f"{'Étape'.ljust(width)}  Durée (s)  Lignes entrée  Lignes sortie"
+              + ('  Pic mémoire (Mo)' if with_memory else ''))
+    lines = [header, '-' * len(header)]
+    for label, timing in zip(labels, timings):
+        rows_in = timing.get('rows_in', '')
+        rows_out = timing.get('rows_out', '')
+        line = f"{label.ljust(width)}  {timing['seconds']:9.3f}  {rows_in:>13}  {rows_out:>13}"
+        if 'peak_mb' in timing:
+            line += f"  {timing['peak_mb']:16.1f}"
+        lines.append(line)
+    lines.append('-' * len(header))
+    lines.append(f"{'Total'.ljust(width)}  {total_seconds(timings):9.3f}")
+    return '\n'.join(lines)
+
+def total_seconds(timings):
+    """
+    Durée totale : somme des étapes de premier niveau (les étapes imbriquées y sont déjà comptées)
+    """
+    return sum(timing['seconds'] for timing in timings if timing.get('depth', 0) == 0)
+
+def timings_to_json(timings, **metadata):
+    """
+    Export JSON des mesures pour la supervision : date, métadonnées éventuelles, total et étapes
+    """
+    report = {
+        'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        **metadata,
+        'total_seconds': total_seconds(timings),
+        'stages': timings
+    }
+    return json.dumps(report, indent=2, ensure_ascii=False)
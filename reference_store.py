@@ -0,0 +1,98 @@
+import json
+import os
+import time
+
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from pipeline import REFERENCE_PREPARERS
+
+# Dossier du stock local des fichiers de référence nettoyés
+REFERENCE_DIR = os.environ.get('BACKLOG_REFERENCE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.reference_data'))
+MANIFEST_FILE = 'latest.json'
+
+def _reference_path(name, digest):
+    """
+    Chemin du fichier Feather d'une référence, versionné par l'empreinte du fichier importé
+    """
+    safe_name = name.replace(' ', '_')
+    return os.path.join(REFERENCE_DIR, f"{safe_name}-{digest}.feather")
+
+def _read_manifest():
+    path = os.path.join(REFERENCE_DIR, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_manifest(manifest):
+    # Écriture atomique pour ne jamais laisser un manifeste à moitié écrit
+    path = os.path.join(REFERENCE_DIR, MANIFEST_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+def latest_reference_digests():
+    """
+    Empreintes de la dernière version enregistrée de chaque fichier de référence
+    (uniquement celles dont le fichier Feather existe encore)
+    """
+    return {
+        name: digest for name, digest in _read_manifest().items()
+        if os.path.exists(_reference_path(name, digest))
+    }
+
+def save_reference(name, digest, df):
+    """
+    Enregistre une référence nettoyée au format Feather et la marque comme dernière version.
+    Retourne False si le DataFrame ne peut pas être stocké (colonne aux types mélangés, disque indisponible).
+    """
+    path = _reference_path(name, digest)
+    try:
+        os.makedirs(REFERENCE_DIR, exist_ok=True)
+        if not os.path.exists(path):
+            tmp_path = path + '.tmp'
+            feather.write_feather(df.reset_index(drop=True), tmp_path)
+            os.replace(tmp_path, path)
+        manifest = _read_manifest()
+        manifest[name] = digest
+        _write_manifest(manifest)
+        return True
+    except (OSError, pa.ArrowException):
+        # Ne pas laisser une version plus ancienne passer pour la dernière
+        try:
+            manifest = _read_manifest()
+            if manifest.pop(name, None) is not None:
+                _write_manifest(manifest)
+        except OSError:
+            pass
+        return False
+
+def load_reference(name, digest):
+    """
+    Relit une référence enregistrée (lecture mappée en mémoire)
+    """
+    table = feather.read_table(_reference_path(name, digest), memory_map=True)
+    return table.to_pandas()
+
+def resolve_references(df_dict, digests):
+    """
+    Références nettoyées pour un traitement : les fichiers importés sont nettoyés puis enregistrés,
+    les fichiers non importés sont relus depuis le stock local (version indiquée par digests).
+    Retourne (références par fichier, temps de chargement des références relues).
+    """
+    references = {}
+    timings = {}
+    for name, prepare in REFERENCE_PREPARERS.items():
+        if name in df_dict:
+            references[name] = prepare(df_dict[name])
+            save_reference(name, digests[name], references[name])
+        else:
+            start = time.perf_counter()
+            references[name] = load_reference(name, digests[name])
+            timings[name] = {'engine': 'stock local', 'seconds': time.perf_counter() - start}
+    return references, timings
@@ -0,0 +1,149 @@
+import io
+import zipfile
+
+import pandas as pd
+import xlsxwriter
+
+from cube import AVAILABLE_ORDER_TYPES
+
+# Nombre maximal de lignes d'une feuille Excel (en-tête compris)
+EXCEL_MAX_ROWS = 1048576
+# Lignes converties en valeurs Python à la fois lors de l'écriture xlsx
+XLSX_CHUNK_ROWS = 10000
+
+# Tables du rapport : nom -> (feuille Excel, nom du fichier CSV / Parquet)
+REPORT_TABLES = {
+    'lines': ('Données_Complètes', 'Rapport_Backlog'),
+    'orders': ('Commandes', 'Commandes'),
+    'no_dispo': ('No_Dispo', 'No_Dispo'),
+    'forecast': ('Prévisions_Mensuelles', 'Previsions_Mensuelles')
+}
+
+# Formats d'export : xlsx en un classeur multi-feuilles, CSV et Parquet en un fichier par table
+EXPORT_FORMATS = {
+    'xlsx': {'label': "Excel (rapport multi-feuilles)", 'extension': 'xlsx',
+             'mime': "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"},
+    'csv': {'label': "CSV (archive zip, un fichier par table)", 'extension': 'zip', 'mime': "application/zip"},
+    'parquet': {'label': "Parquet (archive zip, un fichier par table)", 'extension': 'zip', 'mime': "application/zip"}
+}
+
+# Colonnes du détail No dispo : une ligne par produit manquant d'une commande No dispo
+NO_DISPO_COLUMNS = [
+    'Sales Document', 'Created on', 'Y Material', 'Type', 'MRP Controller',
+    'Updated_Remaining_Quantity', 'Open Value', 'Total Value Order'
+]
+
+def no_dispo_breakdown(merged_df):
+    """
+    Produits manquants des commandes No dispo (lignes No dispo de ces commandes), par commande
+    """
+    lines = merged_df[(merged_df['Order_Type'] == 'No dispo') & (merged_df['Updated_Stock_Status'] == 'No dispo')]
+    columns = [column for column in NO_DISPO_COLUMNS if column in lines.columns]
+    return lines[columns].sort_values('Sales Document', kind='stable')
+
+def monthly_forecast(orders_df):
+    """
+    Prévision mensuelle : nombre et valeur des commandes Dispo et Potentiellement dispo
+    par mois de disponibilité, avec le total du mois et la valeur cumulée
+    """
+    available = orders_df[orders_df['Available'].to_numpy() & orders_df['Delivery_Month'].notna().to_numpy()]
+    grouped = (
+        available.groupby(['Delivery_Month', 'Order_Type'])['Total Value Order'].agg(['size', 'sum'])
+        .unstack('Order_Type', fill_value=0)
+        .reindex(columns=pd.MultiIndex.from_product([['size', 'sum'], AVAILABLE_ORDER_TYPES]), fill_value=0)
+    )
+    forecast = pd.DataFrame(index=grouped.index.rename('Mois'))
+    for order_type in AVAILABLE_ORDER_TYPES:
+        forecast[f"Commandes {order_type}"] = grouped[('size', order_type)].astype(int)
+        forecast[f"Valeur {order_type}"] = grouped[('sum', order_type)].astype(float)
+    forecast['Commandes'] = forecast[[f"Commandes {order_type}" for order_type in AVAILABLE_ORDER_TYPES]].sum(axis=1)
+    forecast['Valeur'] = forecast[[f"Valeur {order_type}" for order_type in AVAILABLE_ORDER_TYPES]].sum(axis=1)
+    forecast['Valeur cumulée'] = forecast['Valeur'].cumsum()
+    return forecast.reset_index()
+
+def report_tables(merged_df, orders_df):
+    """
+    Tables du rapport (voir REPORT_TABLES) : lignes, commandes, détail No dispo et prévision mensuelle
+    """
+    return {
+        'lines': merged_df,
+        'orders': orders_df,
+        'no_dispo': no_dispo_breakdown(merged_df),
+        'forecast': monthly_forecast(orders_df)
+    }
+
+def _cell_values(series):
+    # Valeurs Python écrites telles quelles par xlsxwriter ; None (cellule vide) pour les valeurs manquantes
+    values = series.astype(object)
+    return values.where(series.notna().to_numpy(), None).tolist()
+
+def write_xlsx(tables, target):
+    """
+    Écrit les tables dans un classeur xlsx (une feuille par table), ligne par ligne en mode
+    constant_memory de xlsxwriter : chaque ligne est écrite sur disque dès qu'elle est complète
+    et les valeurs sont converties par blocs de XLSX_CHUNK_ROWS lignes, la mémoire utilisée
+    ne dépend donc pas de la taille du rapport.
+    target : chemin ou fichier binaire (ex. io.BytesIO).
+    """
+    for name, df in tables.items():
+        if len(df) + 1 > EXCEL_MAX_ROWS:
+            raise ValueError(f"Trop de lignes pour une feuille Excel ({REPORT_TABLES[name][0]} : {len(df)}), "
+                             f"utiliser l'export CSV ou Parquet")
+    workbook = xlsxwriter.Workbook(target, {
+        'constant_memory': True,
+        'default_date_format': 'dd/mm/yyyy',
+        'strings_to_formulas': False,
+        'strings_to_urls': False,
+        'nan_inf_to_errors': True
+    })
+    header_format = workbook.add_format({'bold': True})
+    try:
+        for name, df in tables.items():
+            worksheet = workbook.add_worksheet(REPORT_TABLES[name][0])
+            worksheet.write_row(0, 0, [str(column) for column in df.columns], header_format)
+            for start in range(0, len(df), XLSX_CHUNK_ROWS):
+                chunk = df.iloc[start:start + XLSX_CHUNK_ROWS]
+                columns = [_cell_values(chunk[column]) for column in chunk.columns]
+                for row, values in enumerate(zip(*columns), start=start + 1):
+                    worksheet.write_row(row, 0, values)
+    finally:
+        workbook.close()
+
+def _arrow_compatible(df):
+    """
+    Copie exportable en Parquet : les colonnes texte aux types mélangés (ex. Vendor PO #) passent en texte
+    """
+    df = df.copy()
+    for column in df.columns[df.dtypes == object]:
+        if pd.api.types.infer_dtype(df[column], skipna=True) not in ('string', 'empty'):
+            df[column] = df[column].map(lambda value: value if pd.isna(value) else str(value))
+    return df
+
+def write_table(df, export_format, target):
+    """
+    Écrit une table en CSV ou en Parquet (target : chemin ou fichier binaire)
+    """
+    if export_format == 'csv':
+        df.to_csv(target, index=False)
+    elif export_format == 'parquet':
+        _arrow_compatible(df).to_parquet(target, index=False)
+    else:
+        raise ValueError(f"Format de table inconnu: {export_format}")
+
+def export_report(tables, export_format):
+    """
+    Rapport complet au format demandé (voir EXPORT_FORMATS), en octets :
+    classeur xlsx, ou archive zip d'un fichier CSV / Parquet par table
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Format d'export inconnu: {export_format} (formats disponibles : {list(EXPORT_FORMATS)})")
+    output = io.BytesIO()
+    if export_format == 'xlsx':
+        write_xlsx(tables, output)
+    else:
+        with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name, df in tables.items():
+                buffer = io.BytesIO()
+                write_table(df, export_format, buffer)
+                archive.writestr(f"{REPORT_TABLES[name][1]}.{export_format}", buffer.getvalue())
+    return output.getvalue()
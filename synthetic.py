@@ -0,0 +1,191 @@
+"""
+Générateur d'extractions SAP synthétiques (Backlog, ZMM13, PUOM, Sales UOM, Kits, MRP, Securoc),
+aux colonnes et formats des fichiers réels, pour mesurer et tester le traitement à toute échelle.
+"""
+import numpy as np
+import pandas as pd
+
+# MRP Controller -> Type (fichier MRP)
+MRP_TYPES = {
+    'M10': 'BUY', 'M20': 'MAKE', 'M32': 'BUY', 'M50': 'BUY', 'M60': 'MAKE',
+    'M70': 'BUY', 'M80': 'KIT', 'S01': 'SECUROC', 'S02': 'SECUROC'
+}
+STANDARD_CONTROLLERS = ['M10', 'M20', 'M32', 'M50', 'M60', 'M70']
+STANDARD_WEIGHTS = [0.3, 0.25, 0.05, 0.05, 0.2, 0.15]
+
+def _material_names(start, count):
+    return np.char.add('Y', (start + np.arange(count)).astype(str))
+
+def _format_dates(days, base):
+    """
+    Dates au format texte SAP '%m/%d/%Y' (comme dans les exports)
+    """
+    return (pd.Timestamp(base) + pd.to_timedelta(days, unit='D')).strftime('%m/%d/%Y')
+
+def generate_inputs(n_orders=1000, lines_per_order=4, n_materials=500, kit_share=0.05,
+                    securoc_share=0.1, rw_share=0.3, deliveries_per_material=3,
+                    blocked_share=0.05, vendor_po_share=0.1, completed_share=0.05,
+                    fractional_share=0.0, start_date='2024-01-01', seed=0):
+    """
+    Construit les sept fichiers d'entrée de process_backlog_data.
+    - n_orders commandes de lines_per_order lignes en moyenne (plus les composants des kits commandés)
+    - n_materials matériels, dont kit_share de kits (M80) et securoc_share de produits SECUROC
+    - rw_share des commandes ont un numéro 'RW........', les autres un numéro numérique
+    - deliveries_per_material livraisons fournisseurs (ZMM13) en moyenne par matériel non kit
+    - fractional_share des matériels ont des quantités décimales (dixièmes) : commandées, livrées,
+      en stock et en commande fournisseur
+    Retourne un dict {nom du fichier: DataFrame} avec les clés attendues par l'application
+    ('Backlog', 'Sales UOM', 'Orders', 'PUOM', 'Kits', 'MRP', 'Securoc').
+    """
+    rng = np.random.default_rng(seed)
+
+    # Matériels : kits, produits SECUROC et matériels standard
+    n_kits = max(1, int(n_materials * kit_share))
+    n_securoc = max(1, int(n_materials * securoc_share))
+    n_standard = max(1, n_materials - n_kits - n_securoc)
+    standard = _material_names(5000000, n_standard)
+    securoc = _material_names(6000000, n_securoc)
+    kits = _material_names(7000000, n_kits)
+    materials = np.concatenate([standard, securoc, kits])
+    controllers = np.concatenate([
+        rng.choice(STANDARD_CONTROLLERS, size=n_standard, p=STANDARD_WEIGHTS),
+        rng.choice(['S01', 'S02'], size=n_securoc),
+        np.full(n_kits, 'M80')
+    ])
+    controller_of = dict(zip(materials, controllers))
+    on_hand = rng.integers(0, 40, size=len(materials)).astype(float)
+
+    # Nomenclature des kits : 1 à 4 composants standard par kit
+    component_counts = rng.integers(1, 5, size=n_kits)
+    kit_headers = np.repeat(kits, component_counts)
+    kit_components = standard[rng.integers(0, n_standard, size=len(kit_headers))]
+    kit_bom = pd.DataFrame({
+        'Header': kit_headers,
+        'Header MRP Controller': 'M80',
+        'Component': kit_components
+    }).drop_duplicates(['Header', 'Component'])
+
+    # Commandes : numéro, date de création et blocage d'en-tête
+    rw = rng.random(n_orders) < rw_share
+    documents = (3000000 + np.arange(n_orders)).astype(object)
+    if rw.any():
+        rw_numbers = np.char.zfill(rng.integers(0, 10**8, size=rw.sum()).astype(str), 8)
+        documents[rw] = np.char.add('RW', rw_numbers)
+    created_days = rng.integers(0, 120, size=n_orders)
+    header_block = np.where(rng.random(n_orders) < blocked_share, 'Block', 'No Block')
+
+    # Lignes : matériels tirés au hasard, puis composants ajoutés pour chaque kit commandé
+    lines = 1 + rng.poisson(max(lines_per_order - 1, 0), size=n_orders)
+    order_of_line = np.repeat(np.arange(n_orders), lines)
+    line_materials = materials[rng.integers(0, len(materials), size=len(order_of_line))]
+
+    bom_by_kit = kit_bom.groupby('Header')['Component'].apply(np.array)
+    kit_lines = np.flatnonzero(np.isin(line_materials, kits))
+    if len(kit_lines):
+        components_per_line = bom_by_kit.reindex(line_materials[kit_lines])
+        counts = components_per_line.map(len).to_numpy()
+        component_orders = np.repeat(order_of_line[kit_lines], counts)
+        component_materials = np.concatenate(components_per_line.to_list())
+        order_of_line = np.concatenate([order_of_line, component_orders])
+        line_materials = np.concatenate([line_materials, component_materials])
+        grouped = np.argsort(order_of_line, kind='stable')
+        order_of_line, line_materials = order_of_line[grouped], line_materials[grouped]
+
+    n_lines = len(order_of_line)
+    quantity = rng.integers(1, 10, size=n_lines).astype(float)
+    completed = rng.random(n_lines) < completed_share
+    line_controllers = pd.Series(line_materials).map(controller_of).to_numpy()
+
+    # Commandes fournisseurs (ZMM13) : livraisons des matériels non kits
+    supplied = np.concatenate([standard, securoc])
+    delivery_counts = rng.poisson(deliveries_per_material, size=len(supplied))
+    delivery_materials = np.repeat(supplied, delivery_counts)
+    n_deliveries = len(delivery_materials)
+    purchasing_documents = 4500000000 + rng.integers(0, max(1, n_deliveries // 3), size=n_deliveries)
+    orders = pd.DataFrame({
+        'Purchasing Document': purchasing_documents,
+        'Delivery date': _format_dates(rng.integers(0, 240, size=n_deliveries), start_date),
+        'Material': delivery_materials,
+        'Order Unit': 'PC',
+        'Sch Opn Qty': rng.integers(1, 30, size=n_deliveries).astype(float)
+    })
+
+    # Vendor PO : une partie des lignes pointe une commande fournisseur (existante ou non)
+    vendor_po = np.full(n_lines, '-', dtype=object)
+    with_po = np.flatnonzero(rng.random(n_lines) < vendor_po_share)
+    if n_deliveries:
+        vendor_po[with_po] = purchasing_documents[rng.integers(0, n_deliveries, size=len(with_po))]
+
+    backlog = pd.DataFrame({
+        'Created on': _format_dates(created_days[order_of_line], start_date),
+        'Sales Document': documents[order_of_line],
+        'Requested Delivery Date': pd.Timestamp(start_date) + pd.to_timedelta(created_days[order_of_line] + 30, unit='D'),
+        'Sales UOM': rng.choice(['EA', 'PC', 'pak', 'BOX'], size=n_lines, p=[0.3, 0.5, 0.05, 0.15]),
+        'Base UOM': rng.choice(['EA', 'PC'], size=n_lines, p=[0.2, 0.8]),
+        'Header Delivery Block': header_block[order_of_line],
+        'Line Delivery Block': np.where(rng.random(n_lines) < blocked_share / 2, 'Block', 'No Block'),
+        'Y Material': line_materials,
+        'MRP Controller': line_controllers,
+        'MRP Group': 'G1',
+        'Vendor PO #': vendor_po,
+        'Open Value': np.round(rng.uniform(10, 5000, size=n_lines), 2),
+        'Open Order Quantity': quantity,
+        'On Hand Qty': on_hand[pd.Index(materials).get_indexer(line_materials)],
+        'Delivery Qty - Complete': np.where(completed, quantity, 0.0),
+        'ATP QTY': quantity,
+        'DropShip': 'N'
+    })
+    # La première ligne de l'export n'est pas une ligne de backlog (elle est ignorée par le traitement)
+    backlog = pd.concat([backlog.iloc[:1], backlog], ignore_index=True)
+
+    sales_materials = materials[rng.random(len(materials)) < 0.3]
+    sales_uom = pd.DataFrame({
+        'Étiquettes de lignes': sales_materials,
+        'Alternative Unit of Measure': 'BOX',
+        'Counter': rng.integers(1, 6, size=len(sales_materials)).astype(float)
+    })
+
+    puom_materials = supplied[rng.random(len(supplied)) < 0.25]
+    puom = pd.DataFrame({
+        'Material': puom_materials,
+        'Order Unit': 'PC',
+        'PUOM': rng.integers(1, 4, size=len(puom_materials)).astype(float),
+        'Base UOM': 'PC'
+    })
+
+    mrp = pd.DataFrame({'MRP Controller': list(MRP_TYPES), 'Type': list(MRP_TYPES.values())})
+
+    # Securoc : deux tiers des produits SECUROC attendent 1 ou 2 composants
+    blocked_products = securoc[rng.random(n_securoc) < 2 / 3]
+    blocking_counts = rng.integers(1, 3, size=len(blocked_products))
+    securoc_df = pd.DataFrame({
+        'Material': standard[rng.integers(0, min(n_standard, 50), size=blocking_counts.sum())],
+        'Pegged reqmt': np.repeat(blocked_products, blocking_counts)
+    })
+
+    # Matériels à quantités décimales : tirés après tout le reste, les autres paramètres donnent le même jeu
+    if fractional_share:
+        fractional = materials[rng.random(len(materials)) < fractional_share]
+        lines_in_tenths = backlog['Y Material'].isin(fractional).to_numpy()
+        for column in ['Open Order Quantity', 'On Hand Qty', 'Delivery Qty - Complete', 'ATP QTY']:
+            backlog.loc[lines_in_tenths, column] = backlog.loc[lines_in_tenths, column] / 10
+        deliveries_in_tenths = orders['Material'].isin(fractional).to_numpy()
+        orders.loc[deliveries_in_tenths, 'Sch Opn Qty'] = orders.loc[deliveries_in_tenths, 'Sch Opn Qty'] / 10
+
+    return {
+        'Backlog': backlog,
+        'Sales UOM': sales_uom,
+        'Orders': orders,
+        'PUOM': puom,
+        'Kits': kit_bom.reset_index(drop=True),
+        'MRP': mrp,
+        'Securoc': securoc_df
+    }
+
+def generate_backlog_lines(n_lines, lines_per_order=4, **options):
+    """
+    Jeu d'entrées d'environ n_lines lignes de backlog ; le nombre de matériels suit la taille du backlog
+    """
+    n_orders = max(1, int(n_lines / (lines_per_order * (1 + options.get('kit_share', 0.05) * 2.5))))
+    options.setdefault('n_materials', max(100, n_lines // 20))
+    return generate_inputs(n_orders=n_orders, lines_per_order=lines_per_order, **options)
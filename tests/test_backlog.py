@@ -0,0 +1,57 @@
+"""
+Allocations comparées au parcours ligne par ligne : stock On Hand (allocate_on_hand_stock)
+et livraisons fournisseurs (_fit_demands)
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import backlog
+
+@pytest.mark.parametrize('on_hand, n_lines', [(1.0, 10), (0.7, 7)])
+def test_on_hand_allocation_fractional_quantities(on_hand, n_lines):
+    # Stock épuisé exactement par des lignes de 0.1 : la dernière ligne reste Dispo
+    rows = pd.DataFrame({
+        'Y Material': 'Y5000000',
+        'On Hand Qty': on_hand,
+        'Created on': pd.Timestamp('2024-01-01'),
+        'Sort_Order': np.arange(1, n_lines + 1),
+        'Qte_sales': np.full(n_lines, 0.1)
+    })
+    result = backlog.allocate_on_hand_stock(rows)
+    available, remaining = backlog._allocate_sequentially(on_hand, rows['Qte_sales'].to_numpy())
+    np.testing.assert_array_equal(result['Stock_Status'], np.where(available, 'Dispo', 'No dispo'))
+    np.testing.assert_array_equal(result['Remaining_Quantity'], remaining)
+    assert result['Stock_Status'].iloc[-1] == 'Dispo'
+
+def fit_demands_sequentially(codes, needed, capacity):
+    capacity = capacity.copy()
+    served = np.zeros(len(needed), dtype=bool)
+    for position, (code, quantity) in enumerate(zip(codes, needed)):
+        if quantity <= capacity[code]:
+            served[position] = True
+            capacity[code] -= quantity
+    return served
+
+@pytest.mark.parametrize('max_rounds', [1, backlog.MAX_FIT_ROUNDS])
+def test_fit_demands_matches_sequential(monkeypatch, max_rounds):
+    monkeypatch.setattr(backlog, 'MAX_FIT_ROUNDS', max_rounds)
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        n_materials = rng.integers(1, 6)
+        codes = np.sort(rng.integers(0, n_materials, rng.integers(1, 200)))
+        needed = rng.integers(0, 30, len(codes)).astype(float)
+        capacity = rng.integers(0, 200, n_materials).astype(float)
+        np.testing.assert_array_equal(backlog._fit_demands(codes, needed, capacity),
+                                      fit_demands_sequentially(codes, needed, capacity))
+
+def test_fit_demands_alternating_rejections():
+    # Un besoin refusé sur deux : un tour vectorisé par refus sans la limite MAX_FIT_ROUNDS
+    n_pairs = 20000
+    needed = np.empty(2 * n_pairs)
+    needed[0::2] = 2
+    needed[1::2] = 10**6 - 2 * np.arange(n_pairs) - 1
+    codes = np.zeros(len(needed), dtype=int)
+    capacity = np.array([10.0**6])
+    np.testing.assert_array_equal(backlog._fit_demands(codes, needed, capacity),
+                                  fit_demands_sequentially(codes, needed, capacity))